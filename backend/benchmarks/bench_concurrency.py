@@ -0,0 +1,73 @@
+"""동시 질의 벤치마크: 실행 중인 서버의 /documents/query에 동시에 질의를 보내 처리량과 지연 시간을 측정한다.
+
+워커 하나(uvicorn --workers 1)로 실행한 서버에 동시 요청 수를 늘려가며
+초당 처리한 질의 수와 p50/p95 지연 시간, 실패한 요청 수를 출력한다.
+질의 경로가 이벤트 루프를 막지 않으면 처리량은 동시 요청 수에 비례해 늘고 지연 시간은 거의 그대로이다.
+답변 캐시에 걸리지 않도록 질의마다 번호를 붙인다.
+
+실행 (backend 디렉터리에서, 서버 실행 후):
+    python -m benchmarks.bench_concurrency --token <access token> --concurrency 1 50 200 --requests 400
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+
+def percentile(values: list, ratio: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * ratio))]
+
+
+async def send_query(client, url: str, headers: dict, query: str, semaphore, latencies: list, failures: list):
+    async with semaphore:
+        start = time.perf_counter()
+        try:
+            response = await client.post(url, data={"query": query}, headers=headers)
+            response.raise_for_status()
+            latencies.append((time.perf_counter() - start) * 1000)
+        except Exception as e:
+            failures.append(str(e))
+
+
+async def run(url: str, token: str, query: str, concurrency: int, requests: int):
+    import httpx
+
+    headers = {"Authorization": f"Bearer {token}"}
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, failures = [], []
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(timeout=300, limits=limits) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*[
+            send_query(client, url, headers, f"{query} ({concurrency}-{i})", semaphore, latencies, failures)
+            for i in range(requests)
+        ])
+        elapsed = time.perf_counter() - start
+
+    if not latencies:
+        print(f"동시 요청 {concurrency:>4}: 모든 요청 실패 ({failures[0] if failures else ''})")
+        return
+    print(
+        f"동시 요청 {concurrency:>4}: {len(latencies) / elapsed:.1f} 질의/초, "
+        f"p50 {statistics.median(latencies):.0f}ms, p95 {percentile(latencies, 0.95):.0f}ms, 실패 {len(failures)}"
+    )
+
+
+def main(base_url: str, token: str, query: str, concurrencies: list, requests: int):
+    url = base_url.rstrip("/") + "/fast_api/documents/query"
+    for concurrency in concurrencies:
+        asyncio.run(run(url, token, query, concurrency, requests))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="동시 질의 벤치마크")
+    parser.add_argument("--url", default="http://localhost:8000", help="서버 주소")
+    parser.add_argument("--token", required=True, help="질의할 사용자의 access token")
+    parser.add_argument("--query", default="연차 휴가는 며칠인가요?", help="질의 (요청마다 번호를 붙인다)")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 50, 200], help="동시 요청 수")
+    parser.add_argument("--requests", type=int, default=400, help="동시 요청 수마다 보낼 요청 수")
+    args = parser.parse_args()
+
+    main(args.url, args.token, args.query, args.concurrency, args.requests)
@@ -0,0 +1,106 @@
+"""임베딩 저장 방식 벤치마크: float32(vector) vs halfvec, halfvec + float32 재채점.
+
+저장된 청크 임베딩 일부를 질의로 사용해 정확한 전체 탐색 결과 대비 recall@k와 p50/p95 지연 시간을 비교하고,
+테이블과 인덱스 크기를 출력한다. 먼저 `python -m db.migrations halfvec`으로 embedding_half 컬럼을 채워야 한다.
+
+실행 (backend 디렉터리에서):
+    python -m benchmarks.bench_halfvec --queries 50 --k 20
+"""
+
+import argparse
+import statistics
+import time
+
+from sqlalchemy import text
+
+
+def sample_query_embeddings(connection, count: int) -> list:
+    """저장된 청크 임베딩 중 count개를 질의 임베딩으로 사용"""
+    rows = connection.execute(text("""
+        SELECT embedding FROM document_chunks
+        WHERE embedding IS NOT NULL
+        ORDER BY random()
+        LIMIT :count
+    """), {"count": count})
+    return [row.embedding for row in rows]
+
+
+def exact_top_k(connection, query_embedding, k: int) -> set:
+    """인덱스를 사용하지 않는 float32 전체 탐색 결과(정답)"""
+    from rag.retriever import to_query_vector
+
+    with connection.begin():
+        connection.execute(text("SET LOCAL enable_indexscan = off"))
+        rows = connection.execute(text("""
+            SELECT id FROM document_chunks
+            WHERE embedding IS NOT NULL
+            ORDER BY embedding <=> CAST(:query_embedding AS vector)
+            LIMIT :k
+        """), {"query_embedding": to_query_vector(query_embedding), "k": k})
+        return {row.id for row in rows}
+
+
+def measure(connection, name, queries, expected, k, **options):
+    """options(build_similarity_query 인자)로 검색했을 때의 recall@k와 지연 시간을 출력"""
+    from rag.retriever import build_similarity_query, execute_similarity_query
+
+    latencies = []
+    recalls = []
+    for query_embedding, expected_ids in zip(queries, expected):
+        similarity_query, params = build_similarity_query(query_embedding, k, **options)
+        start = time.perf_counter()
+        with connection.begin():
+            ids = {row.id for row in execute_similarity_query(connection, similarity_query, params)}
+        latencies.append(time.perf_counter() - start)
+        recalls.append(len(ids & expected_ids) / len(expected_ids) if expected_ids else 1.0)
+
+    latencies.sort()
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    print(
+        f"{name:>16}: recall@{k} {statistics.mean(recalls):.3f}, "
+        f"p50 {statistics.median(latencies) * 1000:.1f}ms, p95 {p95 * 1000:.1f}ms"
+    )
+
+
+def print_sizes(connection):
+    """document_chunks 테이블과 임베딩 인덱스 크기를 출력"""
+    table_size = connection.execute(text(
+        "SELECT pg_size_pretty(pg_total_relation_size('document_chunks'))"
+    )).scalar()
+    print(f"document_chunks 전체 크기: {table_size}")
+    rows = connection.execute(text("""
+        SELECT indexname, pg_size_pretty(pg_relation_size(quote_ident(indexname)::regclass)) AS size
+        FROM pg_indexes
+        WHERE tablename = 'document_chunks' AND indexdef ILIKE '%embedding%'
+    """))
+    for row in rows:
+        print(f"  인덱스 {row.indexname}: {row.size}")
+
+
+def main(query_count: int, k: int):
+    from db.database import engine
+
+    with engine.connect() as connection:
+        queries = sample_query_embeddings(connection, query_count)
+        connection.commit()
+        if not queries:
+            print("임베딩이 저장된 청크가 없습니다.")
+            return
+        expected = [exact_top_k(connection, query, k) for query in queries]
+
+        measure(connection, "vector", queries, expected, k, storage="full", shortlist="none")
+        measure(connection, "halfvec", queries, expected, k, storage="halfvec", keep_full_precision=False)
+        measure(
+            connection, "halfvec+rescore", queries, expected, k,
+            storage="halfvec", keep_full_precision=True, shortlist="halfvec"
+        )
+        print_sizes(connection)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="임베딩 저장 방식 벤치마크")
+    parser.add_argument("--queries", type=int, default=50, help="질의 수")
+    parser.add_argument("--k", type=int, default=20, help="검색 결과 수")
+    args = parser.parse_args()
+
+    main(args.queries, args.k)
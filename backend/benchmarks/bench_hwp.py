@@ -0,0 +1,89 @@
+"""HWP 텍스트 추출 벤치마크: 문서마다 hwp5txt 실행 vs 프로세스 풀에서 pyhwp로 직접 추출.
+
+문서당 지연 시간(순차 실행)과 처리량(동시 실행)을 비교하고, 두 방식의 페이지 분할 결과가 같은지 확인한다.
+
+실행 (backend 디렉터리에서):
+    python -m benchmarks.bench_hwp sample1.hwp sample2.hwp --repeat 5 --concurrency 4
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+
+async def extract_with_hwp5txt(file_content: bytes) -> list:
+    from rag.file_load import collect_pages, iter_hwp5txt_pages
+    return await collect_pages(iter_hwp5txt_pages(file_content, "hwp"))
+
+
+async def extract_in_process(file_content: bytes) -> list:
+    from rag.file_load import collect_pages, iter_hwp_pages
+    return await collect_pages(iter_hwp_pages(file_content, "hwp"))
+
+
+async def measure(name, extract, file_contents, repeat, concurrency):
+    """순차 실행 지연 시간과 동시 실행 처리량을 출력하고, 파일별 마지막 추출 결과를 반환"""
+    latencies = []
+    results = []
+    for file_content in file_contents:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            pages = await extract(file_content)
+            latencies.append(time.perf_counter() - start)
+        results.append(pages)
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_one(file_content):
+        async with semaphore:
+            await extract(file_content)
+
+    jobs = [file_content for file_content in file_contents for _ in range(repeat)]
+    start = time.perf_counter()
+    await asyncio.gather(*[run_one(file_content) for file_content in jobs])
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    print(
+        f"{name:>10}: 평균 {statistics.mean(latencies) * 1000:.1f}ms, "
+        f"p50 {statistics.median(latencies) * 1000:.1f}ms, p95 {p95 * 1000:.1f}ms, "
+        f"처리량 {len(jobs) / elapsed:.2f} 문서/초 (동시 {concurrency}개)"
+    )
+    return results
+
+
+async def main(paths, repeat, concurrency):
+    from rag.file_load import get_parser_pool
+
+    file_contents = []
+    for path in paths:
+        with open(path, "rb") as f:
+            file_contents.append(f.read())
+
+    # 프로세스 풀 워커 시작 비용은 측정에서 제외한다. (앱에서는 풀이 계속 살아 있다)
+    if get_parser_pool() is not None:
+        await asyncio.gather(*[extract_in_process(file_contents[0]) for _ in range(concurrency)])
+
+    subprocess_results = await measure("hwp5txt", extract_with_hwp5txt, file_contents, repeat, concurrency)
+    in_process_results = await measure("pyhwp", extract_in_process, file_contents, repeat, concurrency)
+
+    for path, expected, actual in zip(paths, subprocess_results, in_process_results):
+        status = "같음" if expected == actual else f"다름 (hwp5txt {len(expected)}페이지, pyhwp {len(actual)}페이지)"
+        print(f"{path}: 페이지 분할 결과 {status}")
+
+
+if __name__ == "__main__":
+    from rag.file_load import shutdown_parser_pool
+
+    parser = argparse.ArgumentParser(description="HWP 텍스트 추출 벤치마크")
+    parser.add_argument("paths", nargs="+", help="HWP 파일 경로")
+    parser.add_argument("--repeat", type=int, default=3, help="파일마다 반복 횟수")
+    parser.add_argument("--concurrency", type=int, default=4, help="처리량 측정 시 동시 실행 수")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(main(args.paths, args.repeat, args.concurrency))
+    finally:
+        shutdown_parser_pool()
@@ -0,0 +1,77 @@
+"""로컬 벡터 인덱스 벤치마크: 사용자 범위 pgvector 검색 vs 프로세스 내 로컬 인덱스(rag.local_index) 전체 탐색.
+
+청크가 가장 많은/적은 사용자들의 청크 임베딩 일부를 질의로 사용해, 그 사용자 청크 전체 탐색 결과 대비
+recall@k와 p50/p95 지연 시간을 출력한다. 로컬 인덱스는 처음 만들 때(DB에서 임베딩을 가져와 스냅샷 저장)와
+스냅샷에서 다시 읽을 때의 시간도 출력한다. 청크 수가 LOCAL_INDEX_MAX_CHUNKS를 넘는 사용자는 pgvector만 측정한다.
+
+실행 (backend 디렉터리에서):
+    LOCAL_INDEX_ENABLED=true python -m benchmarks.bench_local_index --owners 3 --queries 30 --k 20
+"""
+
+import argparse
+import shutil
+import statistics
+import time
+
+from benchmarks.bench_scoped import get_owners, sample_owner_queries, exact_owner_top_k, measure
+
+
+def measure_local(name, index, queries, expected, k):
+    """로컬 인덱스로 검색했을 때의 recall@k와 지연 시간을 출력"""
+    from rag.local_index import search_local_index
+
+    latencies = []
+    recalls = []
+    for query_embedding, expected_ids in zip(queries, expected):
+        start = time.perf_counter()
+        ids = set(search_local_index(index, query_embedding, k)["ids"])
+        latencies.append(time.perf_counter() - start)
+        recalls.append(len(ids & expected_ids) / len(expected_ids) if expected_ids else 1.0)
+
+    latencies.sort()
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    print(
+        f"{name:>24}: recall@{k} {statistics.mean(recalls):.3f}, "
+        f"p50 {statistics.median(latencies) * 1000:.2f}ms, p95 {p95 * 1000:.2f}ms"
+    )
+
+
+def main(owner_count: int, query_count: int, k: int):
+    from db.database import engine
+    import rag.local_index as local_index
+
+    with engine.connect() as connection:
+        owners = get_owners(connection, owner_count)
+        connection.commit()
+        if not owners:
+            print("owner_id가 저장된 청크가 없습니다. 먼저 마이그레이션을 실행하세요.")
+            return
+
+        for owner_id, chunks in owners:
+            queries = sample_owner_queries(connection, owner_id, query_count)
+            connection.commit()
+            expected = [exact_owner_top_k(connection, owner_id, query, k) for query in queries]
+            print(f"사용자 {owner_id} (청크 {chunks}개)")
+            measure(connection, "pgvector 범위 검색", queries, expected, k, owner_id=owner_id)
+
+            # 스냅샷 없이 DB에서 만들 때와 스냅샷에서 다시 읽을 때
+            shutil.rmtree(local_index.get_snapshot_dir(owner_id), ignore_errors=True)
+            for name in ("로컬 인덱스 생성", "스냅샷에서 로드"):
+                local_index._indexes.pop(owner_id, None)
+                start = time.perf_counter()
+                index = local_index.get_local_index(owner_id)
+                print(f"{name:>24}: {(time.perf_counter() - start) * 1000:.0f}ms")
+            if index is None:
+                print(f"{'':>24}  로컬 인덱스를 사용하지 않습니다. (LOCAL_INDEX_ENABLED 또는 LOCAL_INDEX_MAX_CHUNKS 확인)")
+                continue
+            measure_local("로컬 인덱스 검색", index, queries, expected, k)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="로컬 벡터 인덱스 벤치마크")
+    parser.add_argument("--owners", type=int, default=3, help="청크가 많은/적은 쪽에서 각각 고를 사용자 수")
+    parser.add_argument("--queries", type=int, default=30, help="사용자마다 사용할 질의 수")
+    parser.add_argument("--k", type=int, default=20, help="검색 결과 수")
+    args = parser.parse_args()
+
+    main(args.owners, args.queries, args.k)
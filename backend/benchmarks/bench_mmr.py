@@ -0,0 +1,80 @@
+"""MMR 선택 벤치마크: 행렬 연산 MMR(rag.retriever.select_mmr) vs 이전 방식의 이중 루프 MMR.
+
+DB 없이 무작위 임베딩 행렬로 후보 수(fetch_k)별 선택 시간을 측정한다.
+
+실행 (backend 디렉터리에서):
+    python -m benchmarks.bench_mmr --fetch-k 20 100 1000 5000 --k 3 10 --dimension 1536
+"""
+
+import argparse
+import statistics
+import time
+
+import numpy as np
+
+
+def loop_mmr(similarities, embeddings, k, lambda_mult):
+    """이전 do_mmr과 같은 방식: 후보와 선택된 문서 쌍마다 노름과 내적을 계산"""
+    remaining = sorted(range(len(similarities)), key=lambda i: similarities[i], reverse=True)
+    selected = []
+    while len(selected) < k and remaining:
+        mmr_scores = {}
+        for i in remaining:
+            max_sim_with_selected = 0
+            for j in selected:
+                doc_norm = np.linalg.norm(embeddings[i])
+                selected_norm = np.linalg.norm(embeddings[j])
+                sim = np.dot(embeddings[i], embeddings[j]) / (doc_norm * selected_norm)
+                max_sim_with_selected = max(max_sim_with_selected, sim)
+            mmr_scores[i] = lambda_mult * similarities[i] - (1 - lambda_mult) * max_sim_with_selected
+        selected_idx = max(mmr_scores, key=mmr_scores.get)
+        selected.append(selected_idx)
+        remaining.remove(selected_idx)
+    return selected
+
+
+def make_candidates(fetch_k: int, dimension: int, seed: int = 0):
+    """질의와 비슷한 정도가 다른 무작위 후보 (유사도 내림차순)"""
+    rng = np.random.default_rng(seed)
+    query = rng.standard_normal(dimension).astype(np.float32)
+    embeddings = (rng.standard_normal((fetch_k, dimension)) + query * rng.uniform(0, 2, (fetch_k, 1))).astype(np.float32)
+    similarities = embeddings @ query / (np.linalg.norm(embeddings, axis=1) * np.linalg.norm(query))
+    order = np.argsort(-similarities)
+    return similarities[order].astype(np.float32), np.ascontiguousarray(embeddings[order])
+
+
+def measure(select, similarities, embeddings, k, lambda_mult, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        selected = select(similarities, embeddings, k, lambda_mult)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000, selected
+
+
+def main(fetch_ks, ks, dimension, lambda_mult, repeat, loop_limit):
+    from rag.retriever import select_mmr
+
+    for fetch_k in fetch_ks:
+        similarities, embeddings = make_candidates(fetch_k, dimension)
+        for k in ks:
+            vectorized_ms, selected = measure(select_mmr, similarities, embeddings, k, lambda_mult, repeat)
+            line = f"fetch_k {fetch_k:>5}, k {k:>3}: 행렬 연산 {vectorized_ms:.3f}ms"
+            if fetch_k <= loop_limit:
+                loop_ms, expected = measure(loop_mmr, similarities, embeddings, k, lambda_mult, 1)
+                status = "같음" if expected == selected else "다름"
+                line += f", 이중 루프 {loop_ms:.3f}ms ({loop_ms / vectorized_ms:.0f}배), 선택 결과 {status}"
+            print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="MMR 선택 벤치마크")
+    parser.add_argument("--fetch-k", type=int, nargs="+", default=[20, 100, 1000, 5000], help="후보 수")
+    parser.add_argument("--k", type=int, nargs="+", default=[3, 10], help="선택할 문서 수")
+    parser.add_argument("--dimension", type=int, default=1536, help="임베딩 차원")
+    parser.add_argument("--lambda-mult", type=float, default=0.5, help="MMR 관련성 가중치")
+    parser.add_argument("--repeat", type=int, default=20, help="반복 횟수 (중앙값 사용)")
+    parser.add_argument("--loop-limit", type=int, default=1000, help="이중 루프 방식을 측정할 최대 후보 수")
+    args = parser.parse_args()
+
+    main(args.fetch_k, args.k, args.dimension, args.lambda_mult, args.repeat, args.loop_limit)
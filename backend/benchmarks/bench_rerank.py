@@ -0,0 +1,110 @@
+"""재순위 벤치마크: 현재 파이프라인(벡터 검색 -> MMR) vs cross-encoder 재순위(벡터 검색 -> 재순위 -> MMR).
+
+평가용 질의 파일(JSONL, 한 줄에 {"query": "...", "document_name": "정답 문서 이름"})의 질의마다
+MMR이 고른 k개 청크에 정답 문서가 포함되는지(hit@k)와 첫 정답 청크의 순위(MRR)를 계산하고,
+검색/재순위 단계의 p50/p95 지연 시간과 제한 시간(RERANK_TIMEOUT_MS)을 넘은 질의 수를 출력한다.
+재순위 품질은 제한 시간 없이 측정한다.
+
+실행 (backend 디렉터리에서, sentence-transformers 설치 필요):
+    python -m benchmarks.bench_rerank queries.jsonl --owner 1 --fetch-k 20 50 --k 3
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+
+def load_queries(path: str) -> list:
+    """평가용 질의 파일을 읽는다."""
+    with open(path, encoding="utf-8") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def percentile(values: list, ratio: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * ratio))]
+
+
+def reciprocal_rank(docs: list, document_name: str) -> float:
+    """정답 문서의 첫 청크 순위의 역수 (없으면 0)"""
+    for rank, doc in enumerate(docs, start=1):
+        if doc.metadata.get("document_name") == document_name:
+            return 1 / rank
+    return 0.0
+
+
+def print_result(name: str, k: int, ranks: list, latencies: list):
+    hits = sum(1 for rank in ranks if rank > 0)
+    print(
+        f"{name:>20}: hit@{k} {hits / len(ranks):.3f}, MRR {statistics.mean(ranks):.3f}, "
+        f"p50 {statistics.median(latencies):.1f}ms, p95 {percentile(latencies, 0.95):.1f}ms"
+    )
+
+
+async def main(path: str, owner_id: int, fetch_ks: list, k: int, lambda_mult: float):
+    from db.database import get_async_engine
+    from config.settings import RERANK_TIMEOUT_MS, RERANK_BATCH_SIZE
+    from rag.embeddings import aembed_query
+    from rag.retriever import asearch_similarity, ado_mmr, aload_chunk_documents
+    from rag.reranker import get_reranker, ascore_with_budget
+
+    queries = load_queries(path)
+    if not queries:
+        print("평가용 질의가 없습니다.")
+        return
+    # 모델 로딩 시간은 측정에서 제외한다.
+    get_reranker()
+    engine = get_async_engine()
+
+    for fetch_k in fetch_ks:
+        print(f"fetch_k {fetch_k}, k {k}")
+        baseline_ranks, baseline_latencies = [], []
+        rerank_ranks, rerank_latencies = [], []
+        over_budget = 0
+        for item in queries:
+            query_embedding = await aembed_query(item["query"])
+
+            start = time.perf_counter()
+            candidates = await asearch_similarity(query_embedding, engine, fetch_k=fetch_k, owner_id=owner_id, query=item["query"])
+            docs = await ado_mmr(candidates, engine, k, lambda_mult)
+            search_ms = (time.perf_counter() - start) * 1000
+            baseline_latencies.append(search_ms)
+            baseline_ranks.append(reciprocal_rank(docs, item["document_name"]))
+
+            start = time.perf_counter()
+            documents = await aload_chunk_documents(engine, candidates["ids"])
+            scores = await ascore_with_budget(
+                item["query"], [doc.page_content for doc in documents], 60_000, RERANK_BATCH_SIZE
+            )
+            rerank_ms = (time.perf_counter() - start) * 1000
+            over_budget += rerank_ms > RERANK_TIMEOUT_MS
+            # 삭제된 청크가 없을 때만 재순위 결과를 후보와 맞출 수 있다.
+            if len(documents) == len(candidates["ids"]):
+                order = scores.argsort()[::-1]
+                reranked = {
+                    "ids": [candidates["ids"][i] for i in order],
+                    "similarities": scores[order],
+                    "embeddings": candidates["embeddings"][order],
+                    "documents": [documents[i] for i in order],
+                }
+                docs = await ado_mmr(reranked, engine, k, lambda_mult)
+            rerank_latencies.append(search_ms + rerank_ms)
+            rerank_ranks.append(reciprocal_rank(docs, item["document_name"]))
+
+        print_result("벡터 검색 + MMR", k, baseline_ranks, baseline_latencies)
+        print_result("재순위 + MMR", k, rerank_ranks, rerank_latencies)
+        print(f"{'':>20}  재순위 제한 시간({RERANK_TIMEOUT_MS}ms) 초과: {over_budget}/{len(queries)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="재순위 벤치마크")
+    parser.add_argument("queries", help="평가용 질의 JSONL 파일")
+    parser.add_argument("--owner", type=int, default=None, help="검색할 사용자 id (없으면 전체 문서)")
+    parser.add_argument("--fetch-k", type=int, nargs="+", default=[20, 50], help="재순위할 후보 수")
+    parser.add_argument("--k", type=int, default=3, help="MMR로 고를 문서 수")
+    parser.add_argument("--lambda-mult", type=float, default=0.5, help="MMR 관련성 가중치")
+    args = parser.parse_args()
+
+    asyncio.run(main(args.queries, args.owner, args.fetch_k, args.k, args.lambda_mult))
@@ -0,0 +1,105 @@
+"""사용자 범위 검색 벤치마크: 사용자별 청크 수에 따른 범위 검색(owner_id 조건)의 recall@k와 지연 시간.
+
+청크가 가장 많은 사용자와 가장 적은 사용자들의 청크 임베딩 일부를 질의로 사용해,
+그 사용자 청크만 전체 탐색한 결과 대비 recall@k와 p50/p95 지연 시간을 출력한다.
+전체 검색(범위 조건 없음)의 지연 시간도 함께 출력해 비교한다.
+
+실행 (backend 디렉터리에서):
+    python -m benchmarks.bench_scoped --owners 3 --queries 30 --k 20
+"""
+
+import argparse
+import statistics
+import time
+
+from sqlalchemy import text
+
+
+def get_owners(connection, count: int) -> list:
+    """청크가 가장 많은 사용자와 가장 적은 사용자를 (owner_id, 청크 수) 리스트로 반환"""
+    rows = connection.execute(text("""
+        SELECT owner_id, count(*) AS chunks
+        FROM document_chunks
+        WHERE owner_id IS NOT NULL AND embedding IS NOT NULL
+        GROUP BY owner_id
+        ORDER BY chunks DESC
+    """)).all()
+    owners = rows[:count] + rows[-count:]
+    return list(dict.fromkeys((row.owner_id, row.chunks) for row in owners))
+
+
+def sample_owner_queries(connection, owner_id: int, count: int) -> list:
+    """사용자의 청크 임베딩 중 count개를 질의 임베딩으로 사용"""
+    rows = connection.execute(text("""
+        SELECT embedding FROM document_chunks
+        WHERE owner_id = :owner_id AND embedding IS NOT NULL
+        ORDER BY random()
+        LIMIT :count
+    """), {"owner_id": owner_id, "count": count})
+    return [row.embedding for row in rows]
+
+
+def exact_owner_top_k(connection, owner_id: int, query_embedding, k: int) -> set:
+    """벡터 인덱스를 사용하지 않는 사용자 청크 전체 탐색 결과(정답)"""
+    from rag.retriever import to_query_vector
+
+    with connection.begin():
+        connection.execute(text("SET LOCAL enable_indexscan = off"))
+        rows = connection.execute(text("""
+            SELECT id FROM document_chunks
+            WHERE owner_id = :owner_id AND embedding IS NOT NULL
+            ORDER BY embedding <=> CAST(:query_embedding AS vector)
+            LIMIT :k
+        """), {"owner_id": owner_id, "query_embedding": to_query_vector(query_embedding), "k": k})
+        return {row.id for row in rows}
+
+
+def measure(connection, name, queries, expected, k, **options):
+    """options(build_similarity_query 인자)로 검색했을 때의 recall@k와 지연 시간을 출력"""
+    from rag.retriever import build_similarity_query, execute_similarity_query
+
+    latencies = []
+    recalls = []
+    for query_embedding, expected_ids in zip(queries, expected):
+        similarity_query, params = build_similarity_query(query_embedding, k, **options)
+        start = time.perf_counter()
+        with connection.begin():
+            ids = {row.id for row in execute_similarity_query(connection, similarity_query, params)}
+        latencies.append(time.perf_counter() - start)
+        recalls.append(len(ids & expected_ids) / len(expected_ids) if expected_ids else 1.0)
+
+    latencies.sort()
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    print(
+        f"{name:>24}: recall@{k} {statistics.mean(recalls):.3f}, "
+        f"p50 {statistics.median(latencies) * 1000:.1f}ms, p95 {p95 * 1000:.1f}ms"
+    )
+
+
+def main(owner_count: int, query_count: int, k: int):
+    from db.database import engine
+
+    with engine.connect() as connection:
+        owners = get_owners(connection, owner_count)
+        connection.commit()
+        if not owners:
+            print("owner_id가 저장된 청크가 없습니다. 먼저 마이그레이션을 실행하세요.")
+            return
+
+        for owner_id, chunks in owners:
+            queries = sample_owner_queries(connection, owner_id, query_count)
+            connection.commit()
+            expected = [exact_owner_top_k(connection, owner_id, query, k) for query in queries]
+            print(f"사용자 {owner_id} (청크 {chunks}개)")
+            measure(connection, "범위 검색", queries, expected, k, owner_id=owner_id)
+            measure(connection, "전체 검색 (범위 조건 없음)", queries, expected, k)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="사용자 범위 검색 벤치마크")
+    parser.add_argument("--owners", type=int, default=3, help="청크가 많은/적은 쪽에서 각각 고를 사용자 수")
+    parser.add_argument("--queries", type=int, default=30, help="사용자마다 사용할 질의 수")
+    parser.add_argument("--k", type=int, default=20, help="검색 결과 수")
+    args = parser.parse_args()
+
+    main(args.owners, args.queries, args.k)
@@ -0,0 +1,43 @@
+"""2단계 검색 벤치마크: 이진 양자화/앞쪽 차원 후보 검색 + 전체 임베딩 재정렬 vs 정확한 전체 탐색.
+
+후보 수(shortlist_size)별로 recall@k와 p50/p95 지연 시간을 출력한다. 목표는 recall@20 >= 0.95이다.
+먼저 SEARCH_SHORTLIST=binary 또는 prefix로 마이그레이션을 실행해 후보 검색용 인덱스를 만들어야 한다.
+
+실행 (backend 디렉터리에서):
+    python -m benchmarks.bench_shortlist --queries 50 --k 20 --sizes 100 200 400 800
+"""
+
+import argparse
+
+from benchmarks.bench_halfvec import sample_query_embeddings, exact_top_k, measure
+
+
+def main(query_count: int, k: int, sizes: list, shortlists: list):
+    from db.database import engine
+
+    with engine.connect() as connection:
+        queries = sample_query_embeddings(connection, query_count)
+        connection.commit()
+        if not queries:
+            print("임베딩이 저장된 청크가 없습니다.")
+            return
+        expected = [exact_top_k(connection, query, k) for query in queries]
+
+        measure(connection, "exact", queries, expected, k, shortlist="none")
+        for shortlist in shortlists:
+            for size in sizes:
+                measure(
+                    connection, f"{shortlist}@{size}", queries, expected, k,
+                    shortlist=shortlist, shortlist_size=size
+                )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="2단계 검색 벤치마크")
+    parser.add_argument("--queries", type=int, default=50, help="질의 수")
+    parser.add_argument("--k", type=int, default=20, help="검색 결과 수")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 200, 400, 800], help="비교할 후보 수")
+    parser.add_argument("--shortlists", nargs="+", default=["binary", "prefix"], help="비교할 후보 검색 방식")
+    args = parser.parse_args()
+
+    main(args.queries, args.k, args.sizes, args.shortlists)
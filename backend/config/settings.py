@@ -45,17 +45,25 @@ if TEST_MODE:
 # 로컬 Windows 환경에서 사용할 URL
 elif os.name == 'nt':  # Windows 환경
     # Amazon RDS 환경에서 사용할 URL
-    DATABASE_URL = f"postgresql+psycopg2://{RDS_USER}:{RDS_PASSWORD}@{RDS_ENDPOINT}:5432/{RDS_DB_NAME}?client_encoding=utf8"
+    DATABASE_URL = f"postgresql+psycopg://{RDS_USER}:{RDS_PASSWORD}@{RDS_ENDPOINT}:5432/{RDS_DB_NAME}?client_encoding=utf8"
     # 프로그램 종료 시 까지 이 주소를 유지
     os.environ['DATABASE_URL'] = DATABASE_URL
 else:
     # Docker 환경에서 사용할 URL
-    DATABASE_URL = f"postgresql+psycopg2://{RDS_USER}:{RDS_PASSWORD}@{RDS_ENDPOINT}:5432/{RDS_DB_NAME}?client_encoding=utf8"
+    DATABASE_URL = f"postgresql+psycopg://{RDS_USER}:{RDS_PASSWORD}@{RDS_ENDPOINT}:5432/{RDS_DB_NAME}?client_encoding=utf8"
     # Docker 환경 변수 설정
     os.environ['DOCKER_ENV'] = 'true'
 
 print(f"Using database URL: {DATABASE_URL}")
 
+# 같은 연결에서 몇 번째 실행부터 쿼리를 prepare할지 (psycopg prepare_threshold)
+# 검색 쿼리처럼 반복 실행되는 쿼리는 연결마다 한 번만 파싱/계획된다. none이면 사용하지 않는다. (PgBouncer transaction 모드 등)
+DB_PREPARE_THRESHOLD = os.environ.get("DB_PREPARE_THRESHOLD", "1").lower()
+DB_PREPARE_THRESHOLD = None if DB_PREPARE_THRESHOLD == "none" else int(DB_PREPARE_THRESHOLD)
+# 질의 경로(/documents/query)에서 사용하는 비동기 엔진의 연결 풀 크기. 동시 질의가 풀보다 많으면 이벤트 루프를 막지 않고 연결을 기다린다.
+DB_ASYNC_POOL_SIZE = int(os.environ.get("DB_ASYNC_POOL_SIZE", "20"))
+DB_ASYNC_MAX_OVERFLOW = int(os.environ.get("DB_ASYNC_MAX_OVERFLOW", "20"))
+
 
 # 토큰 설정
 # 기본값은 30분이다.
@@ -67,3 +75,156 @@ SECRET_KEY = os.environ.get("SECRET_KEY", "your-secret-key-for-jwt")
 ALGORITHM = "HS256" 
 
 
+
+
+# 임베딩 모델 설정
+# openai: OpenAI 임베딩 API, local: 로컬 CPU 모델 (sentence-transformers 설치 필요), hashing: 테스트/벤치마크용 결정적 임베딩
+EMBEDDING_PROVIDER = os.environ.get("EMBEDDING_PROVIDER", "openai").lower()
+_DEFAULT_EMBEDDING_MODELS = {
+    "openai": ("text-embedding-3-small", "1536"),
+    "local": ("sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2", "384"),
+    "hashing": ("hashing", "1536"),
+}
+_default_model, _default_dimension = _DEFAULT_EMBEDDING_MODELS.get(EMBEDDING_PROVIDER, _DEFAULT_EMBEDDING_MODELS["openai"])
+EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", _default_model)
+# 임베딩 차원. document_chunks.embedding 컬럼의 차원이 이 값을 따르므로 바꾸면 기존 청크를 다시 임베딩해야 한다.
+EMBEDDING_DIMENSION = int(os.environ.get("EMBEDDING_DIMENSION", _default_dimension))
+# 임베딩 저장 방식
+# full: float32 vector 컬럼만 사용, halfvec: 반정밀도(halfvec) 컬럼으로 후보를 찾고 float32 컬럼으로 다시 정렬 (pgvector 0.7 이상)
+EMBEDDING_STORAGE = os.environ.get("EMBEDDING_STORAGE", "full").lower()
+# halfvec 모드에서 float32 임베딩도 저장할지 여부 (false이면 저장 공간을 절반으로 줄이고 halfvec으로만 유사도를 계산)
+EMBEDDING_KEEP_FULL_PRECISION = os.environ.get("EMBEDDING_KEEP_FULL_PRECISION", "true").lower() == "true"
+# halfvec으로 찾을 후보 수 = 최종 검색 수 x EMBEDDING_RESCORE_FACTOR
+EMBEDDING_RESCORE_FACTOR = int(os.environ.get("EMBEDDING_RESCORE_FACTOR", "4"))
+# 2단계 검색의 1단계 후보 검색 방식
+# auto: halfvec 저장 방식이면 halfvec, 아니면 none / none: 전체 임베딩으로 바로 검색
+# binary: 이진 양자화 벡터의 해밍 거리 / prefix: 앞쪽 SEARCH_PREFIX_DIMENSION 차원만 사용 (text-embedding-3 계열)
+SEARCH_SHORTLIST = os.environ.get("SEARCH_SHORTLIST", "auto").lower()
+# binary, prefix 후보 검색에서 전체 임베딩으로 다시 정렬할 후보 수 (질의마다 지정 가능)
+SEARCH_SHORTLIST_SIZE = int(os.environ.get("SEARCH_SHORTLIST_SIZE", "400"))
+# prefix 후보 검색에 사용할 앞쪽 차원 수
+SEARCH_PREFIX_DIMENSION = int(os.environ.get("SEARCH_PREFIX_DIMENSION", "512"))
+# 하이브리드 검색: 벡터 검색 후보와 전문 검색(n-gram tsvector) 후보를 RRF(reciprocal rank fusion)로 합친다.
+# 기존 청크는 전문 검색 색인(content_tsv)이 비어 있으므로 `python -m db.migrations fulltext`로 채운 뒤에 켠다.
+SEARCH_HYBRID = os.environ.get("SEARCH_HYBRID", "false").lower() == "true"
+# RRF 점수 = sum(1 / (SEARCH_RRF_K + 순위)). 클수록 하위 순위 후보의 점수 차이가 줄어든다.
+SEARCH_RRF_K = int(os.environ.get("SEARCH_RRF_K", "60"))
+
+# MMR(Maximal Marginal Relevance) 설정 (질의마다 지정 가능)
+# 유사도 검색으로 가져올 후보 수
+MMR_FETCH_K = int(os.environ.get("MMR_FETCH_K", "20"))
+# 최종 반환 문서 수
+MMR_K = int(os.environ.get("MMR_K", "3"))
+# 관련성과 다양성의 균형 (1이면 관련성만, 0이면 다양성만 고려)
+MMR_LAMBDA = float(os.environ.get("MMR_LAMBDA", "0.5"))
+
+# 재순위(rerank) 설정: MMR 전에 로컬 CPU cross-encoder로 질의/청크 쌍의 관련성을 다시 계산한다. (sentence-transformers 설치 필요)
+# 질의마다 지정 가능하며, 제한 시간을 넘으면 벡터 검색 순서를 그대로 사용한다.
+RERANK_ENABLED = os.environ.get("RERANK_ENABLED", "false").lower() == "true"
+RERANK_MODEL = os.environ.get("RERANK_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
+# 한 번의 추론으로 계산할 질의/청크 쌍의 수
+RERANK_BATCH_SIZE = int(os.environ.get("RERANK_BATCH_SIZE", "8"))
+# 배치를 동시에 추론할 스레드 수
+RERANK_MAX_WORKERS = int(os.environ.get("RERANK_MAX_WORKERS", "2"))
+# 질의/청크 쌍의 최대 토큰 수 (길수록 느리다)
+RERANK_MAX_LENGTH = int(os.environ.get("RERANK_MAX_LENGTH", "512"))
+# 질의 하나의 재순위 제한 시간 (밀리초)
+RERANK_TIMEOUT_MS = int(os.environ.get("RERANK_TIMEOUT_MS", "500"))
+
+# 배치 질의(/documents/query/batch) 설정: 질문들을 한 번에 임베딩하고 한 쿼리로 후보를 가져온다.
+# 한 요청에 보낼 수 있는 최대 질문 수
+QUERY_BATCH_MAX_SIZE = int(os.environ.get("QUERY_BATCH_MAX_SIZE", "20"))
+# 질문별 MMR/재순위/답변 생성을 동시에 실행할 최대 수
+QUERY_BATCH_CONCURRENCY = int(os.environ.get("QUERY_BATCH_CONCURRENCY", "4"))
+
+# 답변 캐시 설정: 질의 임베딩의 코사인 유사도가 임계값 이상이고 문서 집합 버전이 같으면 저장된 답변을 반환한다.
+ANSWER_CACHE_ENABLED = os.environ.get("ANSWER_CACHE_ENABLED", "false").lower() == "true"
+ANSWER_CACHE_SIMILARITY_THRESHOLD = float(os.environ.get("ANSWER_CACHE_SIMILARITY_THRESHOLD", "0.95"))
+# 정규화한 질의 문장(유니코드, 대소문자, 공백 차이 무시)까지 같을 때만 캐시된 답변을 반환할지 여부.
+# false이면 조항 번호나 숫자만 다른 질문("제3조" / "제5조")에도 다른 질문의 답변이 반환될 수 있다.
+ANSWER_CACHE_EXACT_MATCH = os.environ.get("ANSWER_CACHE_EXACT_MATCH", "true").lower() == "true"
+# 답변 캐시 항목의 유효 시간 (초)
+ANSWER_CACHE_TTL = int(os.environ.get("ANSWER_CACHE_TTL", "86400"))
+# 사용자마다 보관할 최대 답변 수
+ANSWER_CACHE_MAX_ENTRIES_PER_USER = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES_PER_USER", "500"))
+
+# 벡터 인덱스 설정 (애플리케이션 시작 시 검색에 사용하는 임베딩 컬럼에 인덱스를 만들고, 설정이 바뀌면 다시 만든다)
+# hnsw / ivfflat / none
+VECTOR_INDEX_TYPE = os.environ.get("VECTOR_INDEX_TYPE", "hnsw").lower()
+# HNSW 그래프의 노드당 연결 수와 생성 시 후보 수 (클수록 recall이 높고 인덱스 생성이 느리다)
+VECTOR_INDEX_M = int(os.environ.get("VECTOR_INDEX_M", "16"))
+VECTOR_INDEX_EF_CONSTRUCTION = int(os.environ.get("VECTOR_INDEX_EF_CONSTRUCTION", "64"))
+# IVFFlat 리스트 수 (권장: 행 수 / 1000)
+VECTOR_INDEX_LISTS = int(os.environ.get("VECTOR_INDEX_LISTS", "100"))
+# 검색 시 세션마다 적용하는 값 (HNSW 탐색 후보 수, IVFFlat 탐색 리스트 수)
+VECTOR_INDEX_EF_SEARCH = int(os.environ.get("VECTOR_INDEX_EF_SEARCH", "40"))
+VECTOR_INDEX_PROBES = int(os.environ.get("VECTOR_INDEX_PROBES", "10"))
+# 사용자/폴더로 검색 범위를 제한할 때의 반복 인덱스 검색 (pgvector 0.8 이상)
+# relaxed_order / strict_order: 조건을 만족하는 행이 모자라면 인덱스를 계속 탐색, off: 사용하지 않음
+# pgvector 0.8 미만이면 시작할 때 경고하고 off로 바꾼다.
+VECTOR_INDEX_ITERATIVE_SCAN = os.environ.get("VECTOR_INDEX_ITERATIVE_SCAN", "relaxed_order").lower()
+# 반복 HNSW 검색에서 탐색할 최대 행 수 (지연 시간 상한)
+VECTOR_INDEX_MAX_SCAN_TUPLES = int(os.environ.get("VECTOR_INDEX_MAX_SCAN_TUPLES", "20000"))
+# 거리 함수: cosine / inner_product (임베딩이 정규화되어 있으면 코사인과 순서가 같고 계산이 더 싸다)
+VECTOR_DISTANCE = os.environ.get("VECTOR_DISTANCE", "cosine").lower()
+
+# 프로세스 내 벡터 인덱스 설정: 청크 수가 적은 사용자는 임베딩 행렬을 로컬 스냅샷 파일에서 메모리 매핑하여
+# pgvector 쿼리 없이 NumPy로 전체 탐색한다. 청크 수가 LOCAL_INDEX_MAX_CHUNKS를 넘으면 pgvector로 검색한다.
+LOCAL_INDEX_ENABLED = os.environ.get("LOCAL_INDEX_ENABLED", "false").lower() == "true"
+# 사용자별 스냅샷 파일을 저장할 디렉터리
+LOCAL_INDEX_DIR = os.environ.get("LOCAL_INDEX_DIR", "./local_index")
+LOCAL_INDEX_MAX_CHUNKS = int(os.environ.get("LOCAL_INDEX_MAX_CHUNKS", "50000"))
+# 다른 프로세스(워커 등)의 문서 변경을 확인하는 간격(초). 문서 집합 버전이 바뀌었으면 바뀐 청크만 다시 가져온다.
+LOCAL_INDEX_SYNC_INTERVAL = float(os.environ.get("LOCAL_INDEX_SYNC_INTERVAL", "5"))
+
+# 임베딩 배치 설정
+# 한 번의 embed_documents 호출로 보낼 청크 수
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", "64"))
+# 동시에 처리할 임베딩 배치 수 (임베딩 API 동시 요청 수 제한)
+EMBEDDING_MAX_CONCURRENCY = int(os.environ.get("EMBEDDING_MAX_CONCURRENCY", "4"))
+
+# 임베딩 캐시 설정
+# (모델 이름, 임베딩 텍스트 해시)를 키로 임베딩을 DB에 저장하여 같은 텍스트를 다시 임베딩하지 않는다.
+EMBEDDING_CACHE_ENABLED = os.environ.get("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+# 캐시에 보관할 최대 임베딩 수. 초과하면 가장 오래 사용되지 않은 항목부터 삭제한다.
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+# 이 횟수만큼 임베딩 배치를 저장할 때마다 캐시 크기를 확인하고 정리한다.
+EMBEDDING_CACHE_EVICT_EVERY = int(os.environ.get("EMBEDDING_CACHE_EVICT_EVERY", "50"))
+# 캐시 적중 항목의 마지막 사용 시각은 모아 두었다가 이 간격(초)마다 한 번에 갱신한다.
+EMBEDDING_CACHE_TOUCH_INTERVAL = float(os.environ.get("EMBEDDING_CACHE_TOUCH_INTERVAL", "300"))
+# 질의 임베딩 캐시 (프로세스 메모리 LRU). 최대 항목 수가 0이면 사용하지 않는다.
+QUERY_EMBEDDING_CACHE_SIZE = int(os.environ.get("QUERY_EMBEDDING_CACHE_SIZE", "1024"))
+# 질의 임베딩 캐시 항목의 유효 시간 (초)
+QUERY_EMBEDDING_CACHE_TTL = float(os.environ.get("QUERY_EMBEDDING_CACHE_TTL", "3600"))
+
+# 문서 수집(ingestion) 작업 큐 설정
+# 작업 큐를 처리할 워커 프로세스 수
+INGESTION_WORKERS = int(os.environ.get("INGESTION_WORKERS", "2"))
+# API 서버 프로세스가 워커 프로세스를 함께 실행할지 여부. 기본값은 별도의 워커 서비스(python worker.py)로 처리하는 것이다.
+# (uvicorn 프로세스마다 워커를 실행하므로 true로 설정하면 uvicorn --workers 1로 실행한다)
+INGESTION_RUN_IN_APP = os.environ.get("INGESTION_RUN_IN_APP", "false").lower() == "true"
+# 작업 하나의 최대 시도 횟수
+INGESTION_MAX_ATTEMPTS = int(os.environ.get("INGESTION_MAX_ATTEMPTS", "3"))
+# 대기 중인 작업이 없을 때 다시 조회하기까지의 시간(초)
+INGESTION_POLL_INTERVAL = float(os.environ.get("INGESTION_POLL_INTERVAL", "2"))
+# 실패한 작업을 다시 시도하기까지의 기본 대기 시간(초). 시도 횟수만큼 곱해진다.
+INGESTION_RETRY_DELAY = int(os.environ.get("INGESTION_RETRY_DELAY", "30"))
+# 처리 중(running) 상태로 이 시간(초) 이상 갱신이 없는 작업은 워커가 중단된 것으로 보고 다시 처리한다.
+INGESTION_STALE_AFTER = int(os.environ.get("INGESTION_STALE_AFTER", "1800"))
+# 처리 중인 작업의 갱신 시각을 이 간격(초)마다 기록한다. (INGESTION_STALE_AFTER보다 충분히 짧아야 한다)
+INGESTION_HEARTBEAT_INTERVAL = float(os.environ.get("INGESTION_HEARTBEAT_INTERVAL", "60"))
+
+# 문서 파싱 설정
+# 워커 프로세스마다 만드는 문서 파싱용 프로세스 풀 크기. 0이면 프로세스 풀 대신 스레드에서 파싱한다.
+# 기본값은 워커 프로세스 전체가 CPU 코어 수만큼의 파싱 프로세스를 나눠 쓰도록 한다.
+PARSER_POOL_SIZE = int(os.environ.get(
+    "PARSER_POOL_SIZE", str(max(1, (os.cpu_count() or 1) // max(1, INGESTION_WORKERS)))
+))
+# 문서 하나의 파싱 제한 시간(초)
+PARSE_TIMEOUT_SECONDS = float(os.environ.get("PARSE_TIMEOUT_SECONDS", "300"))
+# PDF를 여러 프로세스로 나눌 때 작업 하나가 맡는 페이지 수
+PDF_PAGES_PER_TASK = int(os.environ.get("PDF_PAGES_PER_TASK", "10"))
+# HWP 텍스트 추출 방식: auto (pyhwp가 설치되어 있으면 프로세스 풀에서 직접 추출), hwp5txt (문서마다 hwp5txt 실행)
+HWP_EXTRACTOR = os.environ.get("HWP_EXTRACTOR", "auto").lower()
+# 파싱 -> 임베딩 단계 사이의 대기열에 쌓아 둘 수 있는 최대 배치 수 (메모리 사용량 상한)
+INGESTION_QUEUE_SIZE = int(os.environ.get("INGESTION_QUEUE_SIZE", "8"))
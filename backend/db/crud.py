@@ -64,9 +64,38 @@ def create_user(db: Session, username: str, email: str, password_hash: str):
 def get_user_by_id(db: Session, user_id: int):
     return db.query(models.User).filter(models.User.id == user_id).first()
 
+# 사용자 문서 집합의 버전 (답변 캐시 무효화에 사용)
+def get_corpus_version(db: Session, user_id: int) -> int:
+    version = db.query(models.User.corpus_version).filter(models.User.id == user_id).scalar()
+    return version or 0
+
+# get_corpus_version의 비동기 버전 (질의 경로에서 비동기 엔진으로 조회)
+async def aget_corpus_version(engine, user_id: int) -> int:
+    async with engine.connect() as connection:
+        result = await connection.execute(select(models.User.corpus_version).where(models.User.id == user_id))
+        version = result.scalar()
+    return version or 0
+
+def bump_corpus_version(db: Session, user_id: int):
+    """사용자의 문서 집합이 바뀌었음을 기록한다. 이전 버전으로 만든 답변 캐시는 더 이상 사용되지 않는다.
+
+    청크 변경이 commit된 뒤에 호출해야 한다.
+    """
+    from sqlalchemy import update
+    try:
+        db.execute(
+            update(models.User)
+            .where(models.User.id == user_id)
+            .values(corpus_version=func.coalesce(models.User.corpus_version, 0) + 1)
+        )
+        db.commit()
+    except Exception as e:
+        print(f"문서 집합 버전 갱신 오류: {str(e)}")
+        db.rollback()
+
 # DB의 documents 테이블에 문서 정보 저장
-def add_documents(db: Session, filename: str, s3_key: str, upload_time: datetime, user_id: int):
-    db_document = models.Document(filename=filename, s3_key=s3_key, upload_time=upload_time, user_id=user_id)
+def add_documents(db: Session, filename: str, s3_key: str, upload_time: datetime, user_id: int, content_sha256: str = None):
+    db_document = models.Document(filename=filename, s3_key=s3_key, upload_time=upload_time, user_id=user_id, content_sha256=content_sha256)
     db.add(db_document)
     db.commit()
     db.refresh(db_document)
@@ -86,6 +115,81 @@ def add_document_chunk(db: Session, document_id: int, content: str, embedding=No
     db.refresh(db_chunk)
     return db_chunk
 
+def get_embedding_columns(embedding) -> dict:
+    """저장 방식(EMBEDDING_STORAGE)에 따라 청크의 임베딩 컬럼 값을 만든다."""
+    from config.settings import EMBEDDING_STORAGE, EMBEDDING_KEEP_FULL_PRECISION
+    if EMBEDDING_STORAGE != "halfvec":
+        return {"embedding": embedding}
+    return {
+        "embedding": embedding if EMBEDDING_KEEP_FULL_PRECISION else None,
+        "embedding_half": embedding
+    }
+
+# 문서 청크 여러 개를 하나의 트랜잭션으로 저장하는 함수
+def add_document_chunks(db: Session, document_id: int, document_name: str, document_path: str, contents: list, content_hashes: list, embeddings: list, commit: bool = True, owner_id: int = None):
+    """청크 내용과 임베딩 리스트를 받아 한 번의 commit으로 document_chunks 테이블에 저장한다.
+
+    commit이 False이면 flush만 하고 트랜잭션은 호출한 쪽에서 commit한다.
+    """
+    from rag.lexical import to_tsvector_text
+    db_chunks = [
+        models.DocumentChunk(
+            document_id=document_id,
+            document_name=document_name,
+            document_path=document_path,
+            owner_id=owner_id,
+            content=content,
+            content_hash=content_hash,
+            content_tsv=to_tsvector_text(content),
+            **get_embedding_columns(embedding)
+        )
+        for content, content_hash, embedding in zip(contents, content_hashes, embeddings)
+    ]
+    try:
+        db.add_all(db_chunks)
+        if commit:
+            db.commit()
+        else:
+            db.flush()
+    except Exception as e:
+        db.rollback()
+        raise e
+    return db_chunks
+
+def get_legacy_document_chunks(db: Session, limit: int):
+    """이름/경로를 포함한 텍스트로 임베딩된 이전 방식의 청크(content_hash가 NULL)를 limit개 가져온다."""
+    stmt = select(models.DocumentChunk).where(models.DocumentChunk.content_hash.is_(None)).order_by(models.DocumentChunk.id).limit(limit)
+    return db.execute(stmt).scalars().all()
+
+def update_document_chunk_embeddings(db: Session, chunk_ids: list, content_hashes: list, embeddings: list):
+    """청크 id 리스트에 해당하는 청크의 내용 해시와 임베딩을 한 번의 commit으로 업데이트한다."""
+    from sqlalchemy import update
+    try:
+        for chunk_id, content_hash, embedding in zip(chunk_ids, content_hashes, embeddings):
+            db.execute(
+                update(models.DocumentChunk)
+                .where(models.DocumentChunk.id == chunk_id)
+                .values(content_hash=content_hash, **get_embedding_columns(embedding))
+            )
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise e
+
+def update_document_chunks_metadata(db: Session, document_id: any, document_name: str, document_path: str):
+    """문서 id에 해당하는 모든 청크의 문서 이름과 경로를 업데이트한다. (다시 임베딩하지 않음)"""
+    from sqlalchemy import update
+    stmt = update(models.DocumentChunk).where(models.DocumentChunk.document_id == int(document_id)).values(
+        document_name=document_name,
+        document_path=document_path
+    )
+    db.execute(stmt)
+    db.commit()
+
+def get_document_owner_id(db: Session, document_id: any):
+    """문서 소유자(documents.user_id)를 가져온다. 문서가 없으면 None."""
+    return db.query(models.Document.user_id).filter(models.Document.id == int(document_id)).scalar()
+
 # 문서의 id로 문서 청크를 가져오는 함수
 def get_document_chunks_by_document_id(db: Session, document_id: int):
     return db.query(models.DocumentChunk).filter(models.DocumentChunk.document_id == document_id).all()
@@ -169,11 +273,18 @@ def delete_directory_by_id(db: Session, directory_id: str):
     db.commit()
 
 def delete_document_by_id(db: Session, document_id: int):
-    """파일 id로 테이블에서 파일 정보를 document_chunks테이블, documents테이블, directories테이블 순으로 삭제한다."""
+    """파일 id로 테이블에서 파일 정보를 document_chunks테이블, ingestion_jobs테이블, documents테이블, directories테이블 순으로 삭제한다."""
+    from rag.local_index import remove_chunks as remove_local_chunks
     try:
         # 개별 DELETE 문을 실행
+        # 삭제한 청크는 commit 후 로컬 벡터 인덱스에서도 제외한다.
+        deleted_chunks = db.execute(
+            text("DELETE FROM document_chunks WHERE document_id = :doc_id RETURNING id, owner_id"),
+            {"doc_id": document_id}
+        ).fetchall()
+
         db.execute(
-            text("DELETE FROM document_chunks WHERE document_id = :doc_id"),
+            text("DELETE FROM ingestion_jobs WHERE document_id = :doc_id"),
             {"doc_id": document_id}
         )
         
@@ -188,6 +299,8 @@ def delete_document_by_id(db: Session, document_id: int):
         )
         
         db.commit()
+        for owner_id in {row.owner_id for row in deleted_chunks}:
+            remove_local_chunks(owner_id, [row.id for row in deleted_chunks if row.owner_id == owner_id])
         return True
     except Exception as e:
         db.rollback()
@@ -230,6 +343,13 @@ def update_directory_path_and_parent(db: Session, item_id: str, target_new_path:
         parent_id=target_new_parent_id
     )
     db.execute(stmt)
+    # 아이템이 파일인 경우 해당 문서 청크의 경로도 변경 (파일의 directories.id는 documents.id와 같고, 폴더 id는 uuid이다)
+    # 컬럼이 아닌 파라미터를 정수로 바꿔야 document_id 인덱스를 사용한다.
+    if str(item_id).isdigit():
+        db.execute(
+            text("UPDATE document_chunks SET document_path = :new_path WHERE document_id = :document_id"),
+            {"new_path": target_new_path, "document_id": int(item_id)}
+        )
     db.commit()
     return db.query(models.Directory).filter(models.Directory.id == item_id).first()
 
@@ -284,6 +404,9 @@ def update_directory_with_sql_file_safe(db: Session, item_id: str, target_item_p
         text(update_path_sql),
         {"tgt_id": item_id, "old_prefix": target_item_path, "new_prefix": target_new_path}
     )
+
+    # 3. 하위 파일들의 문서 청크 경로 업데이트 (다시 임베딩하지 않음)
+    update_document_chunk_paths_in_subtree(db, item_id, target_item_path, target_new_path)
     
     # 트랜잭션 커밋
     db.commit()
@@ -302,6 +425,46 @@ def update_directory_with_sql_file_safe(db: Session, item_id: str, target_item_p
     return db.query(models.Directory).filter(models.Directory.id == item_id).first()
 
 
+def update_document_chunk_paths_in_subtree(db: Session, item_id: str, old_prefix: str, new_prefix: str):
+    """item_id 폴더 아래(하위 폴더 포함)에 있는 파일의 문서 청크 경로 앞부분을 new_prefix로 교체한다. (commit은 호출한 쪽에서 수행)
+
+    경로가 같은 다른 사용자의 청크를 바꾸지 않도록 directories 트리에서 찾은 파일(directories.id == documents.id)의 청크만 바꾼다.
+    document_id 인덱스를 사용하므로 청크 테이블 전체를 탐색하지 않는다.
+    """
+    update_chunk_path_sql = """
+    WITH RECURSIVE subtree AS (
+        SELECT id, is_directory
+        FROM directories
+        WHERE id = :tgt_id
+        UNION ALL
+        SELECT d.id, d.is_directory
+        FROM directories d
+        JOIN subtree s ON d.parent_id = s.id
+    )
+    UPDATE document_chunks
+    SET document_path = :new_prefix || substr(document_path, length(:old_prefix) + 1)
+    WHERE document_id IN (
+        SELECT CAST(id AS integer) FROM subtree WHERE NOT is_directory AND id ~ '^[0-9]+$'
+    )
+    AND left(document_path, length(:old_prefix) + 1) = :old_prefix || '/';
+    """
+    db.execute(
+        text(update_chunk_path_sql),
+        {"tgt_id": item_id, "old_prefix": old_prefix.rstrip("/"), "new_prefix": new_prefix.rstrip("/")}
+    )
+
+
+def update_document_filename_and_s3_key(db: Session, document_id: any, filename: str, s3_key: str):
+    """documents 테이블에서 문서의 파일 이름과 s3_key를 업데이트한다."""
+    from sqlalchemy import update
+    stmt = update(models.Document).where(models.Document.id == int(document_id)).values(
+        filename=filename,
+        s3_key=s3_key
+    )
+    db.execute(stmt)
+    db.commit()
+
+
 def update_item_name_and_path(db: Session, item_id: any, new_name: str, new_path: str):
     """아이템의 id로 해당 아이템의 이름과 경로를 업데이트한다."""
     from sqlalchemy import update
@@ -494,3 +657,309 @@ def get_directory_by_id(db: Session, item_id: any):
     stmt = select(models.Directory).where(models.Directory.id == item_id)
     result = db.execute(stmt).scalar_one_or_none()
     return result    
+
+
+def get_document_by_id(db: Session, document_id: any):
+    """문서 id로 documents 테이블의 레코드를 가져온다. 없으면 None."""
+    stmt = select(models.Document).where(models.Document.id == int(document_id))
+    return db.execute(stmt).scalar_one_or_none()
+
+
+def delete_document_chunks_by_document_id(db: Session, document_id: int):
+    """문서 id에 해당하는 모든 청크를 삭제하고, commit 후 이 프로세스의 로컬 벡터 인덱스에서도 제외한다."""
+    from rag.local_index import remove_chunks as remove_local_chunks
+    deleted_chunks = db.execute(
+        text("DELETE FROM document_chunks WHERE document_id = :doc_id RETURNING id, owner_id"),
+        {"doc_id": document_id}
+    ).fetchall()
+    db.commit()
+    for owner_id in {row.owner_id for row in deleted_chunks}:
+        remove_local_chunks(owner_id, [row.id for row in deleted_chunks if row.owner_id == owner_id])
+
+
+def get_document_chunk_hashes(db: Session, document_id: int):
+    """문서 id에 해당하는 청크의 (id, content_hash) 리스트를 가져온다."""
+    stmt = select(models.DocumentChunk.id, models.DocumentChunk.content_hash).where(
+        models.DocumentChunk.document_id == document_id
+    )
+    return db.execute(stmt).all()
+
+
+def delete_document_chunks_by_ids(db: Session, chunk_ids: list, commit: bool = True):
+    """청크 id 리스트에 해당하는 청크를 삭제한다. commit이 False이면 호출한 쪽에서 commit한다."""
+    if chunk_ids:
+        db.execute(delete(models.DocumentChunk).where(models.DocumentChunk.id.in_(chunk_ids)))
+    if commit:
+        db.commit()
+
+
+def update_document_blob(db: Session, document_id: any, content_sha256: str, s3_key: str):
+    """문서가 참조하는 blob(내용 해시, s3_key)을 변경한다."""
+    from sqlalchemy import update
+    db.execute(
+        update(models.Document)
+        .where(models.Document.id == int(document_id))
+        .values(content_sha256=content_sha256, s3_key=s3_key)
+    )
+    db.commit()
+
+
+def get_ingested_document_id_by_sha256(db: Session, content_sha256: str, exclude_document_id: any = None):
+    """내용 해시가 같고 마지막 수집 작업이 완료된 문서의 id를 가져온다. 없으면 None."""
+    result = db.execute(
+        text("""
+        SELECT d.id
+        FROM documents AS d
+        JOIN LATERAL (
+            SELECT j.status FROM ingestion_jobs AS j
+            WHERE j.document_id = d.id
+            ORDER BY j.id DESC
+            LIMIT 1
+        ) AS last_job ON TRUE
+        WHERE d.content_sha256 = :content_sha256
+        AND d.id != :exclude_document_id
+        AND last_job.status = 'done'
+        LIMIT 1
+        """),
+        {"content_sha256": content_sha256, "exclude_document_id": int(exclude_document_id or 0)}
+    ).first()
+    return result.id if result else None
+
+
+def clone_document_chunks(db: Session, source_document_id: int, document_id: int, document_name: str, document_path: str) -> int:
+    """원본 문서의 청크와 임베딩을 새 문서의 청크로 복제하고 복제한 청크 수를 반환한다. (임베딩을 다시 계산하지 않음)"""
+    from config.settings import EMBEDDING_STORAGE
+    # halfvec 모드에서는 반정밀도 임베딩 컬럼도 함께 복제한다.
+    embedding_columns = "embedding, embedding_half" if EMBEDDING_STORAGE == "halfvec" else "embedding"
+    result = db.execute(
+        text(f"""
+        INSERT INTO document_chunks (document_id, document_name, document_path, owner_id, content, content_hash, content_tsv, {embedding_columns})
+        SELECT :document_id, :document_name, :document_path,
+            (SELECT user_id FROM documents WHERE id = :document_id),
+            content, content_hash, content_tsv, {embedding_columns}
+        FROM document_chunks
+        WHERE document_id = :source_document_id
+        """),
+        {
+            "document_id": int(document_id),
+            "document_name": document_name,
+            "document_path": document_path,
+            "source_document_id": int(source_document_id)
+        }
+    )
+    db.commit()
+    return result.rowcount
+
+
+# 내용 기반 파일 저장(blob) 관련 CRUD
+def get_blob(db: Session, content_sha256: str):
+    """내용 해시로 blobs 테이블의 레코드를 가져온다. 없으면 None."""
+    return db.get(models.Blob, content_sha256)
+
+
+def add_blob_reference(db: Session, content_sha256: str, s3_key: str, size: int = None):
+    """blob의 참조 수를 1 늘리고 (늘어난 참조 수, s3 업로드 완료 여부)를 반환한다. blob이 없으면 참조 수 1로 만든다.
+
+    업로드 완료 여부가 False이면 (새로 만들었거나 다른 업로드가 아직 끝나지 않았거나 실패한 blob) 호출한 쪽에서 s3에 업로드한 뒤
+    mark_blob_uploaded를 호출해야 한다.
+    """
+    from sqlalchemy.dialects.postgresql import insert as pg_insert
+    stmt = pg_insert(models.Blob).values(
+        sha256=content_sha256, s3_key=s3_key, size=size, ref_count=1, uploaded=False, created_at=datetime.now()
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[models.Blob.sha256],
+        set_={"ref_count": models.Blob.ref_count + 1}
+    ).returning(models.Blob.ref_count, models.Blob.uploaded)
+    row = db.execute(stmt).one()
+    db.commit()
+    return row.ref_count, bool(row.uploaded)
+
+
+def mark_blob_uploaded(db: Session, content_sha256: str):
+    """blob의 s3 업로드가 끝났음을 기록한다."""
+    from sqlalchemy import update
+    db.execute(update(models.Blob).where(models.Blob.sha256 == content_sha256).values(uploaded=True))
+    db.commit()
+
+
+def release_blob_reference(db: Session, content_sha256: str):
+    """blob의 참조 수를 1 줄이고, 더 이상 참조하는 문서가 없으면 레코드를 삭제한 뒤 그 s3_key를 반환한다.
+
+    아직 참조하는 문서가 있으면 None을 반환한다.
+    """
+    from sqlalchemy import update
+    db.execute(
+        update(models.Blob)
+        .where(models.Blob.sha256 == content_sha256)
+        .values(ref_count=models.Blob.ref_count - 1)
+    )
+    deleted_s3_key = db.execute(
+        delete(models.Blob)
+        .where(models.Blob.sha256 == content_sha256, models.Blob.ref_count <= 0)
+        .returning(models.Blob.s3_key)
+    ).scalar()
+    db.commit()
+    return deleted_s3_key
+
+
+# 문서 수집(ingestion) 작업 큐 관련 CRUD
+def enqueue_ingestion_job(db: Session, document_id: int, user_id: int, file_name: str, file_path: str, s3_key: str, mode: str = "full"):
+    """ingestion_jobs 테이블에 대기(queued) 상태의 작업을 추가하고 그 레코드를 반환한다.
+
+    mode가 replace이면 기존 청크와 비교하여 바뀐 청크만 임베딩한다.
+    """
+    from config.settings import INGESTION_MAX_ATTEMPTS
+    # 작업 시각은 claim_next_ingestion_job과 같은 DB 시계(now())로 기록한다.
+    now = func.now()
+    db_job = models.IngestionJob(
+        document_id=document_id,
+        user_id=user_id,
+        file_name=file_name,
+        file_path=file_path,
+        s3_key=s3_key,
+        mode=mode,
+        status="queued",
+        attempts=0,
+        max_attempts=INGESTION_MAX_ATTEMPTS,
+        run_after=now,
+        created_at=now,
+        updated_at=now
+    )
+    db.add(db_job)
+    db.commit()
+    db.refresh(db_job)
+    return db_job
+
+
+def record_cloned_ingestion_job(db: Session, document_id: int, user_id: int, file_name: str, file_path: str, s3_key: str):
+    """다른 문서의 청크를 복제하여 수집을 마친 문서의 완료(done) 작업 기록을 추가하고 그 레코드를 반환한다."""
+    now = func.now()
+    db_job = models.IngestionJob(
+        document_id=document_id,
+        user_id=user_id,
+        file_name=file_name,
+        file_path=file_path,
+        s3_key=s3_key,
+        mode="clone",
+        status="done",
+        stage="indexed",
+        attempts=0,
+        max_attempts=0,
+        run_after=now,
+        created_at=now,
+        updated_at=now,
+        finished_at=now
+    )
+    db.add(db_job)
+    db.commit()
+    db.refresh(db_job)
+    return db_job
+
+
+def claim_next_ingestion_job(db: Session, stale_after_seconds: int):
+    """처리할 작업 하나를 가져와 running 상태로 바꾼다.
+
+    FOR UPDATE SKIP LOCKED를 사용하므로 여러 워커(여러 서버)가 동시에 호출해도 같은 작업을 가져가지 않는다.
+    오랫동안 갱신되지 않은 running 작업(중단된 워커의 작업)도 시도 횟수가 남아 있으면 다시 가져온다.
+    시도 횟수를 모두 쓴 중단된 작업은 failed로 바꾼다. (워커를 죽이는 문서를 계속 다시 처리하지 않는다)
+    """
+    fail_stale_sql = """
+    UPDATE ingestion_jobs
+    SET status = 'failed',
+        error = '작업을 처리하던 워커가 응답 없이 중단되었고 최대 시도 횟수를 초과했습니다.',
+        updated_at = now(), finished_at = now()
+    WHERE status = 'running'
+    AND updated_at < now() - make_interval(secs => :stale_after)
+    AND attempts >= max_attempts
+    """
+    claim_sql = """
+    UPDATE ingestion_jobs
+    SET status = 'running', attempts = attempts + 1, error = NULL, updated_at = now()
+    WHERE id = (
+        SELECT id
+        FROM ingestion_jobs
+        WHERE (status = 'queued' AND run_after <= now())
+        OR (status = 'running' AND updated_at < now() - make_interval(secs => :stale_after) AND attempts < max_attempts)
+        ORDER BY id
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id;
+    """
+    failed = db.execute(text(fail_stale_sql), {"stale_after": stale_after_seconds}).rowcount
+    if failed:
+        print(f"[worker] 최대 시도 횟수를 초과한 중단된 작업 {failed}개를 실패로 기록했습니다.")
+    job_id = db.execute(text(claim_sql), {"stale_after": stale_after_seconds}).scalar()
+    db.commit()
+    if job_id is None:
+        return None
+    return db.query(models.IngestionJob).filter(models.IngestionJob.id == job_id).first()
+
+
+def update_ingestion_job_stage(db: Session, job_id: int, stage: str):
+    """작업의 처리 단계를 기록한다."""
+    from sqlalchemy import update
+    db.execute(
+        update(models.IngestionJob).where(models.IngestionJob.id == job_id).values(
+            stage=stage,
+            updated_at=func.now()
+        )
+    )
+    db.commit()
+
+
+def touch_ingestion_job(db: Session, job_id: int):
+    """running 상태인 작업의 갱신 시각을 DB의 현재 시각으로 바꿔 작업이 살아있음을 알린다. (하트비트)"""
+    from sqlalchemy import update
+    db.execute(
+        update(models.IngestionJob)
+        .where(models.IngestionJob.id == job_id, models.IngestionJob.status == "running")
+        .values(updated_at=func.now())
+    )
+    db.commit()
+
+
+def complete_ingestion_job(db: Session, job_id: int):
+    """작업을 완료(done) 상태로 바꾼다."""
+    from sqlalchemy import update
+    now = func.now()
+    db.execute(
+        update(models.IngestionJob).where(models.IngestionJob.id == job_id).values(
+            status="done",
+            stage="indexed",
+            updated_at=now,
+            finished_at=now
+        )
+    )
+    db.commit()
+
+
+def fail_ingestion_job(db: Session, job_id: int, error: str, retry_delay_seconds: int, retry: bool = True):
+    """작업 실패를 기록한다. 시도 횟수가 남아 있으면 대기 시간 후 다시 처리되도록 queued 상태로 되돌린다."""
+    from datetime import timedelta
+    db.rollback()
+    job = db.query(models.IngestionJob).filter(models.IngestionJob.id == job_id).first()
+    if job is None:
+        # 처리 중에 문서가 삭제된 경우
+        return None
+    now = func.now()
+    job.error = error
+    job.updated_at = now
+    if retry and job.attempts < job.max_attempts:
+        job.status = "queued"
+        job.run_after = now + timedelta(seconds=retry_delay_seconds * job.attempts)
+    else:
+        job.status = "failed"
+        job.finished_at = now
+    db.commit()
+    return job
+
+
+def get_ingestion_jobs(db: Session, user_id: int, job_ids: list = None, limit: int = 50):
+    """사용자의 작업 목록을 가져온다. job_ids가 없으면 최근 작업 limit개를 가져온다."""
+    stmt = select(models.IngestionJob).where(models.IngestionJob.user_id == user_id)
+    if job_ids:
+        stmt = stmt.where(models.IngestionJob.id.in_(job_ids))
+    stmt = stmt.order_by(models.IngestionJob.id.desc()).limit(limit)
+    return db.execute(stmt).scalars().all()
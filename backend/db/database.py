@@ -1,14 +1,65 @@
-from sqlalchemy import create_engine
+import threading
+
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
 
-from config.settings import DATABASE_URL
+from config.settings import DATABASE_URL, DB_PREPARE_THRESHOLD, DB_ASYNC_POOL_SIZE, DB_ASYNC_MAX_OVERFLOW
 
 
 
 # 데이터베이스 엔진 생성
-engine = create_engine(DATABASE_URL, echo=True)
+connect_args = {}
+if DATABASE_URL.startswith("postgresql+psycopg://"):
+    connect_args["prepare_threshold"] = DB_PREPARE_THRESHOLD
+engine = create_engine(DATABASE_URL, echo=True, connect_args=connect_args)
+
+
+@event.listens_for(engine, "connect")
+def register_vector_types(dbapi_connection, connection_record):
+    """새 연결에 pgvector 타입 어댑터를 등록 (질의 벡터를 binary 형식으로 전송하고 임베딩을 numpy 배열로 받는다)"""
+    if engine.dialect.driver != "psycopg":
+        return
+    try:
+        from pgvector.psycopg import register_vector
+        register_vector(dbapi_connection)
+    except Exception as e:
+        # vector 익스텐션이 아직 없는 경우. 익스텐션 생성 후 연결 풀을 비우면 새 연결에서 다시 등록된다.
+        print(f"pgvector 타입 등록 오류: {str(e)}")
+        dbapi_connection.rollback()
+
+# 질의 경로에서 사용하는 비동기 엔진 (psycopg AsyncConnection). 처음 사용할 때 만든다.
+_async_engine = None
+_async_engine_lock = threading.Lock()
+
+
+def register_vector_types_async(dbapi_connection, connection_record):
+    """비동기 엔진의 새 연결에 pgvector 타입 어댑터를 등록"""
+    try:
+        from pgvector.psycopg import register_vector_async
+        dbapi_connection.run_async(register_vector_async)
+    except Exception as e:
+        print(f"pgvector 타입 등록 오류: {str(e)}")
+        dbapi_connection.run_async(lambda connection: connection.rollback())
+
+
+def get_async_engine():
+    """비동기 엔진을 반환. 테스트용 SQLite에는 비동기 드라이버가 없으므로 import 시점이 아닌 처음 사용할 때 만든다."""
+    global _async_engine
+    if _async_engine is None:
+        with _async_engine_lock:
+            if _async_engine is None:
+                from sqlalchemy.ext.asyncio import create_async_engine
+                async_engine = create_async_engine(
+                    DATABASE_URL,
+                    connect_args=connect_args,
+                    pool_size=DB_ASYNC_POOL_SIZE,
+                    max_overflow=DB_ASYNC_MAX_OVERFLOW
+                )
+                event.listen(async_engine.sync_engine, "connect", register_vector_types_async)
+                _async_engine = async_engine
+    return _async_engine
 
 # 세션 로컬 클래스 생성
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
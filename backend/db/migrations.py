@@ -0,0 +1,404 @@
+"""기존 테이블에 대한 스키마 마이그레이션.
+
+Base.metadata.create_all은 새 테이블만 생성하고 기존 테이블에 컬럼을 추가하지 않으므로,
+애플리케이션 시작 시 여기의 SQL을 순서대로 실행한다. 모든 SQL은 여러 번 실행해도 안전해야 한다.
+
+이전 방식(이름/경로 포함)으로 임베딩된 청크를 내용만으로 다시 임베딩하려면:
+    python -m db.migrations reembed
+
+EMBEDDING_STORAGE=halfvec으로 바꾼 뒤 기존 청크의 반정밀도 임베딩을 채우고 ANN 인덱스를 만들려면:
+    python -m db.migrations halfvec
+
+전문 검색(하이브리드 검색) 색인이 없는 기존 청크의 content_tsv를 채우려면:
+    python -m db.migrations fulltext
+
+벡터 인덱스(VECTOR_INDEX_*)는 애플리케이션 시작 시 백그라운드에서 만든다. 직접 만들려면:
+    python -m db.migrations index
+"""
+
+import re
+
+from sqlalchemy import text
+
+
+MIGRATIONS = [
+    # 경로 독립 임베딩: 문서 이름/경로와 내용 해시를 document_chunks 컬럼으로 저장
+    "ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)",
+    "ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS document_name VARCHAR",
+    "ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS document_path VARCHAR",
+    "CREATE INDEX IF NOT EXISTS ix_document_chunks_content_hash ON document_chunks (content_hash)",
+    "CREATE INDEX IF NOT EXISTS ix_document_chunks_document_name ON document_chunks (document_name)",
+    "CREATE INDEX IF NOT EXISTS ix_document_chunks_document_path ON document_chunks (document_path)",
+    # 기존 청크의 이름/경로를 directories 테이블에서 채운다. (파일의 directories.id는 documents.id와 같다)
+    """
+    UPDATE document_chunks AS c
+    SET document_name = d.name, document_path = d.path
+    FROM directories AS d
+    WHERE d.id = CAST(c.document_id AS TEXT)
+    AND c.document_path IS NULL
+    """,
+    # 문서 교체(replace) 수집 모드
+    "ALTER TABLE ingestion_jobs ADD COLUMN IF NOT EXISTS mode VARCHAR DEFAULT 'full'",
+    # 내용 해시 기반 중복 제거: 같은 내용의 문서가 s3 객체를 공유하므로 s3_key의 유일 제약을 없앤다.
+    "ALTER TABLE documents ADD COLUMN IF NOT EXISTS content_sha256 VARCHAR(64)",
+    "CREATE INDEX IF NOT EXISTS ix_documents_content_sha256 ON documents (content_sha256)",
+    "ALTER TABLE documents DROP CONSTRAINT IF EXISTS documents_s3_key_key",
+    "CREATE INDEX IF NOT EXISTS ix_documents_s3_key ON documents (s3_key)",
+    # postgres/schema.sql이 만들던 embedding_vector 컬럼과 ivfflat 인덱스는 어디서도 쓰거나 읽지 않는다.
+    "DROP INDEX IF EXISTS document_chunks_embedding_idx",
+    "ALTER TABLE document_chunks DROP COLUMN IF EXISTS embedding_vector",
+    # 답변 캐시 무효화용 사용자 문서 집합 버전
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS corpus_version INTEGER DEFAULT 0",
+    # 사용자/폴더 범위 검색: 문서 소유자를 document_chunks 컬럼으로 저장
+    "ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS owner_id INTEGER",
+    """
+    UPDATE document_chunks AS c
+    SET owner_id = d.user_id
+    FROM documents AS d
+    WHERE d.id = c.document_id
+    AND c.owner_id IS NULL
+    AND d.user_id IS NOT NULL
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_document_chunks_owner_path ON document_chunks (owner_id, document_path text_pattern_ops)",
+    # 하이브리드 검색용 전문 검색 색인 (기존 청크는 `python -m db.migrations fulltext`로 채운다)
+    "ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS content_tsv tsvector",
+    "CREATE INDEX IF NOT EXISTS ix_document_chunks_content_tsv ON document_chunks USING gin (content_tsv)",
+    # blob의 s3 업로드 완료 여부. 이 컬럼 이전에 만들어진 blob은 업로드가 끝난 것으로 본다. (새 blob은 항상 false로 만든다)
+    "ALTER TABLE blobs ADD COLUMN IF NOT EXISTS uploaded BOOLEAN",
+    "UPDATE blobs SET uploaded = TRUE WHERE uploaded IS NULL",
+    "ALTER TABLE blobs ALTER COLUMN uploaded SET DEFAULT FALSE",
+    # 문서 이동/삭제 시 문서의 청크를 찾는 조건(document_id = ...)용 인덱스
+    "CREATE INDEX IF NOT EXISTS ix_document_chunks_document_id ON document_chunks (document_id)",
+]
+
+# ensure_vector_index가 관리하는 벡터 인덱스 이름의 접두사. 설정과 맞지 않는 인덱스는 삭제된다.
+VECTOR_INDEX_PREFIX = "ix_document_chunks_ann_"
+# 이전 버전에서 만들던 벡터 인덱스 (새 인덱스를 만든 뒤 삭제)
+LEGACY_VECTOR_INDEXES = ["ix_document_chunks_embedding_half"]
+
+
+def get_migrations() -> list:
+    """현재 설정에서 실행할 마이그레이션 SQL 리스트"""
+    from config.settings import EMBEDDING_STORAGE, EMBEDDING_DIMENSION
+
+    migrations = list(MIGRATIONS)
+    if EMBEDDING_STORAGE == "halfvec":
+        # halfvec 타입은 pgvector 0.7 이상에서만 지원되므로 halfvec 모드에서만 컬럼을 추가한다.
+        migrations.append(
+            f"ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS embedding_half halfvec({EMBEDDING_DIMENSION})"
+        )
+    return migrations
+
+
+def get_vector_index_definitions() -> dict:
+    """현재 설정의 검색에 필요한 벡터 인덱스를 {인덱스 이름: CREATE INDEX 문의 ON 이후 부분} 형태로 반환
+
+    인덱스 이름에 설정 값이 들어가므로 설정을 바꾸면 새 인덱스를 만들고 이전 인덱스를 삭제하게 된다.
+    """
+    from config.settings import (
+        EMBEDDING_STORAGE, EMBEDDING_DIMENSION, EMBEDDING_KEEP_FULL_PRECISION, SEARCH_PREFIX_DIMENSION,
+        VECTOR_INDEX_TYPE, VECTOR_INDEX_M, VECTOR_INDEX_EF_CONSTRUCTION, VECTOR_INDEX_LISTS, VECTOR_DISTANCE
+    )
+    from rag.retriever import resolve_shortlist
+
+    if VECTOR_INDEX_TYPE not in ("hnsw", "ivfflat"):
+        return {}
+
+    # 검색의 ORDER BY에 쓰이는 컬럼 (halfvec 모드에서는 반정밀도 컬럼으로 후보를 찾는다)
+    column = "embedding_half" if EMBEDDING_STORAGE == "halfvec" else "embedding"
+    column_type = "halfvec" if EMBEDDING_STORAGE == "halfvec" else "vector"
+    hnsw_options = f"WITH (m = {VECTOR_INDEX_M}, ef_construction = {VECTOR_INDEX_EF_CONSTRUCTION})"
+    hnsw_suffix = f"hnsw_m{VECTOR_INDEX_M}_ef{VECTOR_INDEX_EF_CONSTRUCTION}"
+
+    # 2단계 검색의 1단계 후보 검색용 식 인덱스 (rag.retriever.get_shortlist_distance의 식과 같아야 한다)
+    shortlist = resolve_shortlist(EMBEDDING_STORAGE, EMBEDDING_KEEP_FULL_PRECISION)
+    if shortlist == "binary":
+        return {
+            f"{VECTOR_INDEX_PREFIX}{column}_bit_{hnsw_suffix}": (
+                f"document_chunks USING hnsw ((binary_quantize({column})::bit({EMBEDDING_DIMENSION})) bit_hamming_ops) "
+                f"{hnsw_options}"
+            )
+        }
+    if shortlist == "prefix":
+        # 잘라낸 벡터는 정규화되어 있지 않으므로 항상 코사인 거리를 사용한다.
+        return {
+            f"{VECTOR_INDEX_PREFIX}{column}_prefix{SEARCH_PREFIX_DIMENSION}_{hnsw_suffix}": (
+                f"document_chunks USING hnsw ((subvector({column}, 1, {SEARCH_PREFIX_DIMENSION})"
+                f"::{column_type}({SEARCH_PREFIX_DIMENSION})) {column_type}_cosine_ops) {hnsw_options}"
+            )
+        }
+
+    distance = "ip" if VECTOR_DISTANCE == "inner_product" else "cosine"
+    if VECTOR_INDEX_TYPE == "ivfflat":
+        options = f"WITH (lists = {VECTOR_INDEX_LISTS})"
+        suffix = f"ivfflat_l{VECTOR_INDEX_LISTS}"
+    else:
+        options = hnsw_options
+        suffix = hnsw_suffix
+    return {
+        f"{VECTOR_INDEX_PREFIX}{column}_{distance}_{suffix}": (
+            f"document_chunks USING {VECTOR_INDEX_TYPE} ({column} {column_type}_{distance}_ops) {options}"
+        )
+    }
+
+
+def ensure_vector_index(engine):
+    """검색에 필요한 벡터 인덱스를 만들고, 설정과 맞지 않는 이전 벡터 인덱스를 삭제한다.
+
+    큰 테이블에서도 쓰기를 막지 않도록 CONCURRENTLY로 만들고, 여러 서버가 동시에 시작해도
+    advisory lock을 얻은 한 곳에서만 실행한다.
+    """
+    if engine.dialect.name != "postgresql":
+        return
+    definitions = get_vector_index_definitions()
+    try:
+        # CREATE/DROP INDEX CONCURRENTLY는 트랜잭션 밖에서 실행해야 한다.
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            if not connection.execute(text("SELECT pg_try_advisory_lock(hashtext('ensure_vector_index'))")).scalar():
+                print("다른 서버에서 벡터 인덱스를 관리하고 있어 건너뜁니다.")
+                return
+            try:
+                existing = {
+                    row.name: row.valid
+                    for row in connection.execute(text("""
+                        SELECT c.relname AS name, i.indisvalid AS valid
+                        FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                        WHERE i.indrelid = 'document_chunks'::regclass
+                    """))
+                }
+                for name, definition in definitions.items():
+                    if existing.get(name) is False:
+                        # 이전에 실패한 CONCURRENTLY 생성이 남긴 잘못된 인덱스
+                        connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+                        existing.pop(name)
+                    if name not in existing:
+                        print(f"벡터 인덱스 {name}을 만드는 중입니다.")
+                        connection.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {definition}"))
+                        print(f"벡터 인덱스 {name}을 만들었습니다.")
+
+                # 새 인덱스를 모두 만든 뒤에 이전 인덱스를 삭제해 검색이 인덱스 없이 실행되는 시간을 없앤다.
+                for name in existing:
+                    if name in definitions:
+                        continue
+                    if name.startswith(VECTOR_INDEX_PREFIX) or name in LEGACY_VECTOR_INDEXES:
+                        connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+                        print(f"사용하지 않는 벡터 인덱스 {name}을 삭제했습니다.")
+            finally:
+                connection.execute(text("SELECT pg_advisory_unlock(hashtext('ensure_vector_index'))"))
+    except Exception as e:
+        print(f"벡터 인덱스 생성 오류: {str(e)}")
+
+
+def backfill_halfvec_embeddings(engine, batch_size: int = 1000) -> int:
+    """기존 청크의 float32 임베딩을 반정밀도 컬럼으로 복사하고 벡터 인덱스를 만든다. 채운 청크 수를 반환한다.
+
+    EMBEDDING_KEEP_FULL_PRECISION이 false이면 복사가 끝난 청크의 float32 임베딩을 삭제한다.
+    """
+    from config.settings import EMBEDDING_DIMENSION, EMBEDDING_KEEP_FULL_PRECISION
+
+    total = 0
+    with engine.connect() as connection:
+        connection.execute(text(
+            f"ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS embedding_half halfvec({EMBEDDING_DIMENSION})"
+        ))
+        connection.commit()
+
+        # 긴 잠금을 피하기 위해 batch_size개씩 나눠서 커밋한다.
+        while True:
+            result = connection.execute(text(f"""
+                UPDATE document_chunks
+                SET embedding_half = CAST(embedding AS halfvec({EMBEDDING_DIMENSION}))
+                WHERE id IN (
+                    SELECT id FROM document_chunks
+                    WHERE embedding_half IS NULL AND embedding IS NOT NULL
+                    ORDER BY id
+                    LIMIT :batch_size
+                )
+            """), {"batch_size": batch_size})
+            connection.commit()
+            if result.rowcount == 0:
+                break
+            total += result.rowcount
+            print(f"반정밀도 임베딩 {total}개를 채웠습니다.")
+
+        if not EMBEDDING_KEEP_FULL_PRECISION:
+            while True:
+                result = connection.execute(text("""
+                    UPDATE document_chunks SET embedding = NULL
+                    WHERE id IN (
+                        SELECT id FROM document_chunks
+                        WHERE embedding IS NOT NULL AND embedding_half IS NOT NULL
+                        LIMIT :batch_size
+                    )
+                """), {"batch_size": batch_size})
+                connection.commit()
+                if result.rowcount == 0:
+                    break
+            print("float32 임베딩을 삭제했습니다. 디스크 공간은 VACUUM 후에 반환됩니다.")
+
+    ensure_vector_index(engine)
+    return total
+
+
+def backfill_content_tsv(engine, batch_size: int = 1000) -> int:
+    """content_tsv가 비어 있는 기존 청크의 전문 검색 어휘소를 채운다. 채운 청크 수를 반환한다."""
+    from rag.lexical import to_tsvector_text
+
+    total = 0
+    with engine.connect() as connection:
+        # 긴 잠금을 피하기 위해 batch_size개씩 나눠서 커밋한다.
+        while True:
+            rows = connection.execute(text("""
+                SELECT id, content FROM document_chunks
+                WHERE content_tsv IS NULL
+                ORDER BY id
+                LIMIT :batch_size
+            """), {"batch_size": batch_size}).all()
+            if not rows:
+                break
+            connection.execute(
+                text("UPDATE document_chunks SET content_tsv = CAST(:content_tsv AS tsvector) WHERE id = :id"),
+                [{"id": row.id, "content_tsv": to_tsvector_text(row.content)} for row in rows]
+            )
+            connection.commit()
+            total += len(rows)
+            print(f"전문 검색 색인 {total}개를 채웠습니다.")
+    return total
+
+
+def check_embedding_dimension(connection):
+    """document_chunks.embedding 컬럼의 차원이 EMBEDDING_DIMENSION과 다르면 경고를 출력한다.
+
+    차원 변경은 기존 임베딩을 모두 버려야 하므로 자동으로 변경하지 않는다.
+    """
+    from config.settings import EMBEDDING_DIMENSION
+    # vector 타입의 atttypmod 값이 차원이다.
+    dimension = connection.execute(text("""
+        SELECT atttypmod FROM pg_attribute
+        WHERE attrelid = 'document_chunks'::regclass AND attname = 'embedding'
+    """)).scalar()
+    if dimension and dimension > 0 and dimension != EMBEDDING_DIMENSION:
+        print(
+            f"경고: document_chunks.embedding 컬럼의 차원({dimension})이 EMBEDDING_DIMENSION({EMBEDDING_DIMENSION})과 다릅니다. "
+            "임베딩 모델을 바꾼 경우 document_chunks, embedding_cache 테이블을 새 차원으로 다시 만들고 문서를 다시 수집해야 합니다."
+        )
+        return False
+    return True
+
+
+def get_required_vector_version():
+    """현재 설정에 필요한 최소 pgvector 버전과 그 기능. 필요한 버전이 없으면 (None, None)"""
+    from config.settings import EMBEDDING_STORAGE, EMBEDDING_KEEP_FULL_PRECISION
+    from rag.retriever import resolve_shortlist
+
+    # 반복 인덱스 검색(pgvector 0.8)은 성능 설정이므로 필요한 버전에 넣지 않고 disable_unsupported_vector_options에서 끈다.
+    if EMBEDDING_STORAGE == "halfvec":
+        return (0, 7, 0), "EMBEDDING_STORAGE=halfvec (halfvec 타입)"
+    shortlist = resolve_shortlist(EMBEDDING_STORAGE, EMBEDDING_KEEP_FULL_PRECISION)
+    if shortlist in ("binary", "prefix"):
+        return (0, 7, 0), f"SEARCH_SHORTLIST={shortlist} (binary_quantize, subvector)"
+    return None, None
+
+
+def parse_version(version: str) -> tuple:
+    """'0.8.0' 형식의 버전 문자열을 비교할 수 있는 튜플로 변환"""
+    return tuple(int(part) for part in re.findall(r"\d+", version)[:3])
+
+
+def disable_unsupported_vector_options(version: str):
+    """설치된 pgvector에서 지원하지 않는 검색 성능 설정을 경고와 함께 끈다."""
+    import config.settings as settings
+
+    if settings.VECTOR_INDEX_ITERATIVE_SCAN != "off" and parse_version(version) < (0, 8, 0):
+        print(
+            f"경고: pgvector {version}에서는 VECTOR_INDEX_ITERATIVE_SCAN={settings.VECTOR_INDEX_ITERATIVE_SCAN}"
+            "(hnsw.iterative_scan)을 사용할 수 없어 끕니다. pgvector 0.8 이상에서 사용할 수 있습니다."
+        )
+        settings.VECTOR_INDEX_ITERATIVE_SCAN = "off"
+
+
+def ensure_vector_extension(connection) -> bool:
+    """pgvector 익스텐션을 서버에 설치된 최신 버전으로 올리고, 버전이 바뀌었으면 True를 반환한다.
+
+    CREATE EXTENSION IF NOT EXISTS는 이미 만들어진 익스텐션의 버전을 올리지 않으므로, 이미지의 pgvector를 올린 뒤에도
+    기존 DB는 이전 버전에 머문다. 현재 설정에 필요한 버전보다 낮으면 RuntimeError.
+    반복 인덱스 검색처럼 없어도 동작하는 성능 설정은 오류 대신 경고하고 끈다.
+    """
+    version_query = text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+    previous_version = connection.execute(version_query).scalar()
+    try:
+        connection.execute(text("ALTER EXTENSION vector UPDATE"))
+        connection.commit()
+    except Exception as e:
+        # 권한이 없거나 서버에 새 버전이 설치되어 있지 않은 경우. 아래에서 버전을 확인한다.
+        connection.rollback()
+        print(f"pgvector 익스텐션 업데이트 오류: {str(e)}")
+
+    version = connection.execute(version_query).scalar()
+    if version is None:
+        raise RuntimeError("pgvector 익스텐션(vector)이 설치되어 있지 않습니다.")
+    disable_unsupported_vector_options(version)
+    required, feature = get_required_vector_version()
+    if required is not None and parse_version(version) < required:
+        raise RuntimeError(
+            f"pgvector {version}에서는 {feature}을(를) 사용할 수 없습니다. "
+            f"서버의 pgvector를 {'.'.join(map(str, required))} 이상으로 설치한 뒤 ALTER EXTENSION vector UPDATE를 실행하거나 설정을 바꾸세요."
+        )
+    if version != previous_version:
+        print(f"pgvector 익스텐션을 {previous_version}에서 {version}으로 업데이트했습니다.")
+        return True
+    return False
+
+
+def run_migrations(engine):
+    """pgvector 버전을 확인하고 마이그레이션 SQL을 순서대로 실행한다."""
+    # 테스트용 SQLite DB는 create_all로 생성된 최신 스키마를 사용한다.
+    if engine.dialect.name != "postgresql":
+        return True
+    try:
+        with engine.connect() as connection:
+            # halfvec 컬럼 등 새 pgvector 기능을 쓰는 DDL보다 먼저 익스텐션 버전을 올린다.
+            updated = ensure_vector_extension(connection)
+            for statement in get_migrations():
+                connection.execute(text(statement))
+            connection.commit()
+            check_embedding_dimension(connection)
+        if updated:
+            # 업데이트 전에 만들어진 연결에는 halfvec 등 새 타입의 어댑터가 등록되지 않았으므로 연결 풀을 비운다.
+            engine.dispose()
+        return True
+    except RuntimeError:
+        # pgvector 버전이 설정과 맞지 않으면 시작하지 않는다.
+        raise
+    except Exception as e:
+        print(f"마이그레이션 오류: {str(e)}")
+        return False
+
+
+if __name__ == "__main__":
+    import sys
+    import asyncio
+    from db.database import engine, SessionLocal
+
+    run_migrations(engine)
+
+    if len(sys.argv) > 1 and sys.argv[1] == "reembed":
+        from rag.vectorstore import reembed_legacy_chunks
+
+        db = SessionLocal()
+        try:
+            count = asyncio.run(reembed_legacy_chunks(db))
+            print(f"{count}개의 청크를 다시 임베딩했습니다.")
+        finally:
+            db.close()
+
+    if len(sys.argv) > 1 and sys.argv[1] == "halfvec":
+        count = backfill_halfvec_embeddings(engine)
+        print(f"{count}개의 청크에 반정밀도 임베딩을 채웠습니다.")
+
+    if len(sys.argv) > 1 and sys.argv[1] == "fulltext":
+        count = backfill_content_tsv(engine)
+        print(f"{count}개의 청크에 전문 검색 색인을 채웠습니다.")
+
+    if len(sys.argv) > 1 and sys.argv[1] == "index":
+        ensure_vector_index(engine)
@@ -1,10 +1,12 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, JSON
+from sqlalchemy import Column, Integer, BigInteger, String, Text, DateTime, ForeignKey, JSON, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
-from pgvector.sqlalchemy import Vector
+from pgvector.sqlalchemy import Vector, HALFVEC
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.types import Boolean
 
 from db.database import Base
+from config.settings import EMBEDDING_DIMENSION, EMBEDDING_STORAGE
 
 class User(Base):
     """사용자 모델"""
@@ -15,6 +17,8 @@ class User(Base):
     email = Column(String, unique=True, index=True)
     password_hash = Column(String)
     created_at = Column(DateTime, default=datetime.now)
+    # 문서 업로드, 삭제, 이름 변경, 이동, 수집 완료 시 1씩 증가 (답변 캐시 무효화용)
+    corpus_version = Column(Integer, default=0)
     
     documents = relationship("Document", back_populates="owner")
 
@@ -24,7 +28,10 @@ class Document(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     filename = Column(String)
-    s3_key = Column(String(1024), nullable=False, unique=True)
+    # 내용이 같은 문서는 같은 s3 객체(blob)를 공유하므로 s3_key는 중복될 수 있다.
+    s3_key = Column(String(1024), nullable=False, index=True)
+    # 파일 내용의 SHA-256 해시. NULL이면 blob을 공유하지 않는 이전 방식의 문서이다.
+    content_sha256 = Column(String(64), index=True)
     upload_time = Column(DateTime, default=datetime.now)
     user_id = Column(Integer, ForeignKey("users.id"))
     
@@ -36,11 +43,81 @@ class DocumentChunk(Base):
     __tablename__ = "document_chunks"
 
     id = Column(Integer, primary_key=True, index=True)
-    document_id = Column(Integer, ForeignKey("documents.id"))
+    document_id = Column(Integer, ForeignKey("documents.id"), index=True)
     content = Column(String)
-    embedding = Column(Vector(1536))
+    # 청크 내용의 SHA-256 해시. NULL이면 이름/경로가 포함된 텍스트로 임베딩된 이전 방식의 청크이다.
+    content_hash = Column(String(64), index=True)
+    # 문서 이름과 경로는 임베딩에 포함하지 않고 컬럼으로 저장한다. (이름 변경/이동 시 UPDATE만 수행)
+    document_name = Column(String, index=True)
+    document_path = Column(String, index=True)
+    # 문서 소유자 (documents.user_id 비정규화). 사용자별 검색을 벡터 검색 쿼리 안에서 거르기 위해 저장한다.
+    owner_id = Column(Integer)
+    # 전문 검색용 어휘소 (토큰 + 두 글자 n-gram, rag.lexical.to_tsvector_text). 저장 시 함께 계산한다.
+    content_tsv = Column(TSVECTOR)
+    # halfvec 모드에서 EMBEDDING_KEEP_FULL_PRECISION이 false이면 NULL (후보 재정렬용 float32 사본)
+    embedding = Column(Vector(EMBEDDING_DIMENSION))
+    # ANN 검색용 반정밀도 임베딩. pgvector 0.7 미만에서도 동작하도록 halfvec 모드에서만 컬럼을 매핑한다.
+    if EMBEDDING_STORAGE == "halfvec":
+        embedding_half = Column(HALFVEC(EMBEDDING_DIMENSION))
     document = relationship("Document", back_populates="chunks") 
 
+    __table_args__ = (
+        # 사용자 + 폴더 경로 접두사(LIKE '/폴더/%') 검색용 인덱스
+        Index(
+            "ix_document_chunks_owner_path", "owner_id", "document_path",
+            postgresql_ops={"document_path": "text_pattern_ops"}
+        ),
+        Index("ix_document_chunks_content_tsv", "content_tsv", postgresql_using="gin"),
+    )
+
+class IngestionJob(Base):
+    """문서 수집(파싱/청킹/임베딩) 작업 큐 모델"""
+    __tablename__ = "ingestion_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    document_id = Column(Integer, ForeignKey("documents.id"), index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    file_name = Column(String)
+    file_path = Column(String)
+    s3_key = Column(String(1024))
+    # full: 기존 청크를 지우고 전체 수집, replace: 기존 청크와 비교하여 추가/변경된 청크만 임베딩,
+    # clone: 내용이 같은 문서의 청크를 복제 (워커가 처리하지 않고 완료 상태로 기록된다)
+    mode = Column(String, default="full")
+    # queued: 대기, running: 처리 중, done: 완료, failed: 실패 (재시도 횟수 초과)
+    status = Column(String, default="queued", index=True)
+    # 마지막으로 끝난 처리 단계 (parsed, chunked, embedded, indexed)
+    stage = Column(String)
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=3)
+    error = Column(Text)
+    # 재시도 시 이 시각 이후에 다시 처리한다.
+    run_after = Column(DateTime, default=datetime.now)
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now)
+    finished_at = Column(DateTime)
+
+class EmbeddingCache(Base):
+    """임베딩 캐시 모델 (공급자:모델:차원 + 임베딩 텍스트의 SHA-256 해시가 키)"""
+    __tablename__ = "embedding_cache"
+
+    model = Column(String, primary_key=True)
+    text_hash = Column(String(64), primary_key=True)
+    embedding = Column(Vector(EMBEDDING_DIMENSION))
+    created_at = Column(DateTime, default=datetime.now)
+    last_used_at = Column(DateTime, default=datetime.now, index=True)
+
+class Blob(Base):
+    """내용 기반(content-addressed) 파일 저장 모델. 같은 내용의 파일은 s3에 한 번만 저장하고 참조 수를 센다."""
+    __tablename__ = "blobs"
+
+    sha256 = Column(String(64), primary_key=True)
+    s3_key = Column(String(1024), nullable=False)
+    size = Column(BigInteger)
+    ref_count = Column(Integer, default=0)
+    # s3 업로드가 끝났는지 여부. 업로드 전에 참조한 다른 업로드는 객체가 있다고 가정하지 않고 직접 업로드한다.
+    uploaded = Column(Boolean, default=False)
+    created_at = Column(DateTime, default=datetime.now)
+
 class Directory(Base):
     """디렉토리 모델"""
     __tablename__ = "directories"
@@ -52,3 +129,20 @@ class Directory(Base):
     parent_id = Column(String)
     created_at = Column(DateTime, default=datetime.now)
     owner_id = Column(Integer, ForeignKey("users.id"))
+
+
+class AnswerCache(Base):
+    """질의 답변 캐시 모델. 질의 임베딩이 충분히 비슷하고 사용자의 문서 집합 버전이 같으면 저장된 답변을 재사용한다."""
+    __tablename__ = "answer_cache"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    corpus_version = Column(Integer, nullable=False)
+    # 임베딩 모델과 검색 옵션(k, fetch_k 등)이 다르면 재사용하지 않는다.
+    model = Column(String, nullable=False)
+    options = Column(String, nullable=False)
+    query = Column(Text)
+    query_embedding = Column(Vector(EMBEDDING_DIMENSION))
+    answer = Column(Text)
+    sources = Column(JSON)
+    created_at = Column(DateTime, default=datetime.now, index=True)
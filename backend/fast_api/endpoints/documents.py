@@ -1,18 +1,19 @@
 from fastapi import APIRouter, Depends, File, Form, UploadFile, HTTPException, Query
 from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 from pydantic import BaseModel
 from datetime import datetime
 import uuid
 import json
+import hashlib
 import boto3
 
 from db.database import get_db, engine
 from db.models import User
 from fast_api.security import get_current_user
-from rag.document_service import get_all_documents, process_document, process_query
-from rag.llm import get_llms_answer
+from rag.document_service import get_all_documents, check_supported_file, register_document, aprocess_query, aprocess_query_batch
+from rag.llm import aget_llms_answer
 from config.settings import AWS_SECRET_ACCESS_KEY,S3_BUCKET_NAME,AWS_ACCESS_KEY_ID,AWS_DEFAULT_REGION  # 설정 임포트
 import os
 import logging
@@ -42,6 +43,9 @@ if not S3_BUCKET_NAME:
 
 router = APIRouter()
 
+# 검색 대상(청크 내용, 문서 이름/경로)을 바꾸는 /manage 작업. 끝나면 답변 캐시 버전을 올린다.
+CORPUS_CHANGING_OPERATIONS = {"move", "delete", "rename", "copy"}
+
 ''' 함수 인덱스
 
 # 디버깅 stop 시 다음 코드 강제 실행 불가하도록 하는 함수.
@@ -59,6 +63,12 @@ get_filesystem_structure
 post("/query")
 query_document
 
+post("/query/batch")
+query_documents_batch
+
+get("/jobs")
+get_ingestion_jobs
+
 디렉토리 업로드 처리
 process_directory_uploads
 
@@ -89,6 +99,21 @@ set_file_path
 s3 업로드
 upload_file_to_s3
 
+업로드 파일의 내용 해시 계산
+hash_upload_file
+
+내용 해시 기준으로 s3에 저장 (같은 내용은 한 번만 저장)
+store_upload_blob
+
+문서가 참조하던 s3 객체 해제
+release_document_blob
+
+같은 내용의 수집된 문서가 있으면 청크 복제, 없으면 수집 작업 등록
+ingest_or_reuse_chunks
+
+복사한 문서의 파일과 청크 준비
+copy_document_content
+
 '''
 
 
@@ -159,10 +184,15 @@ async def upload_document(
     path: str = Form('/'),
     directory_structure: str = Form(None),
     operations: str = Form(None),
+    replace: bool = Form(False),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """통합 문서 / 디렉토리 관리"""
+    """통합 문서 / 디렉토리 관리
+
+    replace가 true이면 같은 경로에 같은 이름의 문서가 이미 있을 때 새 이름으로 저장하지 않고
+    기존 문서를 교체한다. 이때 바뀐 청크만 다시 임베딩한다.
+    """
     from typing import Dict, Any
 
     # API 테스트 용 코드.
@@ -188,7 +218,7 @@ async def upload_document(
             # 단일 파일인 경우
             if os.path.dirname(files[0].filename) == "":
                 # 파일 업로드 처리
-                file_results = await process_file_uploads(files, current_upload_path, current_user, db)
+                file_results = await process_file_uploads(files, current_upload_path, current_user, db, replace)
                 results["items"].extend(file_results)
             else:
                 # 디렉토리 업로드인 경우
@@ -197,7 +227,7 @@ async def upload_document(
                 results["items"].extend(directory_results)
 
                 # 파일 업로드 처리
-                file_results = await process_file_uploads(files, current_upload_path, current_user, db)
+                file_results = await process_file_uploads(files, current_upload_path, current_user, db, replace)
                 results["items"].extend(file_results)
         
         # 3 & 4. 디렉토리 작업 처리 (생성, 이동, 삭제 등)
@@ -263,15 +293,155 @@ async def get_filesystem_structure(
         raise HTTPException(status_code=500, detail=f"Error fetching filesystem structure: {str(e)}")
 
 @router.post("/query")
-async def query_document(query: str = Form(...)):
-    """문서 질의응답 엔드포인트"""
-    from db.database import engine  # 기존 엔진을 임포트
+async def query_document(
+    query: str = Form(...),
+    shortlist_size: Optional[int] = Form(None, ge=1, le=1000, description="2단계 검색에서 다시 정렬할 후보 수"),
+    k: Optional[int] = Form(None, ge=1, le=50, description="답변에 사용할 문서 수"),
+    fetch_k: Optional[int] = Form(None, ge=1, le=1000, description="MMR에 넘길 후보 문서 수"),
+    mmr_lambda: Optional[float] = Form(None, ge=0, le=1, description="MMR 관련성 가중치 (1이면 관련성만 사용)"),
+    path: Optional[str] = Form(None, description="검색할 폴더 경로 (하위 폴더 포함, 없으면 전체 문서)"),
+    rerank: Optional[bool] = Form(None, description="cross-encoder 재순위 사용 여부 (없으면 서버 설정)"),
+    current_user: User = Depends(get_current_user)
+):
+    """문서 질의응답 엔드포인트
 
-    docs = process_query(query,engine)
+    현재 사용자의 문서(path를 주면 그 폴더와 하위 폴더의 문서)에서만 검색한다.
+    비슷한 질의의 답변이 같은 문서 집합 버전으로 캐시되어 있으면 검색과 LLM 호출 없이 반환한다.
+    임베딩, DB 조회, LLM 호출을 모두 비동기로 기다리므로 워커 하나가 여러 질의를 동시에 처리한다.
+    """
+    from db.database import get_async_engine
+    from db import crud
+    from rag.embeddings import aembed_query
+    from rag.answer_cache import get_answer_cache_options, get_answer_sources, lookup_cached_answer, store_cached_answer
+
+    engine = get_async_engine()
+    # 답변을 만들기 전에 버전을 읽어야 그 사이에 문서가 바뀌어도 오래된 답변이 새 버전으로 저장되지 않는다.
+    corpus_version = await crud.aget_corpus_version(engine, current_user.id)
+    options = get_answer_cache_options(
+        shortlist_size=shortlist_size, k=k, fetch_k=fetch_k, mmr_lambda=mmr_lambda, path=path, rerank=rerank
+    )
+    query_embedding = await aembed_query(query)
+
+    cached = await lookup_cached_answer(engine, current_user.id, corpus_version, query, query_embedding, options)
+    if cached is not None:
+        return {"answer": cached["answer"], "sources": cached["sources"], "cached": True}
+
+    docs = await aprocess_query(
+        query, engine, shortlist_size, k, fetch_k, mmr_lambda, query_embedding,
+        owner_id=current_user.id, path_prefix=path, rerank=rerank
+    )
+
+    answer, answered = await aget_llms_answer(docs, query)
+
+    # 처리 중 오류가 나면 docs는 오류 메시지 문자열이므로 캐시하지 않는다. LLM 호출이 실패한 답변도 캐시하지 않는다.
+    sources = get_answer_sources(docs) if isinstance(docs, list) else []
+    if isinstance(docs, list) and answered:
+        await store_cached_answer(engine, current_user.id, corpus_version, query, query_embedding, answer, sources, options)
 
-    answer = get_llms_answer(docs, query)
+    return {"answer": answer, "sources": sources, "cached": False}
 
-    return {"answer": answer} 
+
+@router.post("/query/batch")
+async def query_documents_batch(
+    queries: List[str] = Form(..., description="질문 목록 (같은 필드를 여러 번 보낸다)"),
+    k: Optional[int] = Form(None, ge=1, le=50, description="질문마다 답변에 사용할 문서 수"),
+    fetch_k: Optional[int] = Form(None, ge=1, le=1000, description="질문마다 MMR에 넘길 후보 문서 수"),
+    mmr_lambda: Optional[float] = Form(None, ge=0, le=1, description="MMR 관련성 가중치 (1이면 관련성만 사용)"),
+    path: Optional[str] = Form(None, description="검색할 폴더 경로 (하위 폴더 포함, 없으면 전체 문서)"),
+    rerank: Optional[bool] = Form(None, description="cross-encoder 재순위 사용 여부 (없으면 서버 설정)"),
+    current_user: User = Depends(get_current_user)
+):
+    """여러 질문을 한 번에 처리하는 문서 질의응답 엔드포인트
+
+    질문들을 한 번의 임베딩 호출로 임베딩하고, 답변 캐시에 없는 질문의 후보를 한 쿼리로 가져온다.
+    질문별 MMR과 답변 생성은 QUERY_BATCH_CONCURRENCY개까지 동시에 실행한다.
+    결과는 질문 순서대로 {"query", "answer", "sources", "cached"} 리스트로 반환한다.
+    """
+    import asyncio
+    from config.settings import QUERY_BATCH_MAX_SIZE, QUERY_BATCH_CONCURRENCY
+    from db.database import get_async_engine
+    from db import crud
+    from rag.embeddings import aembed_queries
+    from rag.answer_cache import get_answer_cache_options, get_answer_sources, lookup_cached_answer, store_cached_answer
+
+    if len(queries) > QUERY_BATCH_MAX_SIZE:
+        raise HTTPException(status_code=400, detail=f"한 번에 최대 {QUERY_BATCH_MAX_SIZE}개의 질문만 보낼 수 있습니다.")
+
+    engine = get_async_engine()
+    corpus_version = await crud.aget_corpus_version(engine, current_user.id)
+    # 배치 검색은 전문 검색 후보를 합치지 않으므로 단일 질의의 답변과 따로 캐시한다.
+    options = get_answer_cache_options(
+        k=k, fetch_k=fetch_k, mmr_lambda=mmr_lambda, path=path, rerank=rerank, batch=True
+    )
+    query_embeddings = await aembed_queries(queries)
+    semaphore = asyncio.Semaphore(max(1, QUERY_BATCH_CONCURRENCY))
+
+    async def lookup(query, query_embedding):
+        async with semaphore:
+            return await lookup_cached_answer(engine, current_user.id, corpus_version, query, query_embedding, options)
+
+    results = [None] * len(queries)
+    cached_answers = await asyncio.gather(*[
+        lookup(query, query_embedding) for query, query_embedding in zip(queries, query_embeddings)
+    ])
+    for i, cached in enumerate(cached_answers):
+        if cached is not None:
+            results[i] = {"query": queries[i], "answer": cached["answer"], "sources": cached["sources"], "cached": True}
+
+    uncached = [i for i, result in enumerate(results) if result is None]
+    docs_list = await aprocess_query_batch(
+        [queries[i] for i in uncached], engine, k, fetch_k, mmr_lambda,
+        query_embeddings=[query_embeddings[i] for i in uncached],
+        owner_id=current_user.id, path_prefix=path, rerank=rerank
+    )
+
+    async def answer(i, docs):
+        async with semaphore:
+            answer, answered = await aget_llms_answer(docs, queries[i])
+            # 처리 중 오류가 나면 docs는 오류 메시지 문자열이므로 캐시하지 않는다. LLM 호출이 실패한 답변도 캐시하지 않는다.
+            sources = get_answer_sources(docs) if isinstance(docs, list) else []
+            if isinstance(docs, list) and answered:
+                await store_cached_answer(
+                    engine, current_user.id, corpus_version, queries[i], query_embeddings[i], answer, sources, options
+                )
+            results[i] = {"query": queries[i], "answer": answer, "sources": sources, "cached": False}
+
+    await asyncio.gather(*[answer(i, docs) for i, docs in zip(uncached, docs_list)])
+    return {"results": results}
+
+
+@router.get("/jobs")
+def get_ingestion_jobs(
+    job_ids: List[int] = Query(None, description="조회할 작업 id 목록 (없으면 최근 작업)"),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """문서 수집 작업 상태 조회 (파일별 진행 단계: parsed, chunked, embedded, indexed)"""
+    from db import crud
+    try:
+        jobs = crud.get_ingestion_jobs(db, current_user.id, job_ids)
+        return {
+            "jobs": [
+                {
+                    "job_id": job.id,
+                    "document_id": job.document_id,
+                    "name": job.file_name,
+                    "path": job.file_path,
+                    "mode": job.mode,
+                    "status": job.status,
+                    "stage": job.stage,
+                    "attempts": job.attempts,
+                    "max_attempts": job.max_attempts,
+                    "error": job.error,
+                    "created_at": job.created_at,
+                    "updated_at": job.updated_at,
+                    "finished_at": job.finished_at,
+                }
+                for job in jobs
+            ]
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching ingestion jobs: {str(e)}")
 
 
 
@@ -332,23 +502,30 @@ async def process_directory_uploads(current_upload_path, directory_structure, cu
     return results
 
 
-async def process_file_uploads(files, current_upload_path, current_user, db):
+async def process_file_uploads(files, current_upload_path, current_user, db, replace: bool = False):
     """파일 업로드 처리"""
     from db import crud
     # 결과가 저장될 리스트를 미리 선언
     results = []
     user_id = current_user.id
-    user_username = current_user.username
+    # 문서를 등록하거나 교체했으면 답변 캐시를 무효화한다.
+    changed = False
 
     try:
     # 3-2. 해당 디렉토리에 포함된 파일 처리
         for upload_file in files:
 
+            # 교체 모드: 같은 경로에 같은 이름의 내 문서가 있으면 그 문서를 교체한다.
+            existing_document = find_replaceable_document(db, upload_file, current_upload_path, user_id) if replace else None
+            if existing_document:
+                replace_results = await replace_file_upload(db, upload_file, existing_document, current_upload_path, user_id)
+                results.extend(replace_results)
+                changed = changed or any(result.get("status") == "replaced" for result in replace_results)
+                continue
+
             # 파일 이름을 추출 & 파일 이름 중복 처리.
             file_name = set_filename(upload_file, db)
-
-            # s3 key 생성
-            s3_key = f"uploads/{user_username}/{file_name}"
+            check_supported_file(file_name)
 
             # 파일 경로 설정
             file_path, file_path_dir = set_file_path(file_name, upload_file, current_upload_path)
@@ -357,60 +534,134 @@ async def process_file_uploads(files, current_upload_path, current_user, db):
             parent_id = crud.get_directory_id_by_path(db, file_path_dir)
 
             # 파일 업로드 처리 시작
-            # <파일의 내용을 여러 번 재사용하기 위해 메모리에 로드.>
-            file_content = await upload_file.read()
-
             # 문서
 
-            # s3 업로드
-            s3_upload_result = await upload_file_to_s3(upload_file, s3_key, file_name, file_path)
+            # s3 업로드. 파일을 읽으면서 내용 해시를 계산하고, 같은 내용의 파일이 이미 있으면 업로드하지 않는다.
+            content_sha256, size = hash_upload_file(upload_file)
+            s3_upload_result, s3_key = await store_upload_blob(db, upload_file, file_name, file_path, content_sha256, size)
             results.append(s3_upload_result)
+            if s3_upload_result["status"] != "success":
+                continue
 
-            # 문서 저장
-            document_id = await process_document(
-                        file_name=file_name,
-                        file_path=file_path,
-                        file_content=file_content,
-                        user_id=user_id,
-                        db=db,
-                        s3_key=s3_key
-                    )
-
-            # 디렉토리 테이블에 저장할 데이터 준비
-            directory_value_dict = {
-                "id": document_id,
-                "name": file_name,
-                "path": file_path,
-                "is_directory": False,
-                "parent_id": parent_id,
-                "created_at": datetime.now().isoformat()
-            }
-            # 디렉토리 테이블에 정보 저장
-            results.append(store_directory_table(db, directory_value_dict, user_id))
+            document_id = None
+            try:
+                # 문서 정보 저장 (파싱, 청킹, 임베딩은 작업 큐의 워커가 처리한다)
+                document_id = register_document(file_name, user_id, db, s3_key, content_sha256).id
+
+                # 디렉토리 테이블에 저장할 데이터 준비
+                directory_value_dict = {
+                    "id": document_id,
+                    "name": file_name,
+                    "path": file_path,
+                    "is_directory": False,
+                    "parent_id": parent_id,
+                    "created_at": datetime.now().isoformat()
+                }
+                # 디렉토리 테이블에 정보 저장
+                directory_result = store_directory_table(db, directory_value_dict, user_id)
+
+                # 문서 수집 작업 등록. 진행 상황은 /jobs 엔드포인트에서 job_id로 조회한다.
+                # 같은 내용의 문서가 이미 수집되어 있으면 청크와 임베딩을 복제하고 완료된 작업으로 기록한다.
+                job = ingest_or_reuse_chunks(db, content_sha256, document_id, user_id, file_name, file_path, s3_key)
+            except Exception:
+                discard_failed_upload(db, document_id, content_sha256, s3_key)
+                raise
+            directory_result["job_id"] = job.id
+            directory_result["job_status"] = job.status
+            results.append(directory_result)
+            changed = True
     except Exception as e:
         print(e)
+        db.rollback()
+    if changed:
+        # 처리된 업로드는 모두 commit되었으므로 일부만 처리된 경우에도 버전을 올린다.
+        crud.bump_corpus_version(db, user_id)
     return results
 
 
+def find_replaceable_document(db: Session, upload_file: any, current_upload_path: str, user_id: int):
+    """업로드 파일과 같은 경로, 같은 이름의 사용자 문서를 찾는다. 없으면 None."""
+    from db import crud
+    file_name = os.path.basename(upload_file.filename)
+    document = crud.get_file_info_by_filename(db, file_name)
+    if document is None or document.user_id != user_id:
+        return None
+    file_path, _ = set_file_path(file_name, upload_file, current_upload_path)
+    directory = crud.get_directory_by_id(db, document.id)
+    if directory is None or directory.path != file_path:
+        return None
+    return document
+
+
+async def replace_file_upload(db: Session, upload_file: any, document: any, current_upload_path: str, user_id: int):
+    """기존 문서가 새 파일의 blob을 참조하도록 바꾸고 교체(replace) 모드의 수집 작업을 등록한다.
+
+    다른 문서와 공유하는 s3 객체일 수 있으므로 기존 객체를 덮어쓰지 않는다.
+    """
+    from db import crud
+    file_name = document.filename
+    file_path, _ = set_file_path(file_name, upload_file, current_upload_path)
+
+    content_sha256, size = hash_upload_file(upload_file)
+    if content_sha256 == document.content_sha256:
+        # 내용이 같으면 다시 수집하지 않는다.
+        return [{
+            "type": "file",
+            "id": str(document.id),
+            "name": file_name,
+            "path": file_path,
+            "status": "unchanged"
+        }]
+
+    s3_upload_result, s3_key = await store_upload_blob(db, upload_file, file_name, file_path, content_sha256, size)
+    if s3_upload_result["status"] != "success":
+        return [s3_upload_result]
+
+    previous_content_sha256, previous_s3_key = document.content_sha256, document.s3_key
+    try:
+        crud.update_document_blob(db, document.id, content_sha256, s3_key)
+    except Exception:
+        # 문서가 새 blob을 참조하지 못했으므로 store_upload_blob이 늘린 참조를 놓는다.
+        db.rollback()
+        release_document_blob(db, content_sha256, s3_key)
+        raise
+    release_document_blob(db, previous_content_sha256, previous_s3_key)
+
+    job = crud.enqueue_ingestion_job(db, document.id, user_id, file_name, file_path, s3_key, mode="replace")
+    return [s3_upload_result, {
+        "type": "file",
+        "id": str(document.id),
+        "name": file_name,
+        "path": file_path,
+        "status": "replaced",
+        "job_id": job.id,
+        "job_status": job.status
+    }]
+
+
 async def process_directory_operations(operations, user_id: int, db):
     """디렉토리 작업 처리 (생성, 이동, 삭제 등)"""
     from db import crud
     import asyncio
     results = [] #결과값 객체들이 담김.
+    # 청크 내용이나 문서 이름/경로를 바꾸는 작업이 하나라도 끝났으면 답변 캐시를 무효화한다.
+    # (빈 폴더 생성은 검색 결과에 영향이 없으므로 버전을 올리지 않는다)
+    changed = False
     
     for op in operations:
         op_type = op.get("operation_type")
         reserved_item_id = op.get("item_id", None)
         reserved_item_name = op.get("name", None)
         reserved_path = op.get("target_path", "/")
-        if reserved_item_id:
-            # 아이템의 디렉토리 여부
-            item_is_directory = crud.get_file_is_directory_by_id(db, reserved_item_id)
 
         if op.get("target_path", "/") == "":
             reserved_path = "/"
 
         try:
+            if reserved_item_id:
+                # 아이템의 디렉토리 여부
+                item_is_directory = crud.get_file_is_directory_by_id(db, reserved_item_id)
+
             # 새 폴더 생성
             if op_type == "create":
                 new_folder_id = str(uuid.uuid4())
@@ -664,8 +915,7 @@ async def process_directory_operations(operations, user_id: int, db):
                         crud.update_directory_and_child_dirs(db, reserved_item_id, target_item_original_path, reserved_item_new_name, item_new_path)
 
                         if child_file_ids:
-                            # 파일 처리 (비동기)
-                            tasks = []
+                            # 파일 처리 (경로 정보만 업데이트하며 다시 임베딩하지 않는다)
                             for file_id in child_file_ids:
                                 # 파일의 기존 이름 가져오기
                                 file_original_name = crud.get_file_name_by_id(db, file_id)
@@ -675,17 +925,10 @@ async def process_directory_operations(operations, user_id: int, db):
                                 # 파일이 저장되어 있는 디렉토리 id 가져오기
                                 file_parent_id = crud.get_parent_id_by_id(db, file_id)
                                 print(f"처리 중인 파일 ID: {file_id}")  # 예시: 로그 출력
-                                # 비동기 함수(코루틴 객체) 생성
-                                task = edit_path_and_reupload_document(
-                                    db, user_id, file_id, file_original_name, target_item_original_name, reserved_item_new_name, file_original_path,
-                                    file_parent_id, s3_client, op_type
-                                )
-                                tasks.append(task)
-                            # results_list의 실제 값 확인 필요.
-                            results_list = await asyncio.gather(*tasks)
-                            # 결과를 합치려면
-                            for result in results_list:
-                                results.extend(result)
+                                results.extend(edit_document_path(
+                                    db, file_id, file_original_name, target_item_original_name, reserved_item_new_name, file_original_path,
+                                    file_parent_id, op_type
+                                ))
                         
                         results.append({
                             "operation": "rename",
@@ -715,7 +958,7 @@ async def process_directory_operations(operations, user_id: int, db):
                 else:
                     # 파일인 경우 아래 블럭을 함수화 할 수 있는지 확인.
                     # 필요한 변수 reserved_item_id, 
-                    results.extend(await rename_and_reupload_document(db, user_id, reserved_item_id, target_item_original_name, target_item_original_path, reserved_item_new_name, target_item_parent_id, s3_client, op_type))
+                    results.extend(rename_document(db, reserved_item_id, target_item_original_name, target_item_original_path, reserved_item_new_name, s3_client, op_type))
             
             # 항목 복사
             elif op_type == "copy":
@@ -833,35 +1076,16 @@ async def process_directory_operations(operations, user_id: int, db):
                                     child_file_new_path = child_file_original_path.replace(target_item_original_name,target_new_name).replace(child_file_original_name,child_file_new_name)
                                     
                                     child_file_new_parent_id = crud.get_directory_id_by_path(db,child_file_new_path.replace("/"+child_file_new_name,""))
-                                    # s3로 복사
-                                    # 버킷 내 다른 위치로 파일 복사
-                                    s3_client.copy_object(
-                                        Bucket=S3_BUCKET_NAME,
-                                        CopySource={'Bucket': S3_BUCKET_NAME, 'Key': child_file_original_s3_key},
-                                        Key=child_file_new_s3_key
-                                    )
-                                    # s3 에서 해당 파일 데이터를 가져오기.
-                                    response = s3_client.get_object(
-                                        Bucket=S3_BUCKET_NAME,
-                                        Key=child_file_new_s3_key
-                                    )
                                     # 저장될 데이터를 일반화
                                     id = child_file_new_id
                                     name = child_file_new_name
                                     path = child_file_new_path
                                     parent_id = child_file_new_parent_id
                                     s3_key = child_file_new_s3_key
-                                    file_content = response['Body'].read()  # file_content는 bytes 타입
                         
-                                    # 문서 새로 저장
-                                    await process_document(
-                                                    file_name=name,
-                                                    file_path=path,
-                                                    file_content=file_content,
-                                                    user_id=user_id,
-                                                    db=db,
-                                                    s3_key=s3_key
-                                                )                        
+                                    # s3 객체 복사(내용 해시가 있는 문서는 blob 공유)와 청크 준비
+                                    # 같은 내용의 수집된 문서가 있으면 청크를 복제하고, 없으면 수집 작업을 등록한다.
+                                    copy_document_content(db, child_file, id, user_id, name, path, child_file_original_s3_key, s3_key)
                                     # 디렉토리 테이블에 저장할 데이터 준비
                                     directory_value_dict = {
                                         "id": id,
@@ -957,35 +1181,16 @@ async def process_directory_operations(operations, user_id: int, db):
                                         # 1. 경로 부분 변경, 2. 기존 파일 이름을 새 파일 이름으로 교체.
                                     child_file_new_path = child_file_original_path.replace(target_item_original_name,target_new_name).replace(child_file_original_name,child_file_new_name)
                                     child_file_new_parent_id = crud.get_directory_id_by_path(db,child_file_new_path.replace("/"+child_file_new_name,""))
-                                    # s3로 복사
-                                    # 버킷 내 다른 위치로 파일 복사
-                                    s3_client.copy_object(
-                                        Bucket=S3_BUCKET_NAME,
-                                        CopySource={'Bucket': S3_BUCKET_NAME, 'Key': child_file_original_s3_key},
-                                        Key=child_file_new_s3_key
-                                    )
-                                    # s3 에서 해당 파일 데이터를 가져오기.
-                                    response = s3_client.get_object(
-                                        Bucket=S3_BUCKET_NAME,
-                                        Key=child_file_new_s3_key
-                                    )
                                     # 저장될 데이터를 일반화
                                     id = child_file_new_id
                                     name = child_file_new_name
                                     path = child_file_new_path
                                     parent_id = child_file_new_parent_id
                                     s3_key = child_file_new_s3_key
-                                    file_content = response['Body'].read()  # file_content는 bytes 타입
                         
-                                    # 문서 새로 저장
-                                    await process_document(
-                                                    file_name=name,
-                                                    file_path=path,
-                                                    file_content=file_content,
-                                                    user_id=user_id,
-                                                    db=db,
-                                                    s3_key=s3_key
-                                                )                        
+                                    # s3 객체 복사(내용 해시가 있는 문서는 blob 공유)와 청크 준비
+                                    # 같은 내용의 수집된 문서가 있으면 청크를 복제하고, 없으면 수집 작업을 등록한다.
+                                    copy_document_content(db, child_file, id, user_id, name, path, child_file_original_s3_key, s3_key)
                                     # 디렉토리 테이블에 저장할 데이터 준비
                                     directory_value_dict = {
                                         "id": id,
@@ -1086,34 +1291,15 @@ async def process_directory_operations(operations, user_id: int, db):
                                     # 1. 경로 부분 변경, 2. 기존 파일 이름을 새 파일 이름으로 교체.
                                 child_file_new_path = child_file_original_path.replace(parent_path_of_target,"").replace(child_file_original_name,child_file_new_name)
                                 child_file_new_parent_id = crud.get_directory_id_by_path(db,child_file_new_path.replace("/"+child_file_new_name,""))
-                                # s3로 복사
-                                # 버킷 내 다른 위치로 파일 복사
-                                s3_client.copy_object(
-                                    Bucket=S3_BUCKET_NAME,
-                                    CopySource={'Bucket': S3_BUCKET_NAME, 'Key': child_file_original_s3_key},
-                                    Key=child_file_new_s3_key
-                                )
-                                # s3 에서 해당 파일 데이터를 가져오기.
-                                response = s3_client.get_object(
-                                    Bucket=S3_BUCKET_NAME,
-                                    Key=child_file_new_s3_key
-                                )
                                 # 저장될 데이터를 일반화
                                 id = child_file_new_id
                                 name = child_file_new_name
                                 path = child_file_new_path
                                 parent_id = child_file_new_parent_id
                                 s3_key = child_file_new_s3_key
-                                file_content = response['Body'].read()  # file_content는 bytes 타입
-                                # 문서 새로 저장
-                                await process_document(
-                                                file_name=name,
-                                                file_path=path,
-                                                file_content=file_content,
-                                                user_id=user_id,
-                                                db=db,
-                                                s3_key=s3_key
-                                            )                        
+                                # s3 객체 복사(내용 해시가 있는 문서는 blob 공유)와 청크 준비
+                                # 같은 내용의 수집된 문서가 있으면 청크를 복제하고, 없으면 수집 작업을 등록한다.
+                                copy_document_content(db, child_file, id, user_id, name, path, child_file_original_s3_key, s3_key)
                                 # 디렉토리 테이블에 저장할 데이터 준비
                                 directory_value_dict = {
                                     "id": id,
@@ -1217,34 +1403,15 @@ async def process_directory_operations(operations, user_id: int, db):
                                 
                                 child_file_new_parent_id = crud.get_directory_id_by_path(db,child_file_new_path.replace("/"+child_file_new_name,"",1))
                                 
-                                # s3로 복사
-                                # 버킷 내 다른 위치로 파일 복사
-                                s3_client.copy_object(
-                                    Bucket=S3_BUCKET_NAME,
-                                    CopySource={'Bucket': S3_BUCKET_NAME, 'Key': child_file_original_s3_key},
-                                    Key=child_file_new_s3_key
-                                )
-                                # s3 에서 해당 파일 데이터를 가져오기.
-                                response = s3_client.get_object(
-                                    Bucket=S3_BUCKET_NAME,
-                                    Key=child_file_new_s3_key
-                                )
                                 # 저장될 데이터를 일반화
                                 id = child_file_new_id
                                 name = child_file_new_name
                                 path = child_file_new_path
                                 parent_id = child_file_new_parent_id
                                 s3_key = child_file_new_s3_key
-                                file_content = response['Body'].read()  # file_content는 bytes 타입
-                                # 문서 새로 저장
-                                await process_document(
-                                                file_name=name,
-                                                file_path=path,
-                                                file_content=file_content,
-                                                user_id=user_id,
-                                                db=db,
-                                                s3_key=s3_key
-                                            )                        
+                                # s3 객체 복사(내용 해시가 있는 문서는 blob 공유)와 청크 준비
+                                # 같은 내용의 수집된 문서가 있으면 청크를 복제하고, 없으면 수집 작업을 등록한다.
+                                copy_document_content(db, child_file, id, user_id, name, path, child_file_original_s3_key, s3_key)
                                 # 디렉토리 테이블에 저장할 데이터 준비
                                 directory_value_dict = {
                                     "id": id,
@@ -1352,11 +1519,6 @@ async def process_directory_operations(operations, user_id: int, db):
                         # 파일의 새 부모 설정
                             # 기존 부모 id.
                         
-                        # s3 에서 해당 파일 데이터를 가져오기.
-                        response = s3_client.get_object(
-                            Bucket=S3_BUCKET_NAME,
-                            Key=target_item_original_s3_key
-                        )
                         
                         # 저장될 데이터를 일반화
                         id = target_item_new_id
@@ -1364,7 +1526,6 @@ async def process_directory_operations(operations, user_id: int, db):
                         path = target_item_new_path
                         parent_id = file_parent_id
                         s3_key = target_item_new_s3_key
-                        file_content = response['Body'].read()  # file_content는 bytes 타입                             
                     elif (target_item_copied_path != '/') and (target_destination_path == "/"):# 목적지가 루트인 경우
                         
 
@@ -1373,11 +1534,6 @@ async def process_directory_operations(operations, user_id: int, db):
                         # 파일의 새 부모 설정
                         target_item_new_parent_id = "root"
 
-                        # s3 에서 해당 파일 데이터를 가져오기.
-                        response = s3_client.get_object(
-                            Bucket=S3_BUCKET_NAME,
-                            Key=target_item_original_s3_key
-                        )
                         
                         # 저장될 데이터를 일반화
                         id = target_item_new_id
@@ -1385,7 +1541,6 @@ async def process_directory_operations(operations, user_id: int, db):
                         path = target_item_new_path
                         parent_id = target_item_new_parent_id
                         s3_key = target_item_new_s3_key
-                        file_content = response['Body'].read()  # file_content는 bytes 타입
 
                     else: # 목적지가 루트가 아닌 경우
                         
@@ -1393,11 +1548,6 @@ async def process_directory_operations(operations, user_id: int, db):
                         target_item_new_path = target_destination_path + "/" + target_item_new_name
                         # 파일의 새 부모 설정
                         target_item_new_parent_id = crud.get_directory_id_by_path(db, target_destination_path)
-                        # s3 에서 해당 파일 데이터를 가져오기.
-                        response = s3_client.get_object(
-                            Bucket=S3_BUCKET_NAME,
-                            Key=target_item_original_s3_key
-                        )
 
                         # 저장될 데이터를 일반화
                         id = target_item_new_id
@@ -1405,24 +1555,10 @@ async def process_directory_operations(operations, user_id: int, db):
                         path = target_item_new_path
                         parent_id = target_item_new_parent_id
                         s3_key = target_item_new_s3_key
-                        file_content = response['Body'].read()  # file_content는 bytes 타입                           
-
-                    # s3로 복사
-                    # 버킷 내 다른 위치로 파일 복사
-                    s3_client.copy_object(
-                        Bucket=S3_BUCKET_NAME,
-                        CopySource={'Bucket': S3_BUCKET_NAME, 'Key': target_item_original_s3_key},
-                        Key=s3_key
-                    )                        
-                    # 문서 새로 저장
-                    await process_document(
-                                    file_name=name,
-                                    file_path=path,
-                                    file_content=file_content,
-                                    user_id=user_id,
-                                    db=db,
-                                    s3_key=s3_key
-                                )                        
+
+                    # s3 객체 복사(내용 해시가 있는 문서는 blob 공유)와 청크 준비
+                    # 같은 내용의 수집된 문서가 있으면 청크를 복제하고, 없으면 수집 작업을 등록한다.
+                    copy_document_content(db, target_item_id, id, user_id, name, path, target_item_original_s3_key, s3_key)
                     # 디렉토리 테이블에 저장할 데이터 준비
                     directory_value_dict = {
                         "id": id,
@@ -1443,12 +1579,20 @@ async def process_directory_operations(operations, user_id: int, db):
                 })
         
         except Exception as e:
+            # 실패한 작업의 commit되지 않은 변경을 버리고 다음 작업을 처리한다.
+            db.rollback()
             results.append({
                 "operation": op_type,
                 "status": "error",
                 "error": str(e)
             })
+        else:
+            if op_type in CORPUS_CHANGING_OPERATIONS:
+                changed = True
     
+    if changed:
+        # 각 작업은 commit된 뒤이므로 일부만 처리된 경우에도 버전을 올린다.
+        crud.bump_corpus_version(db, user_id)
     return results
 
 
@@ -1838,6 +1982,107 @@ async def upload_file_to_s3(upload_file: any, s3_key: str, file_name: str, file_
         }
 
 
+def hash_upload_file(upload_file: any) -> tuple:
+    """업로드 파일을 조금씩 읽으면서 SHA-256 해시와 크기를 계산한다. 파일 포인터는 처음으로 되돌린다."""
+    file_object = upload_file.file if hasattr(upload_file, "file") else upload_file
+    file_object.seek(0)
+    sha256 = hashlib.sha256()
+    size = 0
+    while True:
+        block = file_object.read(1024 * 1024)
+        if not block:
+            break
+        sha256.update(block)
+        size += len(block)
+    file_object.seek(0)
+    return sha256.hexdigest(), size
+
+
+async def store_upload_blob(db: Session, upload_file: any, file_name: str, file_path: str, content_sha256: str, size: int):
+    """업로드 파일을 내용 해시 기반 s3_key(blobs/<sha256>)로 저장하고 (업로드 결과, s3_key)를 반환한다.
+
+    같은 내용의 blob이 이미 업로드되어 있으면 s3에 다시 올리지 않고 참조 수만 늘린다.
+    다른 업로드가 같은 blob을 아직 올리는 중이거나 실패했으면 객체가 없을 수 있으므로 직접 업로드한다. (같은 키, 같은 내용)
+    """
+    from db import crud
+    s3_key = f"blobs/{content_sha256}"
+    _, uploaded = crud.add_blob_reference(db, content_sha256, s3_key, size)
+    if uploaded:
+        return {
+            "type": "file",
+            "id": None,
+            "name": file_name,
+            "path": file_path,
+            "status": "success",
+            "deduplicated": True
+        }, s3_key
+
+    s3_upload_result = await upload_file_to_s3(upload_file, s3_key, file_name, file_path)
+    if s3_upload_result["status"] == "success":
+        crud.mark_blob_uploaded(db, content_sha256)
+    else:
+        crud.release_blob_reference(db, content_sha256)
+    return s3_upload_result, s3_key
+
+
+def release_document_blob(db: Session, content_sha256: str, s3_key: str):
+    """문서가 참조하던 s3 객체를 놓는다. 공유하는 blob은 마지막 참조가 사라질 때만 s3에서 삭제한다."""
+    from db import crud
+    if content_sha256:
+        s3_key = crud.release_blob_reference(db, content_sha256)
+    if s3_key:
+        s3_client.delete_object(Bucket=S3_BUCKET_NAME, Key=s3_key)
+
+
+def discard_failed_upload(db: Session, document_id: int, content_sha256: str, s3_key: str):
+    """등록 도중 실패한 업로드의 문서 레코드를 삭제하고 store_upload_blob이 늘린 blob 참조를 놓는다."""
+    from db import crud
+    db.rollback()
+    try:
+        if document_id is not None:
+            crud.delete_document_by_id(db, document_id)
+        release_document_blob(db, content_sha256, s3_key)
+    except Exception as e:
+        print(f"실패한 업로드 정리 오류 (blob {content_sha256}): {str(e)}")
+
+
+def ingest_or_reuse_chunks(db: Session, content_sha256: str, document_id: int, user_id: int, name: str, path: str, s3_key: str):
+    """내용이 같은 문서가 이미 수집되어 있으면 청크와 임베딩을 복제하고, 없으면 수집 작업을 등록한다. 작업 레코드를 반환한다."""
+    from db import crud
+    source_document_id = crud.get_ingested_document_id_by_sha256(db, content_sha256, document_id) if content_sha256 else None
+    if source_document_id is None:
+        return crud.enqueue_ingestion_job(db, document_id, user_id, name, path, s3_key)
+
+    chunk_count = crud.clone_document_chunks(db, source_document_id, document_id, name, path)
+    print(f"문서 {source_document_id}의 청크 {chunk_count}개를 문서 {document_id}로 복제했습니다.")
+    return crud.record_cloned_ingestion_job(db, document_id, user_id, name, path, s3_key)
+
+
+def copy_document_content(db: Session, source_document_id: any, document_id: int, user_id: int, name: str, path: str, source_s3_key: str, s3_key: str):
+    """복사한 문서의 파일과 청크를 준비한다.
+
+    내용 해시가 있는 문서는 s3 객체를 복사하지 않고 blob 참조 수만 늘린 뒤 청크를 복제한다.
+    이전 방식의 문서는 s3 객체를 복사하고 수집 작업을 등록한다.
+    """
+    from db import crud
+    source_document = crud.get_document_by_id(db, source_document_id)
+    if source_document is not None and source_document.content_sha256:
+        crud.add_blob_reference(db, source_document.content_sha256, source_document.s3_key)
+        crud.update_document_blob(db, document_id, source_document.content_sha256, source_document.s3_key)
+        return ingest_or_reuse_chunks(
+            db, source_document.content_sha256, document_id, user_id, name, path, source_document.s3_key
+        )
+
+    # 버킷 내 다른 위치로 파일 복사
+    s3_client.copy_object(
+        Bucket=S3_BUCKET_NAME,
+        CopySource={'Bucket': S3_BUCKET_NAME, 'Key': source_s3_key},
+        Key=s3_key
+    )
+    # 문서 수집 작업 등록 (파싱, 청킹, 임베딩은 작업 큐의 워커가 처리한다)
+    return crud.enqueue_ingestion_job(db, document_id, user_id, name, path, s3_key)
+
+
 def delete_directory(db: Session, reserved_item_id: str, item_name: str, item_path: str):
     """디렉토리 삭제"""
     from db import crud
@@ -1857,12 +2102,12 @@ def delete_file(db: Session, reserved_item_id: str, item_name: str, item_path: s
     """파일 삭제"""
     from db import crud
     # 파일 삭제
-     # 삭제를 위해 s3_key값을 검색해서 가져오기
-    s3_key = crud.get_s3_key_by_id(db, int(reserved_item_id))
-    # s3에서 삭제
-    s3_client.delete_object(Bucket=S3_BUCKET_NAME, Key=s3_key)
+     # 삭제를 위해 s3_key값과 내용 해시를 검색해서 가져오기
+    document = crud.get_document_by_id(db, int(reserved_item_id))
     # documents 테이블에서 해당 id의 데이터를 삭제하면서 document_chunks, directories 테이블에서 데이터 삭제.
     crud.delete_document_by_id(db, reserved_item_id)
+    # s3에서 삭제 (다른 문서와 공유하는 blob이면 마지막 참조일 때만 삭제)
+    release_document_blob(db, document.content_sha256, document.s3_key)
 
     return {
         "operation": "delete",
@@ -1873,142 +2118,80 @@ def delete_file(db: Session, reserved_item_id: str, item_name: str, item_path: s
         "status": "success" 
     }
 
-async def rename_and_reupload_document(db: Session, user_id: int, reserved_item_id: str, target_item_original_name: str, target_item_original_path: str, reserved_item_new_name: str, target_item_parent_id: str, s3_client: boto3.client, op_type: any=None):
-    """문서 이름 변경 및 재업로드.
+def rename_document(db: Session, reserved_item_id: str, target_item_original_name: str, target_item_original_path: str, reserved_item_new_name: str, s3_client: boto3.client, op_type: any=None):
+    """문서 이름 변경.
     주요 매개변수: 
     reserved_item_id : 아이템의 id.
     target_item_original_name : 아이템의 기존 이름.
     target_item_original_path : 아이템의 기존 경로.
     reserved_item_new_name : 아이템의 새로운 이름.
-    target_item_parent_id : 아이템의 부모 아이디.
 
     함수의 작업:
-    1. 기존 아이템의 s3_key 가져오기
-    2. s3에서 해당 파일 데이터 가져오기
-    3. 기존 파일을 삭제
-    4. 새로운 이름과 경로, s3_key로 s3에 새 파일을 업로드
-    5. 새로운 정보로 문서 저장 (document_chunks, documents 테이블에 저장)
-    6. 새로운 정보를 디렉토리 테이블에 저장
-    
+    1. 새 이름(중복 처리), 새 경로, 새 s3_key 준비
+    2. s3 내부에서 새 s3_key로 파일 복사 후 기존 파일 삭제 (파일 내용을 내려받지 않음)
+    3. documents, directories 테이블의 이름/경로 업데이트
+    4. document_chunks 테이블의 문서 이름/경로 업데이트
+
+    청크 임베딩은 문서 내용만으로 계산되므로 다시 파싱하거나 임베딩하지 않는다.
     """
     from db import crud
-    import io
-    results = []
-    # 기존 아이템의 s3_key 가져오기
-    target_item_original_s3_key = crud.get_s3_key_by_id(db, reserved_item_id)                    
-    # s3에서 해당 파일 데이터 가져오기
-    response = s3_client.get_object(
-        Bucket=S3_BUCKET_NAME,
-        Key=target_item_original_s3_key
-    )
-
-    # response에서 컨텐츠 타입, 파일 데이터 추출
-    # 컨텐츠 타입 추출
-    content_type = response.get("ContentType")
-    # ext = content_type.split("/")[-1]  # 결과: 'pdf', 'docx', 'hwp', 'hwpx' 등등
-    # 파일 데이터를 바이트 타입으로 가져오기
-    data = response['Body'].read()  # data는 bytes 타입
-    file_content = data
-    # s3 업로드를 위해 파일 객체로 포장.
-    file_obj = io.BytesIO(data)
-
-    # 기존 파일을 삭제
-    results.append(delete_file(db, reserved_item_id, target_item_original_name, target_item_original_path, s3_client))
-
-    # 새로운 이름과 경로, s3_key로 s3에 새 파일을 업로드
-    # 새 s3_key 생성
     # 이름 중복 확인
     target_item_new_name = generate_unique_filename(db, reserved_item_new_name)
-    # 새 s3_key 생성
-    target_item_new_s3_key = target_item_original_s3_key.replace(target_item_original_name, target_item_new_name)
+    # 기존 아이템의 s3_key 가져오기
+    document = crud.get_document_by_id(db, reserved_item_id)
+    target_item_original_s3_key = document.s3_key
+    # 새 s3_key 생성. 내용 해시 기반 s3_key는 이름과 무관하므로 그대로 사용한다.
+    if document.content_sha256:
+        target_item_new_s3_key = target_item_original_s3_key
+    else:
+        target_item_new_s3_key = target_item_original_s3_key.replace(target_item_original_name, target_item_new_name)
     # 아이템의 새 주소 설정
     target_item_new_path = target_item_original_path.replace(target_item_original_name, target_item_new_name)
-    # 새 파일을 s3로 업로드
-    results.append(await upload_file_to_s3(file_obj, target_item_new_s3_key, reserved_item_new_name, target_item_new_path, content_type))
-
-    # 새로운 정보로 문서 저장
-    # 문서 저장
-    document_id = await process_document(
-                file_name=target_item_new_name,
-                file_path=target_item_new_path,
-                file_content=file_content,
-                user_id=user_id,
-                db=db,
-                s3_key=target_item_new_s3_key
-            )
-                    
-    # 새로운 정보를 디렉토리 테이블에 저장
-    # 디렉토리 테이블에 저장할 데이터 준비
-    directory_value_dict = {
-        "id": document_id,
+
+    # s3 내부에서 새 s3_key로 복사하고 기존 파일을 삭제
+    if target_item_new_s3_key != target_item_original_s3_key:
+        s3_client.copy_object(
+            Bucket=S3_BUCKET_NAME,
+            CopySource={'Bucket': S3_BUCKET_NAME, 'Key': target_item_original_s3_key},
+            Key=target_item_new_s3_key
+        )
+        s3_client.delete_object(Bucket=S3_BUCKET_NAME, Key=target_item_original_s3_key)
+
+    # 메타데이터만 업데이트
+    crud.update_document_filename_and_s3_key(db, reserved_item_id, target_item_new_name, target_item_new_s3_key)
+    crud.update_item_name_and_path(db, reserved_item_id, target_item_new_name, target_item_new_path)
+    crud.update_document_chunks_metadata(db, reserved_item_id, target_item_new_name, target_item_new_path)
+
+    return [{
+        "operation": op_type,
+        "type": "file",
+        "id": reserved_item_id,
         "name": target_item_new_name,
-        "path": target_item_new_path,
-        "is_directory": False,
-        "parent_id": target_item_parent_id,
-        "created_at": datetime.now().isoformat(),
-        "operation":op_type
-    }
-    # 디렉토리 테이블에 저장
-    results.append(store_directory_table(db, directory_value_dict, user_id))
-    return results
+        "old_path": target_item_original_path,
+        "new_path": target_item_new_path,
+        "status": "success"
+    }]
 
-# edit_path_and_reupload_document
-async def edit_path_and_reupload_document(db: Session, user_id: int, file_id: str, file_original_name: str, target_item_original_name: str, reserved_item_new_name: str, file_original_path: str, file_parent_id: str, s3_client: boto3.client, op_type: any=None):
-    """문서의 경로를 변경 및 재업로드"""
+# edit_document_path
+def edit_document_path(db: Session, file_id: str, file_original_name: str, target_item_original_name: str, reserved_item_new_name: str, file_original_path: str, file_parent_id: str, op_type: any=None):
+    """상위 디렉토리 이름 변경에 따라 문서의 경로만 변경 (s3_key와 임베딩은 그대로 사용)"""
     from db import crud
-    import io
-    results = []
-    # 기존 아이템의 s3_key 가져오기
-    target_item_original_s3_key = crud.get_s3_key_by_id(db, file_id)                    
-    # s3에서 해당 파일 데이터 가져오기
-    response = s3_client.get_object(
-        Bucket=S3_BUCKET_NAME,
-        Key=target_item_original_s3_key
-    )
-    # 컨텐츠 타입 추출
-    content_type = response.get("ContentType")
-    ext = content_type.split("/")[-1]  # 결과: 'pdf', 'docx', 'hwp', 'hwpx' 등등
-    # 파일 데이터를 바이트 타입으로 가져오기
-    data = response['Body'].read()  # data는 bytes 타입
-    file_content = data
-    # s3 업로드를 위해 파일 객체로 포장.
-    file_obj = io.BytesIO(data)
-
-    # 기존 파일을 삭제
-    results.append(delete_file(db, file_id, file_original_name, file_original_path, s3_client))
-
-    # 새로운 경로를 주고 s3에 새 파일을 업로드
-    # 기존에 쓰던 s3_key 사용 : target_item_original_s3_key
     # 파일의 새 주소 설정
     target_item_new_path = file_original_path.replace(target_item_original_name, reserved_item_new_name)
-    # 새 파일을 s3로 업로드
-    results.append(await upload_file_to_s3(file_obj, target_item_original_s3_key, file_original_name, target_item_new_path, content_type))
-
-    # 새로운 정보로 문서 저장
-    # 문서 저장
-    document_id = await process_document(
-                file_name=file_original_name,
-                file_path=target_item_new_path,
-                file_content=file_content,
-                user_id=user_id,
-                db=db,
-                s3_key=target_item_original_s3_key
-            )
-                    
-    # 새로운 정보를 디렉토리 테이블에 저장
-    # 디렉토리 테이블에 저장할 데이터 준비
-    directory_value_dict = {
-        "id": document_id,
+
+    # directories 테이블과 document_chunks 테이블의 경로 업데이트
+    crud.update_item_path_and_parent_id(db, file_id, target_item_new_path, file_parent_id)
+    crud.update_document_chunks_metadata(db, file_id, file_original_name, target_item_new_path)
+
+    return [{
+        "operation": op_type,
+        "type": "file",
+        "id": file_id,
         "name": file_original_name,
-        "path": target_item_new_path,
-        "is_directory": False,
-        "parent_id": file_parent_id,
-        "created_at": datetime.now().isoformat(),
-        "operation":op_type
-    }
-    # 디렉토리 테이블에 저장
-    results.append(store_directory_table(db, directory_value_dict, user_id))
-    return results
+        "old_path": file_original_path,
+        "new_path": target_item_new_path,
+        "status": "success"
+    }]
 
 
 async def copy_file(db: Session, target_item_id: str, target_destination_path: str, user_id: int, op_type: str):
@@ -2047,11 +2230,6 @@ async def copy_file(db: Session, target_item_id: str, target_destination_path: s
         target_item_new_path = target_destination_path + target_item_new_name
         # 파일의 새 부모 설정
         target_item_new_parent_id = "root"
-        # s3 에서 해당 파일 데이터를 가져오기.
-        response = s3_client.get_object(
-            Bucket=S3_BUCKET_NAME,
-            Key=target_item_original_s3_key
-        )
         
         # 저장될 데이터를 일반화
         id = target_item_new_id
@@ -2059,7 +2237,6 @@ async def copy_file(db: Session, target_item_id: str, target_destination_path: s
         path = target_item_new_path
         parent_id = target_item_new_parent_id
         s3_key = target_item_new_s3_key
-        file_content = response['Body'].read()  # file_content는 bytes 타입
         
     elif target_item_original_path_without_name == target_destination_path: # 아이템을 복사한 위치와 붙여넣기 하는 위치가 동일할 경우.
                         
@@ -2068,11 +2245,6 @@ async def copy_file(db: Session, target_item_id: str, target_destination_path: s
         # 파일의 새 부모 설정
             # 기존 부모 id.
                         
-        # s3 에서 해당 파일 데이터를 가져오기.
-        response = s3_client.get_object(
-            Bucket=S3_BUCKET_NAME,
-            Key=target_item_original_s3_key
-        )
                         
         # 저장될 데이터를 일반화
         id = target_item_new_id
@@ -2080,7 +2252,6 @@ async def copy_file(db: Session, target_item_id: str, target_destination_path: s
         path = target_item_new_path
         parent_id = file_parent_id
         s3_key = target_item_new_s3_key
-        file_content = response['Body'].read()  # file_content는 bytes 타입                             
 
     else: # 목적지가 루트가 아닌 경우
                         
@@ -2088,11 +2259,6 @@ async def copy_file(db: Session, target_item_id: str, target_destination_path: s
         target_item_new_path = target_destination_path + "/" + target_item_new_name
         # 파일의 새 부모 설정
         target_item_new_parent_id = crud.get_directory_id_by_path(db, target_destination_path)
-        # s3 에서 해당 파일 데이터를 가져오기.
-        response = s3_client.get_object(
-            Bucket=S3_BUCKET_NAME,
-            Key=target_item_original_s3_key
-        )
         
         # 저장될 데이터를 일반화
         id = target_item_new_id
@@ -2100,24 +2266,10 @@ async def copy_file(db: Session, target_item_id: str, target_destination_path: s
         path = target_item_new_path
         parent_id = target_item_new_parent_id
         s3_key = target_item_new_s3_key
-        file_content = response['Body'].read()  # file_content는 bytes 타입                           
 
-    # s3로 복사
-    # 버킷 내 다른 위치로 파일 복사
-    s3_client.copy_object(
-        Bucket=S3_BUCKET_NAME,
-        CopySource={'Bucket': S3_BUCKET_NAME, 'Key': target_item_original_s3_key},
-        Key=s3_key
-    )                        
-    # 문서 새로 저장
-    await process_document(
-                    file_name=name,
-                    file_path=path,
-                    file_content=file_content,
-                    user_id=user_id,
-                    db=db,
-                    s3_key=s3_key
-                )                        
+    # s3 객체 복사(내용 해시가 있는 문서는 blob 공유)와 청크 준비
+    # 같은 내용의 수집된 문서가 있으면 청크를 복제하고, 없으면 수집 작업을 등록한다.
+    copy_document_content(db, target_item_id, id, user_id, name, path, target_item_original_s3_key, s3_key)
     # 디렉토리 테이블에 저장할 데이터 준비
     directory_value_dict = {
         "id": id,
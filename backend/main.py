@@ -1,6 +1,7 @@
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
 import os
+import threading
 
 # 추적을 위한 .env 설정 불러오기
 from dotenv import load_dotenv
@@ -15,8 +16,9 @@ logging.langsmith("25-1_RAG_Project")
 from db.database import init_db
 from fast_api.router import api_router
 from fast_api.middlewares import setup_middlewares
-from config.settings import UPLOAD_DIR
+from config.settings import UPLOAD_DIR, TEST_MODE, INGESTION_RUN_IN_APP, INGESTION_WORKERS
 from rag.vectorstore import manually_create_vector_extension
+from db.migrations import run_migrations, ensure_vector_index
 
 
 # 애플리케이션 시작 시 DB 초기화
@@ -27,8 +29,29 @@ async def lifespan(app: FastAPI):
     
     # pgvector 익스텐션 생성
     manually_create_vector_extension(engine)
+
+    # 기존 테이블 스키마 마이그레이션
+    run_migrations(engine)
+
+    # 벡터 인덱스 생성은 오래 걸릴 수 있으므로 시작을 막지 않도록 백그라운드에서 실행
+    if not TEST_MODE:
+        threading.Thread(target=ensure_vector_index, args=(engine,), daemon=True).start()
+
+    # 문서 수집 작업 큐를 처리할 워커 프로세스 실행
+    worker_processes = []
+    if INGESTION_RUN_IN_APP and not TEST_MODE and INGESTION_WORKERS > 0:
+        from worker import start_worker_pool
+        worker_processes = start_worker_pool(INGESTION_WORKERS)
     yield
 
+    if worker_processes:
+        from worker import stop_worker_pool
+        stop_worker_pool(worker_processes)
+
+    # 문서 파싱용 프로세스 풀 종료
+    from rag.file_load import shutdown_parser_pool
+    shutdown_parser_pool()
+
 
 # FastAPI 앱 생성
 app = FastAPI(title="RAG Document Search API", lifespan=lifespan)
@@ -0,0 +1,119 @@
+# 질의 답변 캐시.
+# 새 질의의 임베딩이 캐시된 질의 임베딩과 충분히 비슷하면 검색과 LLM 호출 없이 저장된 답변과 출처를 반환한다.
+# 항목은 만들 때의 사용자 문서 집합 버전(users.corpus_version)에 묶여 있어 문서가 바뀌면 사용되지 않는다.
+# 질의 경로에서 호출되므로 비동기 엔진(db.database.get_async_engine)으로 조회/저장한다.
+
+import json
+from datetime import datetime, timedelta
+
+from sqlalchemy import text, delete, insert, select
+
+
+def get_answer_cache_options(**options) -> str:
+    """답변에 영향을 주는 검색 옵션을 캐시 키 문자열로 변환"""
+    return json.dumps(options, sort_keys=True)
+
+
+def get_answer_sources(docs: list) -> list:
+    """답변에 사용한 문서의 이름/경로 목록 (중복 제거, 순서 유지)"""
+    sources = []
+    for doc in docs:
+        source = {
+            "document_name": doc.metadata.get("document_name"),
+            "document_path": doc.metadata.get("document_path"),
+        }
+        if source not in sources:
+            sources.append(source)
+    return sources
+
+
+async def lookup_cached_answer(engine, user_id: int, corpus_version: int, query: str, query_embedding, options: str):
+    """가장 비슷한 캐시된 질의의 답변을 {"answer", "sources", "similarity"} 형태로 반환. 임계값 미만이면 None
+
+    ANSWER_CACHE_EXACT_MATCH이면 정규화한 질의 문장도 같아야 한다.
+    ("제3조"와 "제5조"처럼 조항 번호나 숫자만 다른 질문은 임베딩 유사도가 임계값을 넘기 쉽다)
+    """
+    from config.settings import (
+        ANSWER_CACHE_ENABLED, ANSWER_CACHE_SIMILARITY_THRESHOLD, ANSWER_CACHE_TTL, ANSWER_CACHE_EXACT_MATCH,
+        EMBEDDING_MODEL
+    )
+    from rag.embedding_cache import normalize_query
+    from rag.retriever import to_query_vector
+
+    if not ANSWER_CACHE_ENABLED:
+        return None
+    try:
+        async with engine.connect() as connection:
+            result = await connection.execute(
+                text("""
+                SELECT query, answer, sources, 1 - (query_embedding <=> CAST(:query_embedding AS vector)) AS similarity
+                FROM answer_cache
+                WHERE user_id = :user_id
+                AND corpus_version = :corpus_version
+                AND model = :model
+                AND options = :options
+                AND created_at > :created_after
+                ORDER BY query_embedding <=> CAST(:query_embedding AS vector)
+                LIMIT 1
+                """),
+                {
+                    "query_embedding": to_query_vector(query_embedding),
+                    "user_id": user_id,
+                    "corpus_version": corpus_version,
+                    "model": EMBEDDING_MODEL,
+                    "options": options,
+                    "created_after": datetime.now() - timedelta(seconds=ANSWER_CACHE_TTL),
+                }
+            )
+            row = result.first()
+    except Exception as e:
+        # 캐시 장애가 답변 자체를 막지 않도록 한다.
+        print(f"답변 캐시 조회 오류: {str(e)}")
+        return None
+
+    if row is None or row.similarity < ANSWER_CACHE_SIMILARITY_THRESHOLD:
+        return None
+    if ANSWER_CACHE_EXACT_MATCH and normalize_query(row.query or "") != normalize_query(query):
+        return None
+    print(f"답변 캐시 적중 (질의 유사도 {row.similarity:.3f})")
+    return {"answer": row.answer, "sources": row.sources or [], "similarity": row.similarity}
+
+
+async def store_cached_answer(engine, user_id: int, corpus_version: int, query: str, query_embedding, answer: str, sources: list, options: str):
+    """답변을 캐시에 저장하고, 이전 문서 집합 버전의 항목과 최대 개수를 넘는 오래된 항목을 삭제"""
+    from db.models import AnswerCache
+    from config.settings import ANSWER_CACHE_ENABLED, ANSWER_CACHE_MAX_ENTRIES_PER_USER, EMBEDDING_MODEL
+
+    if not ANSWER_CACHE_ENABLED:
+        return
+    try:
+        # 한 트랜잭션으로 저장하고 정리한다.
+        async with engine.begin() as connection:
+            await connection.execute(insert(AnswerCache).values(
+                user_id=user_id,
+                corpus_version=corpus_version,
+                model=EMBEDDING_MODEL,
+                options=options,
+                query=query,
+                query_embedding=list(query_embedding),
+                answer=answer,
+                sources=sources,
+                created_at=datetime.now()
+            ))
+            # 이전 버전의 답변은 다시 사용되지 않는다.
+            await connection.execute(delete(AnswerCache).where(
+                AnswerCache.user_id == user_id,
+                AnswerCache.corpus_version < corpus_version
+            ))
+            newest = (
+                select(AnswerCache.id)
+                .where(AnswerCache.user_id == user_id)
+                .order_by(AnswerCache.created_at.desc())
+                .limit(ANSWER_CACHE_MAX_ENTRIES_PER_USER)
+            )
+            await connection.execute(delete(AnswerCache).where(
+                AnswerCache.user_id == user_id,
+                AnswerCache.id.not_in(newest)
+            ))
+    except Exception as e:
+        print(f"답변 캐시 저장 오류: {str(e)}")
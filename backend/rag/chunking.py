@@ -3,12 +3,10 @@ from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_text_splitters import CharacterTextSplitter
 
 
-def chunk_documents(documents, filepath, file_name):
-    """문서 청킹"""
-    print("Splitting text into chunks...")
-
+def get_text_splitter():
+    """청킹에 사용하는 텍스트 분할기"""
     # CharacterTextSplitter를 사용하여 텍스트를 청크(chunk)로 분할하는 코드
-    text_splitter = RecursiveCharacterTextSplitter(
+    return RecursiveCharacterTextSplitter(
         # 분할된 텍스트 청크의 최대 크기를 지정합니다 (문자 수).
         chunk_size=600,
         # 분할된 텍스트 청크 간의 중복되는 문자 수를 지정합니다.
@@ -18,6 +16,13 @@ def chunk_documents(documents, filepath, file_name):
         # 구분자를 정규 표현식으로 처리할지 여부를 지정합니다.
         is_separator_regex=False,
     )
+
+
+def chunk_documents(documents, filepath, file_name):
+    """문서 청킹"""
+    print("Splitting text into chunks...")
+
+    text_splitter = get_text_splitter()
     
     metadatas = [
         {
@@ -47,3 +52,24 @@ def chunk_documents(documents, filepath, file_name):
     # 서버 로그에 출력
     print(f"Total {total_chunks} chunks created from {len(documents)} pages of a single document")
     return chunked_documents
+
+
+async def iter_chunk_documents(pages, filepath, file_name):
+    """페이지 스트림을 받아 페이지마다 청크 리스트를 내보낸다. (전체 청크 리스트를 만들지 않는다)"""
+    from contextlib import aclosing
+
+    text_splitter = get_text_splitter()
+    metadatas = [{"document_name": file_name, "document_path": filepath}]
+
+    total_chunks = 0
+    page_count = 0
+    async with aclosing(pages) as pages:
+        async for page in pages:
+            page_count += 1
+            chunks = text_splitter.create_documents([page], metadatas=metadatas)
+            total_chunks += len(chunks)
+            if chunks:
+                yield chunks
+
+    # 서버 로그에 출력
+    print(f"Total {total_chunks} chunks created from {page_count} pages of a single document")
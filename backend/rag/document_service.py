@@ -10,15 +10,13 @@ from db import crud
 from db.models import Document
 
 # 함수 불러오기
-from rag.embeddings import embed_query
-from rag.vectorstore import save_to_vector_store
-from rag.retriever import search_similarity, do_mmr
-from rag.file_load import (
-    load_pdf, 
-    load_docx, 
-    load_hwp, 
-)
-from rag.chunking import chunk_documents
+from rag.embeddings import aembed_query, aembed_queries
+from rag.embedding_cache import get_query_embedding_cache_stats
+from rag.vectorstore import save_stream_to_vector_store
+from rag.retriever import asearch_similarity, ado_mmr, asearch_similarity_batch
+from rag.reranker import arerank_candidates
+from rag.file_load import iter_document_pages
+from rag.chunking import iter_chunk_documents
 
 
 
@@ -29,111 +27,185 @@ def get_all_documents(db: Session):
     return db.query(Document).all()
 
 
-async def process_document(
-    file_name: str,
-    file_path: str,
-    file_content: bytes,
-    user_id: int, 
-    db: Session,
-    s3_key: str
-) -> int:
-    """문서 업로드 및 처리"""
+SUPPORTED_EXTENSIONS = ['pdf', 'docx', 'hwp', 'hwpx']
 
-    # 1. 업로드 된 파일의 형식을 확인한다.
-    # 파일 확장자 추출
-    file_extension = file_name.split('.')[-1].lower()
 
-    # 지원되는 파일 형식 확인
-    if file_extension not in ['pdf', 'docx', 'hwp', 'hwpx']:
+def get_file_extension(file_name: str) -> str:
+    """파일 확장자 추출"""
+    return file_name.split('.')[-1].lower()
+
+
+def check_supported_file(file_name: str):
+    """지원되는 파일 형식인지 확인. 지원되지 않으면 HTTP 400"""
+    if get_file_extension(file_name) not in SUPPORTED_EXTENSIONS:
         raise HTTPException(
             status_code=400, 
             detail="지원되지 않는 파일 형식입니다. PDF, DOCX, HWP 또는 HWPX 파일만 업로드 가능합니다."
         )
-    
-    # 파일의 경로 # 아래 코드는 삭제
-    # file_path = path+file.filename
-
-    # 파일의 이름 추출
-    # file_name = os.path.basename(file_path)
 
 
+def register_document(
+    file_name: str,
+    user_id: int,
+    db: Session,
+    s3_key: str,
+    content_sha256: str = None
+) -> Document:
+    """업로드 된 파일의 형식을 확인하고 documents 테이블에 문서 정보를 저장한 뒤 그 레코드를 반환"""
 
+    # 1. 업로드 된 파일의 형식을 확인한다.
+    # 지원되는 파일 형식 확인
+    check_supported_file(file_name)
 
+    # 2. 업로드 된 파일의 정보를 db에 저장한다.
+    # 업로드 된 파일의 이름, 업로드 시간, 사용자 아이디를 DB의 documents 테이블에 저장.
+    # 문서 정보 저장 중 오류 발생 시 예외 처리
     try:
-        
-
-        # 2. 업로드 된 파일의 정보를 db에 저장한다.
-        # 업로드 된 파일의 이름, 업로드 시간, 사용자 아이디를 DB의 documents 테이블에 저장.
-        # DB의 documents 테이블에 문서 정보 저장. # 이 코드는 이 위치에 있어야 함.
-        
-        # 문서 정보 저장 중 오류 발생 시 예외 처리
-        try:
-            if crud.get_file_info_by_filename(db, file_name):
-                # 만약 이 파일이 db에 이미 존재한다면 이 파일을 또 저장하지 않는다.
-                pass
-            else:
-                crud.add_documents(db, file_name, s3_key, datetime.now(), user_id)
-        except Exception as e:
-            print(f"Error adding documents: {str(e)}")
-            print(traceback.format_exc())
-            raise HTTPException(status_code=500, detail=f"Error adding documents: {str(e)}")
-
-
-
-        # 3. 파일 형식에 따라 문서 로드
-        # 파일을 읽어 문자열 리스트로 반환하는 작업을 한다.
-        if file_extension == 'pdf':
-            documents = await load_pdf(file_content) # file 대신 file_content를 매개변수로 전달
-        elif file_extension == 'docx':
-            documents = await load_docx(file_content) # file 대신 file_content를 매개변수로 전달
-        elif file_extension in ['hwp', 'hwpx']:
-            documents = await load_hwp(file_content, file_extension)
-
-
-
-        # 4. 문서 청킹
-        # 문자열 리스트화 된 문서를 조각으로 나눈다.
-        chunked_documents = chunk_documents(documents, file_path, file_name)
-        # 4. 문서 청킹
-
-
-        # 5. 벡터 스토어에 청크들을 저장
-        # 청크들을 임베딩하여 벡터 스토어에 저장한다.
-        try:
-            # chunked_documents를 db로 보낼때 비동기 처리를 하면 됨.
-            # chunked_documents는 문서에 따라 여러 개의 데이터가 들어가니까 비동기 처리를 해야 함.
-            document_id = await save_to_vector_store(db, chunked_documents, file_name, file_path)
-            print(f"Document {file_name} uploaded and processed successfully")
-        except Exception as ve:
-            print(f"벡터 저장 중 오류 발생 {str(ve)}")
-            print(traceback.format_exc())
-
-
-        return document_id
-        
+        document = crud.get_file_info_by_filename(db, file_name)
+        if document:
+            # 만약 이 파일이 db에 이미 존재한다면 이 파일을 또 저장하지 않는다.
+            return document
+        return crud.add_documents(db, file_name, s3_key, datetime.now(), user_id, content_sha256)
     except Exception as e:
-        # 오류 발생 시 처리
-        db.rollback()  # 트랜잭션 롤백
-        print(f"Error processing document: {str(e)}")
+        print(f"Error adding documents: {str(e)}")
         print(traceback.format_exc())
-        raise HTTPException(status_code=500, detail=f"Error processing document: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error adding documents: {str(e)}")
 
 
-def process_query(query: str, engine) -> str:
-    """사용자의 쿼리를 처리"""
+async def ingest_document(
+    document_id: int,
+    file_name: str,
+    file_path: str,
+    file_content: bytes,
+    db: Session,
+    on_stage=None,
+    replace: bool = False
+) -> int:
+    """등록된 문서를 파싱, 청킹, 임베딩하여 벡터 스토어에 저장한다.
+
+    replace가 True이면 문서의 기존 청크와 비교하여 추가/변경된 청크만 임베딩하고 없어진 청크는 삭제한다.
+
+    페이지는 추출되는 대로 청킹되어 임베딩/저장 단계로 넘어가므로 전체 페이지나 청크 리스트를 메모리에 올리지 않는다.
+    on_stage가 주어지면 단계 이름('parsed', 'chunked', 'embedded')으로 호출한다.
+    파싱과 청킹은 함께 진행되므로 'parsed'는 페이지 스트림이, 'chunked'는 청크 스트림이 끝난 시점에 호출된다.
+    """
+    from contextlib import aclosing
+
+    def report(stage: str):
+        if on_stage is not None:
+            on_stage(stage)
+
+    async def report_when_exhausted(stream, stage: str):
+        # 스트림을 끝까지 읽었을 때만 단계를 기록한다. (중간에 닫히거나 오류가 나면 기록하지 않는다)
+        async with aclosing(stream) as stream:
+            async for item in stream:
+                yield item
+        report(stage)
+
+    file_extension = get_file_extension(file_name)
+
+    # 3. 파일 형식에 따라 문서를 페이지 단위로 로드
+    pages = report_when_exhausted(iter_document_pages(file_content, file_extension), "parsed")
+
+    # 4. 문서 청킹
+    # 페이지마다 조각으로 나눈다.
+    chunk_stream = report_when_exhausted(iter_chunk_documents(pages, file_path, file_name), "chunked")
+
+    # 5. 벡터 스토어에 청크들을 저장
+    # 청크들을 임베딩하여 벡터 스토어에 저장한다.
+    document_id = await save_stream_to_vector_store(
+        db, chunk_stream, file_name, file_path, document_id=document_id, replace=replace
+    )
+    report("embedded")
+    print(f"Document {file_name} uploaded and processed successfully")
+    return document_id
+
+
+async def aprocess_query(
+    query: str,
+    engine,
+    shortlist_size: int = None,
+    k: int = None,
+    fetch_k: int = None,
+    lambda_mult: float = None,
+    query_embedding: list = None,
+    owner_id: int = None,
+    path_prefix: str = None,
+    rerank: bool = None
+):
+    """사용자의 쿼리를 처리하여 MMR로 고른 문서 리스트를 반환 (engine: AsyncEngine)
+
+    shortlist_size: 2단계 검색의 1단계 후보 수, k/fetch_k/lambda_mult: MMR 설정.
+    query_embedding을 주면 질의를 다시 임베딩하지 않는다.
+    owner_id, path_prefix를 주면 그 사용자의 문서(폴더와 하위 폴더)에서만 검색한다.
+    rerank가 True이면 MMR 전에 cross-encoder로 후보를 재순위한다. (없으면 RERANK_ENABLED)
+    임베딩, 벡터 검색, 청크 조회, 재순위를 모두 기다리는 동안 이벤트 루프를 막지 않으므로
+    워커 하나가 여러 질의를 동시에 처리할 수 있다.
+    """
+    from config.settings import RERANK_ENABLED
     try:
-        # 쿼리 임베딩
-        embed_query_data = embed_query(query)
+        embed_query_data = query_embedding if query_embedding is not None else await aembed_query(query)
+        cache_stats = get_query_embedding_cache_stats()
+        print(f"질의 임베딩 캐시 통계: 적중 {cache_stats['hits']}, 실패 {cache_stats['misses']}, 적중률 {cache_stats['hit_rate']:.1%}")
 
-        # 검색 결과 가져오기
-        search_similarity_result = search_similarity(embed_query_data, engine)
+        search_similarity_result = await asearch_similarity(
+            embed_query_data, engine, shortlist_size, fetch_k, owner_id=owner_id, path_prefix=path_prefix, query=query
+        )
 
-        # MMR 알고리즘 수행
-        docs = do_mmr(search_similarity_result)
+        if RERANK_ENABLED if rerank is None else rerank:
+            search_similarity_result = await arerank_candidates(query, search_similarity_result, engine)
 
-        return docs
+        return await ado_mmr(search_similarity_result, engine, k, lambda_mult)
     except Exception as e:
         print(f"Error processing query: {str(e)}")
         print(traceback.format_exc())
-        # 오류 발생 시 사용자 친화적인 메시지 반환
-        return f"처리 중 오류가 발생했습니다. 관리자에게 문의하세요. 오류 정보: {str(e)[:100]}..." 
\ No newline at end of file
+        return f"처리 중 오류가 발생했습니다. 관리자에게 문의하세요. 오류 정보: {str(e)[:100]}..."
+
+
+async def aprocess_query_batch(
+    queries: list,
+    engine,
+    k: int = None,
+    fetch_k: int = None,
+    lambda_mult: float = None,
+    query_embeddings: list = None,
+    owner_id: int = None,
+    path_prefix: str = None,
+    rerank: bool = None
+) -> list:
+    """여러 질의를 한 번에 처리하여 질의 순서대로 문서 리스트(오류가 나면 오류 메시지)를 반환 (engine: AsyncEngine)
+
+    질의 임베딩(query_embeddings가 없을 때)과 벡터 검색은 질의 수와 관계없이 한 번씩만 호출하고,
+    질의별 재순위와 MMR은 QUERY_BATCH_CONCURRENCY개까지 동시에 실행한다.
+    """
+    import asyncio
+    from config.settings import RERANK_ENABLED, QUERY_BATCH_CONCURRENCY
+
+    try:
+        if query_embeddings is None:
+            query_embeddings = await aembed_queries(queries)
+        candidates = await asearch_similarity_batch(
+            query_embeddings, engine, fetch_k, owner_id=owner_id, path_prefix=path_prefix
+        )
+    except Exception as e:
+        print(f"Error processing query batch: {str(e)}")
+        print(traceback.format_exc())
+        return [f"처리 중 오류가 발생했습니다. 관리자에게 문의하세요. 오류 정보: {str(e)[:100]}..." for _ in queries]
+
+    semaphore = asyncio.Semaphore(max(1, QUERY_BATCH_CONCURRENCY))
+
+    async def select_documents(query: str, search_similarity_result: dict):
+        async with semaphore:
+            try:
+                if RERANK_ENABLED if rerank is None else rerank:
+                    search_similarity_result = await arerank_candidates(query, search_similarity_result, engine)
+                return await ado_mmr(search_similarity_result, engine, k, lambda_mult)
+            except Exception as e:
+                print(f"Error processing query: {str(e)}")
+                print(traceback.format_exc())
+                return f"처리 중 오류가 발생했습니다. 관리자에게 문의하세요. 오류 정보: {str(e)[:100]}..."
+
+    return await asyncio.gather(*[
+        select_documents(query, search_similarity_result)
+        for query, search_similarity_result in zip(queries, candidates)
+    ])
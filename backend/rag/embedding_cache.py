@@ -0,0 +1,331 @@
+# 내용 기반(content-addressed) 임베딩 캐시.
+# 이름 변경, 이동, 복사 시 텍스트가 같으면 임베딩 API를 다시 호출하지 않는다.
+# 질의 임베딩은 프로세스 메모리의 LRU/TTL 캐시에 보관하여 같은 질문에 임베딩 API를 다시 호출하지 않는다.
+
+import asyncio
+import hashlib
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime
+
+from sqlalchemy import select, func, delete, update, text
+
+
+# 프로세스 단위 캐시 적중/실패 카운터
+_stats_lock = threading.Lock()
+_stats = {
+    "hits": 0,
+    "misses": 0,
+    "saved_characters": 0,  # 캐시 적중으로 임베딩하지 않은 글자 수 (임베딩 비용 절감량 추정치)
+}
+
+
+# 프로세스 단위 질의 임베딩 캐시: (공급자:모델:차원, 정규화된 질의) -> (만료 시각, 임베딩)
+_query_cache_lock = threading.Lock()
+_query_cache = OrderedDict()
+_query_stats = {
+    "hits": 0,
+    "misses": 0,
+}
+
+
+# 캐시 관리 상태: 마지막 사용 시각을 갱신할 (모델 -> 해시 집합), 마지막 갱신 시각, 마지막 정리 이후 저장 횟수
+_maintenance_lock = threading.Lock()
+_pending_touches = {}
+_maintenance = {
+    "last_touch_flush": 0.0,
+    "stores_since_evict": 0,
+}
+
+
+def hash_text(text: str) -> str:
+    """임베딩할 텍스트의 SHA-256 해시를 반환"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def record_cache_result(hits: int, misses: int, saved_characters: int = 0):
+    """캐시 적중/실패 횟수를 누적"""
+    with _stats_lock:
+        _stats["hits"] += hits
+        _stats["misses"] += misses
+        _stats["saved_characters"] += saved_characters
+
+
+def get_embedding_cache_stats() -> dict:
+    """임베딩 캐시 적중/실패 통계를 반환"""
+    with _stats_lock:
+        stats = dict(_stats)
+    total = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / total if total else 0.0
+    return stats
+
+
+def normalize_query(query: str) -> str:
+    """질의 임베딩 캐시 키로 사용할 정규화된 질의 (유니코드 정규화, 대소문자, 공백 차이 무시)"""
+    return " ".join(unicodedata.normalize("NFKC", query).casefold().split())
+
+
+def lookup_query_embedding(model: str, query: str):
+    """질의 임베딩 캐시에서 임베딩을 찾는다. 없거나 만료되었으면 None"""
+    from config.settings import QUERY_EMBEDDING_CACHE_SIZE
+
+    if QUERY_EMBEDDING_CACHE_SIZE <= 0:
+        return None
+    key = (model, normalize_query(query))
+    with _query_cache_lock:
+        entry = _query_cache.get(key)
+        if entry is not None and entry[0] <= time.monotonic():
+            # TTL이 지난 항목
+            del _query_cache[key]
+            entry = None
+        if entry is None:
+            _query_stats["misses"] += 1
+            return None
+        _query_cache.move_to_end(key)
+        _query_stats["hits"] += 1
+        return entry[1]
+
+
+def store_query_embedding(model: str, query: str, embedding: list):
+    """질의 임베딩을 캐시에 저장하고, 최대 크기를 넘으면 가장 오래 사용되지 않은 항목을 제거"""
+    from config.settings import QUERY_EMBEDDING_CACHE_SIZE, QUERY_EMBEDDING_CACHE_TTL
+
+    if QUERY_EMBEDDING_CACHE_SIZE <= 0:
+        return
+    key = (model, normalize_query(query))
+    with _query_cache_lock:
+        _query_cache[key] = (time.monotonic() + QUERY_EMBEDDING_CACHE_TTL, embedding)
+        _query_cache.move_to_end(key)
+        while len(_query_cache) > QUERY_EMBEDDING_CACHE_SIZE:
+            _query_cache.popitem(last=False)
+
+
+def clear_query_embedding_cache():
+    """질의 임베딩 캐시와 통계를 비운다."""
+    with _query_cache_lock:
+        _query_cache.clear()
+        _query_stats["hits"] = 0
+        _query_stats["misses"] = 0
+
+
+def get_query_embedding_cache_stats() -> dict:
+    """질의 임베딩 캐시 적중/실패 통계를 반환"""
+    with _query_cache_lock:
+        stats = dict(_query_stats)
+        stats["size"] = len(_query_cache)
+    total = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / total if total else 0.0
+    return stats
+
+
+def lookup_cached_embeddings(db, model: str, text_hashes: list) -> dict:
+    """캐시에서 텍스트 해시에 해당하는 임베딩을 찾아 {해시: 임베딩} 형태로 반환"""
+    from db.models import EmbeddingCache
+
+    if not text_hashes:
+        return {}
+
+    stmt = select(EmbeddingCache.text_hash, EmbeddingCache.embedding).where(
+        EmbeddingCache.model == model,
+        EmbeddingCache.text_hash.in_(text_hashes)
+    )
+    found = {row.text_hash: to_float_list(row.embedding) for row in db.execute(stmt)}
+
+    if found:
+        touches = take_pending_touches(model, found)
+        if touches:
+            flush_touches(db, touches)
+    return found
+
+
+def take_pending_touches(model: str, text_hashes) -> dict:
+    """사용한 해시를 모아 두고, 갱신 주기가 지났으면 모아 둔 {모델: 해시 집합}을 꺼내 반환 (아니면 None)"""
+    from config.settings import EMBEDDING_CACHE_TOUCH_INTERVAL
+
+    now = time.monotonic()
+    with _maintenance_lock:
+        _pending_touches.setdefault(model, set()).update(text_hashes)
+        if now - _maintenance["last_touch_flush"] < EMBEDDING_CACHE_TOUCH_INTERVAL:
+            return None
+        _maintenance["last_touch_flush"] = now
+        touches = dict(_pending_touches)
+        _pending_touches.clear()
+    return touches
+
+
+def flush_touches(db, touches: dict):
+    """LRU 제거를 위해 모아 둔 해시의 마지막 사용 시각을 한 번에 갱신"""
+    from db.models import EmbeddingCache
+
+    now = datetime.now()
+    for model, text_hashes in touches.items():
+        db.execute(
+            update(EmbeddingCache)
+            .where(EmbeddingCache.model == model, EmbeddingCache.text_hash.in_(list(text_hashes)))
+            .values(last_used_at=now)
+        )
+    db.commit()
+
+
+def store_cached_embeddings(db, model: str, hashed_embeddings: dict):
+    """새로 계산한 임베딩을 캐시에 저장하고, EMBEDDING_CACHE_EVICT_EVERY번 저장할 때마다 오래된 항목을 정리"""
+    from sqlalchemy.dialects.postgresql import insert as pg_insert
+    from db.models import EmbeddingCache
+    from config.settings import EMBEDDING_CACHE_MAX_ENTRIES, EMBEDDING_CACHE_EVICT_EVERY
+
+    if not hashed_embeddings:
+        return
+
+    now = datetime.now()
+    rows = [
+        {"model": model, "text_hash": text_hash, "embedding": embedding, "created_at": now, "last_used_at": now}
+        for text_hash, embedding in hashed_embeddings.items()
+    ]
+    # 다른 워커가 같은 텍스트를 동시에 저장한 경우는 무시한다.
+    db.execute(pg_insert(EmbeddingCache).values(rows).on_conflict_do_nothing())
+    db.commit()
+
+    with _maintenance_lock:
+        _maintenance["stores_since_evict"] += 1
+        due = _maintenance["stores_since_evict"] >= EMBEDDING_CACHE_EVICT_EVERY
+        if due:
+            _maintenance["stores_since_evict"] = 0
+    if due:
+        evict_embedding_cache(db, EMBEDDING_CACHE_MAX_ENTRIES)
+
+
+def estimate_cache_entries(db) -> int:
+    """통계(pg_class.reltuples)로 추정한 캐시 항목 수. 아직 통계가 없으면 직접 센다."""
+    from db.models import EmbeddingCache
+
+    estimate = db.execute(
+        text("SELECT reltuples::bigint FROM pg_class WHERE oid = 'embedding_cache'::regclass")
+    ).scalar()
+    if estimate is None or estimate < 0:
+        return db.execute(select(func.count()).select_from(EmbeddingCache)).scalar() or 0
+    return estimate
+
+
+def evict_embedding_cache(db, max_entries: int):
+    """캐시 항목 수가 max_entries를 넘으면 가장 오래 사용되지 않은 항목부터 삭제
+
+    추정치가 max_entries 이하이면 아무것도 하지 않는다. 넘으면 최근 사용한 max_entries번째 항목의
+    마지막 사용 시각(last_used_at 인덱스로 찾는다)보다 오래된 항목을 삭제하므로, 추정치가 오래되어도 너무 많이 지우지 않는다.
+    """
+    from db.models import EmbeddingCache
+
+    if estimate_cache_entries(db) <= max_entries:
+        return
+
+    watermark = db.execute(
+        select(EmbeddingCache.last_used_at)
+        .order_by(EmbeddingCache.last_used_at.desc())
+        .offset(max_entries)
+        .limit(1)
+    ).scalar()
+    if watermark is None:
+        return
+
+    result = db.execute(delete(EmbeddingCache).where(EmbeddingCache.last_used_at <= watermark))
+    db.commit()
+    print(f"임베딩 캐시에서 {result.rowcount}개의 오래된 항목을 삭제했습니다.")
+
+
+def to_float_list(embedding) -> list:
+    """DB에서 읽은 임베딩(numpy 배열 등)을 float 리스트로 변환"""
+    if hasattr(embedding, "tolist"):
+        return embedding.tolist()
+    return list(embedding)
+
+
+class CachedEmbeddings:
+    """임베딩 모델 앞에서 임베딩 캐시를 먼저 조회하는 래퍼.
+
+    캐시에 없는 텍스트만 실제 임베딩 모델로 보낸다.
+    일회성 질의가 문서 임베딩을 밀어내지 않도록 문서 임베딩(embed_documents)에만 캐시를 사용한다.
+    """
+
+    def __init__(self, embeddings, model: str):
+        self.embeddings = embeddings
+        self.model = model
+
+    def embed_query(self, text: str) -> list:
+        return self.embeddings.embed_query(text)
+
+    async def aembed_query(self, text: str) -> list:
+        return await self.embeddings.aembed_query(text)
+
+    def embed_documents(self, texts: list) -> list:
+        hashes = [hash_text(text) for text in texts]
+        cached = self._lookup(hashes)
+        missing = self._missing_texts(texts, hashes, cached)
+        if missing:
+            computed = self.embeddings.embed_documents(list(missing.values()))
+            new_embeddings = dict(zip(missing.keys(), computed))
+            self._store(new_embeddings)
+            cached.update(new_embeddings)
+        return [cached[text_hash] for text_hash in hashes]
+
+    async def aembed_documents(self, texts: list) -> list:
+        hashes = [hash_text(text) for text in texts]
+        cached = await asyncio.to_thread(self._lookup, hashes)
+        missing = self._missing_texts(texts, hashes, cached)
+        if missing:
+            computed = await self.embeddings.aembed_documents(list(missing.values()))
+            new_embeddings = dict(zip(missing.keys(), computed))
+            await asyncio.to_thread(self._store, new_embeddings)
+            cached.update(new_embeddings)
+        return [cached[text_hash] for text_hash in hashes]
+
+    def _missing_texts(self, texts, hashes, cached) -> dict:
+        """캐시에 없는 텍스트를 {해시: 텍스트} 형태로 반환하고 통계를 기록 (같은 텍스트는 한 번만 임베딩)"""
+        missing = {}
+        hits = 0
+        saved_characters = 0
+        for text, text_hash in zip(texts, hashes):
+            if text_hash in cached:
+                hits += 1
+                saved_characters += len(text)
+            else:
+                missing.setdefault(text_hash, text)
+        record_cache_result(hits, len(texts) - hits, saved_characters)
+        return missing
+
+    def _lookup(self, hashes: list) -> dict:
+        from db.database import SessionLocal
+        db = SessionLocal()
+        try:
+            return lookup_cached_embeddings(db, self.model, list(set(hashes)))
+        except Exception as e:
+            # 캐시 장애가 임베딩 자체를 막지 않도록 한다.
+            print(f"임베딩 캐시 조회 오류: {str(e)}")
+            db.rollback()
+            return {}
+        finally:
+            db.close()
+
+    def _store(self, hashed_embeddings: dict):
+        from db.database import SessionLocal
+        db = SessionLocal()
+        try:
+            store_cached_embeddings(db, self.model, hashed_embeddings)
+        except Exception as e:
+            print(f"임베딩 캐시 저장 오류: {str(e)}")
+            db.rollback()
+        finally:
+            db.close()
+
+
+def get_cached_embeddings():
+    """설정된 임베딩 모델을 임베딩 캐시로 감싸서 반환"""
+    from rag.embeddings import get_embeddings, get_embedding_model_key
+    from config.settings import EMBEDDING_CACHE_ENABLED, EMBEDDING_PROVIDER
+
+    embeddings = get_embeddings()
+    # 해시 임베딩은 계산 비용이 DB 조회보다 작으므로 캐시를 사용하지 않는다.
+    if not EMBEDDING_CACHE_ENABLED or EMBEDDING_PROVIDER == "hashing":
+        return embeddings
+    # 공급자나 차원이 다르면 모델 이름이 같아도 다른 캐시 항목을 사용한다.
+    return CachedEmbeddings(embeddings, get_embedding_model_key())
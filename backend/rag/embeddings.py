@@ -1,9 +1,124 @@
 
 
+import asyncio
+import hashlib
+import re
+import threading
+
+from langchain_core.embeddings import Embeddings
+
+
+# 프로세스마다 한 번만 만드는 임베딩 클라이언트 (로컬 모델 로딩, HTTP 연결 재사용)
+_embedding_clients = {}
+_embedding_clients_lock = threading.Lock()
+
+
+class LocalEmbeddings(Embeddings):
+    """sentence-transformers 모델을 CPU에서 실행하는 임베딩. 네트워크 왕복 없이 배치 단위로 추론한다."""
+
+    def __init__(self, model_name: str, batch_size: int = 64):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise ImportError("EMBEDDING_PROVIDER=local을 사용하려면 sentence-transformers를 설치해야 합니다.")
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.batch_size = batch_size
+
+    def embed_documents(self, texts: list) -> list:
+        vectors = self.model.encode(
+            texts, batch_size=self.batch_size, normalize_embeddings=True, show_progress_bar=False
+        )
+        return vectors.tolist()
+
+    def embed_query(self, text: str) -> list:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: list) -> list:
+        # 추론은 CPU 작업이므로 이벤트 루프를 막지 않도록 스레드에서 실행한다.
+        return await asyncio.to_thread(self.embed_documents, texts)
+
+    async def aembed_query(self, text: str) -> list:
+        return await asyncio.to_thread(self.embed_query, text)
+
+
+class HashingEmbeddings(Embeddings):
+    """단어와 글자 2-gram을 해시하여 만드는 결정적 임베딩 (테스트/벤치마크용, 외부 호출 없음).
+
+    같은 텍스트는 프로세스와 관계없이 항상 같은 벡터가 되며, 겹치는 단어가 많을수록 코사인 유사도가 높다.
+    """
+
+    def __init__(self, dimension: int):
+        self.dimension = dimension
+
+    def _features(self, text: str) -> list:
+        words = re.findall(r"\w+", text.lower())
+        # 띄어쓰기가 일정하지 않은 한국어를 위해 단어 안의 글자 2-gram도 사용한다.
+        bigrams = [word[i:i + 2] for word in words for i in range(len(word) - 1)]
+        return words + bigrams
+
+    def _embed(self, text: str) -> list:
+        import numpy as np
+
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for feature in self._features(text):
+            digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+            index = int.from_bytes(digest[:7], "little") % self.dimension
+            vector[index] += 1.0 if digest[7] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            # 영벡터는 코사인 거리가 정의되지 않으므로 고정된 단위 벡터를 사용한다.
+            vector[0] = 1.0
+            norm = 1.0
+        return (vector / norm).tolist()
+
+    def embed_documents(self, texts: list) -> list:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> list:
+        return self._embed(text)
+
+    async def aembed_documents(self, texts: list) -> list:
+        return self.embed_documents(texts)
+
+    async def aembed_query(self, text: str) -> list:
+        return self.embed_query(text)
+
+
+def get_embedding_model_key() -> str:
+    """설정된 임베딩을 구분하는 키 (공급자, 모델, 차원). 이 중 하나라도 다르면 같은 텍스트도 다른 벡터가 된다."""
+    from config.settings import EMBEDDING_PROVIDER, EMBEDDING_MODEL, EMBEDDING_DIMENSION
+
+    return f"{EMBEDDING_PROVIDER}:{EMBEDDING_MODEL}:{EMBEDDING_DIMENSION}"
+
+
 def get_embeddings():
-    """임베딩 모델 함수."""
+    """임베딩 모델 함수. EMBEDDING_PROVIDER 설정에 따라 구현을 선택하고, 프로세스마다 한 번만 만들어 재사용한다."""
+    key = get_embedding_model_key()
+    embeddings = _embedding_clients.get(key)
+    if embeddings is None:
+        with _embedding_clients_lock:
+            embeddings = _embedding_clients.get(key)
+            if embeddings is None:
+                embeddings = create_embeddings()
+                _embedding_clients[key] = embeddings
+    return embeddings
+
+
+def create_embeddings():
+    """설정에 맞는 임베딩 클라이언트를 새로 만든다."""
+    from config.settings import EMBEDDING_PROVIDER, EMBEDDING_MODEL, EMBEDDING_DIMENSION, EMBEDDING_BATCH_SIZE
+
+    if EMBEDDING_PROVIDER == "local":
+        return LocalEmbeddings(EMBEDDING_MODEL, EMBEDDING_BATCH_SIZE)
+    if EMBEDDING_PROVIDER == "hashing":
+        return HashingEmbeddings(EMBEDDING_DIMENSION)
+    if EMBEDDING_PROVIDER != "openai":
+        raise ValueError(f"지원되지 않는 EMBEDDING_PROVIDER입니다: {EMBEDDING_PROVIDER}")
+
     from langchain_openai import OpenAIEmbeddings
-    embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
+    # text-embedding-3 모델은 dimensions로 출력 차원을 줄일 수 있다.
+    dimensions = EMBEDDING_DIMENSION if EMBEDDING_MODEL.startswith("text-embedding-3") and EMBEDDING_DIMENSION != 1536 else None
+    embeddings = OpenAIEmbeddings(model=EMBEDDING_MODEL, dimensions=dimensions)
     return embeddings
 
 
@@ -44,8 +159,38 @@ def manually_create_vector_extension(engine):
         return False
 
 
-def embed_query(query: str):
-    """사용자 쿼리를 임베딩 벡터로 변환"""
+async def aembed_query(query: str):
+    """사용자 쿼리를 임베딩 벡터로 변환 (같은 질의는 질의 임베딩 캐시에서 재사용). OpenAI 임베딩은 비동기 클라이언트로 호출하여 이벤트 루프를 막지 않는다."""
+    from rag.embedding_cache import lookup_query_embedding, store_query_embedding
+
+    model_key = get_embedding_model_key()
+
+    cached = lookup_query_embedding(model_key, query)
+    if cached is not None:
+        return cached
+
     embeddings_model = get_embeddings()
-    embeded_query = embeddings_model.embed_query(query)
+    embeded_query = await embeddings_model.aembed_query(query)
+    store_query_embedding(model_key, query, embeded_query)
     return embeded_query
+
+
+async def aembed_queries(queries: list) -> list:
+    """여러 질의를 임베딩 벡터 리스트로 변환. 캐시에 없는 질의만 한 번의 aembed_documents 호출로 임베딩한다."""
+    from rag.embedding_cache import lookup_query_embedding, store_query_embedding
+
+    model_key = get_embedding_model_key()
+
+    embeded_queries = [lookup_query_embedding(model_key, query) for query in queries]
+    # 같은 질의가 여러 번 있으면 한 번만 임베딩한다.
+    missing = list(dict.fromkeys(query for query, embedding in zip(queries, embeded_queries) if embedding is None))
+    if missing:
+        embeddings_model = get_embeddings()
+        new_embeddings = dict(zip(missing, await embeddings_model.aembed_documents(missing)))
+        for query, embedding in new_embeddings.items():
+            store_query_embedding(model_key, query, embedding)
+        embeded_queries = [
+            new_embeddings[query] if embedding is None else embedding
+            for query, embedding in zip(queries, embeded_queries)
+        ]
+    return embeded_queries
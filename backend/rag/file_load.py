@@ -1,131 +1,641 @@
-# 텍스트를 추출한다. 
+# 텍스트를 추출한다.
 # RAG 프로세스 중 문서 로드 단계.
+# 파싱은 CPU를 많이 사용하므로 이벤트 루프가 아닌 프로세스 풀에서 실행한다.
+# iter_*_pages 함수는 페이지를 추출되는 대로 하나씩 내보내므로 문서 크기와 관계없이 메모리 사용량이 일정하다.
 
 import os
 import tempfile
 import subprocess
 import re
+import codecs
+import zipfile
+import asyncio
+import queue
+import threading
+import multiprocessing
+from contextlib import aclosing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
-from langchain_community.document_loaders import PyPDFLoader, TextLoader
 import docx2txt
 
 from io import BytesIO
 from PyPDF2 import PdfReader
 
+
+# 문서 파싱용 프로세스 풀과 프로세스 간 큐를 만드는 매니저 (처음 사용할 때 생성)
+_parser_pool = None
+_parser_manager = None
+
+# pyhwp로 추출한 HWP 텍스트를 파싱 프로세스에서 보내는 블록 크기(바이트)와 큐에 쌓아 둘 수 있는 최대 블록 수
+HWP_STREAM_BLOCK_SIZE = 65536
+HWP_STREAM_QUEUE_SIZE = 8
+
+# 파싱용 프로세스마다 한 번만 만드는 HWP 텍스트 변환기 (XSLT 컴파일 비용을 문서마다 반복하지 않는다)
+_hwp_text_transform = None
+
+
+def get_parser_pool():
+    """문서 파싱용 프로세스 풀을 반환. PARSER_POOL_SIZE가 0이면 None."""
+    global _parser_pool
+    from config.settings import PARSER_POOL_SIZE
+
+    if PARSER_POOL_SIZE <= 0:
+        return None
+    if _parser_pool is None:
+        _parser_pool = ProcessPoolExecutor(
+            max_workers=PARSER_POOL_SIZE,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _parser_pool
+
+
+def get_parser_manager():
+    """파싱용 프로세스와 주고받을 큐/이벤트를 만드는 매니저 (처음 사용할 때 생성)"""
+    global _parser_manager
+    if _parser_manager is None:
+        _parser_manager = multiprocessing.get_context("spawn").Manager()
+    return _parser_manager
+
+
+def shutdown_parser_pool():
+    """문서 파싱용 프로세스 풀 종료"""
+    global _parser_pool, _parser_manager
+    if _parser_pool is not None:
+        _parser_pool.shutdown(wait=False, cancel_futures=True)
+        _parser_pool = None
+    if _parser_manager is not None:
+        _parser_manager.shutdown()
+        _parser_manager = None
+
+
+async def run_in_parser_pool(func, *args):
+    """func(*args)를 파싱용 프로세스 풀에서 실행하고 결과를 기다린다."""
+    global _parser_pool
+    pool = get_parser_pool()
+    if pool is None:
+        return await asyncio.to_thread(func, *args)
+
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(pool, func, *args)
+    except BrokenProcessPool:
+        # 워커 프로세스가 비정상 종료된 경우 다음 요청을 위해 풀을 새로 만든다.
+        _parser_pool = None
+        raise
+
+
+def split_page_ranges(page_count: int, pages_per_task: int) -> list:
+    """page_count 페이지를 pages_per_task 페이지씩의 (시작, 끝) 구간으로 나눈다."""
+    pages_per_task = max(1, pages_per_task)
+    return [(start, min(start + pages_per_task, page_count)) for start in range(0, page_count, pages_per_task)]
+
+
+def get_remaining_time(deadline: float) -> float:
+    """파싱 제한 시각까지 남은 시간(초). 시간이 지났으면 TimeoutError."""
+    remaining = deadline - asyncio.get_running_loop().time()
+    if remaining <= 0:
+        raise asyncio.TimeoutError()
+    return remaining
+
+
 def clean_text(text):
     """텍스트에서 NULL 문자 및 기타 문제가 될 수 있는 특수 문자 제거"""
     # NULL 문자 제거
     text = text.replace('\x00', '')
-    
+
     # 제어 문자 제거 (탭, 줄바꿈, 캐리지 리턴은 유지)
     text = re.sub(r'[\x01-\x08\x0b\x0c\x0e-\x1f\x7f]', '', text)
-    
+
     return text
 
-async def load_pdf(file_content):
-    """PDF 파일 사전 처리"""
+
+# <프로세스 풀에서 실행되는 함수들>
+def count_pdf_pages(file_content: bytes) -> int:
+    """PDF 페이지 수"""
+    return len(PdfReader(BytesIO(file_content)).pages)
+
+
+def extract_pdf_pages(file_content: bytes, start: int, end: int) -> list:
+    """PDF의 start 페이지부터 end 페이지 전까지 텍스트 추출"""
+    # PyPDFLoader 대신 PyPDFReader 사용
+    reader = PdfReader(BytesIO(file_content))
+    documents = []
+    for page_number in range(start, end):
+        text = reader.pages[page_number].extract_text()
+        documents.append(clean_text(text))
+    return documents
+
+
+def extract_docx_text(docx_content: bytes) -> list:
+    """Word 문서 텍스트 추출"""
+    # docx2txt는 파일 객체도 받을 수 있으므로 임시 파일을 만들지 않는다.
+    text = docx2txt.process(BytesIO(docx_content))
+    # 결과를 PDF와 같은 형식으로 변환
+    return [clean_text(text)]
+
+
+def get_hwp_text_transform():
+    """pyhwp의 HWP -> 텍스트 변환 함수 (프로세스마다 한 번 생성)"""
+    global _hwp_text_transform
+    if _hwp_text_transform is None:
+        from hwp5.hwp5txt import TextTransform
+        _hwp_text_transform = TextTransform()
+    return _hwp_text_transform.transform_hwp5_to_text
+
+
+class HwpTextStreamCancelled(Exception):
+    """HWP 텍스트를 받던 쪽이 중단(제한 시간 초과 등)하여 추출을 멈춘다."""
+
+
+class QueueWriter:
+    """pyhwp 변환 결과를 받아 HWP_STREAM_BLOCK_SIZE 바이트씩 큐에 넣는 쓰기 객체
+
+    큐의 크기가 정해져 있으므로 받는 쪽이 느리면 변환이 기다린다. (추출한 텍스트 전체를 메모리에 올리지 않는다)
+    """
+
+    def __init__(self, stream, cancelled):
+        self.stream = stream
+        self.cancelled = cancelled
+        self.buffer = bytearray()
+
+    def write(self, data) -> int:
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self.buffer.extend(data)
+        while len(self.buffer) >= HWP_STREAM_BLOCK_SIZE:
+            self.put(bytes(self.buffer[:HWP_STREAM_BLOCK_SIZE]))
+            del self.buffer[:HWP_STREAM_BLOCK_SIZE]
+        return len(data)
+
+    def flush(self):
+        if self.buffer:
+            self.put(bytes(self.buffer))
+            self.buffer.clear()
+
+    def put(self, block):
+        while True:
+            if self.cancelled.is_set():
+                raise HwpTextStreamCancelled()
+            try:
+                self.stream.put(block, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+
+def write_hwp_text(file_content: bytes, output):
+    """pyhwp로 메모리에 있는 HWP 문서의 텍스트(hwp5txt와 같은 결과)를 output에 쓴다."""
+    from contextlib import closing
+    from olefile import OleFileIO
+    from hwp5.xmlmodel import Hwp5File
+    from hwp5.storage.ole import OleStorage
+
+    # 업로드된 바이트를 임시 파일로 쓰지 않고 바로 연다.
+    with closing(Hwp5File(OleStorage(OleFileIO(BytesIO(file_content))))) as hwp5file:
+        get_hwp_text_transform()(hwp5file, output)
+
+
+def stream_hwp_text(file_content: bytes, stream, cancelled):
+    """HWP 문서의 텍스트를 블록 단위로 stream 큐에 넣고, 끝나면(실패해도) None을 넣는다."""
+    writer = QueueWriter(stream, cancelled)
+    try:
+        write_hwp_text(file_content, writer)
+        writer.flush()
+    finally:
+        try:
+            writer.put(None)
+        except HwpTextStreamCancelled:
+            pass
+# </프로세스 풀에서 실행되는 함수들>
+
+
+def use_in_process_hwp_extractor(file_extension: str) -> bool:
+    """HWP를 hwp5txt 대신 프로세스 풀에서 pyhwp로 직접 추출할지 여부"""
+    import importlib.util
+    from config.settings import HWP_EXTRACTOR
+
+    if file_extension != 'hwp' or HWP_EXTRACTOR == 'hwp5txt':
+        return False
+    return importlib.util.find_spec('hwp5') is not None
+
+
+class TextPageSplitter:
+    """hwp5txt 출력처럼 페이지 구분이 없는 텍스트를 조금씩 받아 페이지 단위로 나눈다.
+
+    빈 줄이 2개 이상 연속된 곳(\\n이 3개 이상)을 페이지 구분자로 간주하고,
+    구분자가 한 번도 없으면 page_size 글자 단위로 나눈다.
+    페이지 하나가 max_page_size 글자를 넘으면 구분자를 기다리지 않고 내보내서 메모리 사용량을 제한한다.
+    """
+
+    def __init__(self, page_size: int = 1000, max_page_size: int = 100000):
+        self.page_size = page_size
+        self.max_page_size = max_page_size
+        self.partial_line = ""  # 아직 줄바꿈을 받지 못한 마지막 줄
+        self.lines = []  # 현재 페이지의 줄
+        self.length = 0
+        self.empty_lines = 0  # 연속된 빈 줄 수
+        self.delimited = False  # 페이지 구분자를 한 번이라도 찾았는지 여부
+
+    def feed(self, text: str) -> list:
+        """텍스트 조각을 받아 완성된 페이지 리스트를 반환"""
+        pages = []
+        lines = (self.partial_line + text).split("\n")
+        self.partial_line = lines.pop()
+        for line in lines:
+            pages.extend(self._add_line(line))
+        if len(self.partial_line) > self.max_page_size:
+            # 줄바꿈 없이 매우 긴 텍스트는 줄 하나로 간주
+            pages.extend(self._add_line(self.partial_line))
+            self.partial_line = ""
+        return pages
+
+    def close(self) -> list:
+        """남은 텍스트를 마지막 페이지로 반환"""
+        pages = []
+        if self.partial_line:
+            pages.extend(self._add_line(self.partial_line))
+            self.partial_line = ""
+        pages.extend(self._flush(final=True))
+        return pages
+
+    def _add_line(self, line: str) -> list:
+        if not line:
+            self.empty_lines += 1
+            self.lines.append(line)
+            return []
+
+        pages = []
+        if self.empty_lines >= 2:
+            # 빈 줄 2개 이상 뒤에 오는 줄부터 새 페이지
+            pages.extend(self._flush(final=False, delimiter=True))
+        self.empty_lines = 0
+        self.lines.append(line)
+        self.length += len(line) + 1
+        if self.length > self.max_page_size:
+            pages.extend(self._flush(final=False))
+        return pages
+
+    def _flush(self, final: bool, delimiter: bool = False) -> list:
+        page = "\n".join(self.lines).strip()
+        self.lines = []
+        self.length = 0
+        self.empty_lines = 0
+
+        if delimiter and page:
+            self.delimited = True
+        if not page:
+            return []
+        if self.delimited:
+            return [page]
+        # 구분자를 아직 찾지 못한 페이지는 약 page_size 글자 단위로 분할
+        pages = [page[i:i + self.page_size] for i in range(0, len(page), self.page_size)]
+        if not final and not delimiter and len(pages[-1]) < self.page_size:
+            # 마지막 조각은 다음 텍스트와 이어 붙인다.
+            self.lines = [pages.pop()]
+            self.length = len(self.lines[0])
+        return pages
+
+
+def iter_text_pages(texts, page_size: int = 1000):
+    """텍스트 조각들을 TextPageSplitter로 나눠 페이지를 하나씩 내보낸다."""
+    splitter = TextPageSplitter(page_size=page_size)
+    for text in texts:
+        yield from splitter.feed(text)
+    yield from splitter.close()
+
+
+async def iter_pdf_pages(file_content):
+    """PDF 페이지를 순서대로 하나씩 내보낸다.
+
+    PDF_PAGES_PER_TASK 페이지 구간을 최대 PARSER_POOL_SIZE 개까지 동시에 추출하고,
+    앞 구간의 페이지를 내보내는 동안 다음 구간을 추출한다.
+    """
+    from config.settings import PARSER_POOL_SIZE, PARSE_TIMEOUT_SECONDS, PDF_PAGES_PER_TASK
     print("Loading PDF file...")
 
+    deadline = asyncio.get_running_loop().time() + PARSE_TIMEOUT_SECONDS
+    page_count = await asyncio.wait_for(
+        run_in_parser_pool(count_pdf_pages, file_content),
+        timeout=get_remaining_time(deadline)
+    )
+    page_ranges = split_page_ranges(page_count, PDF_PAGES_PER_TASK)
+    window_size = max(1, PARSER_POOL_SIZE)
+
+    running = []
     try:
+        for start, end in page_ranges:
+            running.append(asyncio.ensure_future(run_in_parser_pool(extract_pdf_pages, file_content, start, end)))
+            if len(running) < window_size:
+                continue
+            for page in await asyncio.wait_for(running.pop(0), timeout=get_remaining_time(deadline)):
+                yield page
+        while running:
+            for page in await asyncio.wait_for(running.pop(0), timeout=get_remaining_time(deadline)):
+                yield page
+        print(f"Extracted {page_count} pages from PDF")
+    except asyncio.TimeoutError:
+        print(f"PDF 파싱 제한 시간({PARSE_TIMEOUT_SECONDS}초)을 초과했습니다.")
+        raise
+    finally:
+        # 중간에 중단되면 아직 실행 중인 구간 추출을 취소한다.
+        for future in running:
+            future.cancel()
+
 
-        # PyPDFLoader 대신 PyPDFReader 사용
-        reader = PdfReader(BytesIO(file_content)) # 이부분의 <pdf_file>는 BytesIO(<load_pdf의 매개변수>)로 대체.
-        documents = []
-        for page in reader.pages:
-            text = page.extract_text()
-            text = clean_text(text)
-            documents.append(text)
+async def iter_docx_pages(docx_content):
+    """Word 문서 텍스트를 내보낸다. (docx2txt는 문서 전체를 한 번에 추출하므로 한 페이지로 처리)"""
+    from config.settings import PARSE_TIMEOUT_SECONDS
+    print("Loading DOCX file...")
 
-        print(f"Extracted {len(documents)} pages from PDF")
+    documents = await asyncio.wait_for(
+        run_in_parser_pool(extract_docx_text, docx_content),
+        timeout=PARSE_TIMEOUT_SECONDS
+    )
+    for document in documents:
+        yield document
 
-        return documents
-    
+
+async def iter_hwp_pages(file_content, file_extension="hwp"):
+    """HWP 문서를 페이지 단위로 내보낸다.
+
+    pyhwp가 설치되어 있으면 파싱용 프로세스 풀에서 메모리의 바이트로부터 직접 추출하고,
+    없으면 hwp5txt를 실행한다.
+    """
+    from config.settings import PARSE_TIMEOUT_SECONDS
+
+    if not use_in_process_hwp_extractor(file_extension):
+        async with aclosing(iter_hwp5txt_pages(file_content, file_extension)) as pages:
+            async for page in pages:
+                yield page
+        return
+
+    print(f"Loading {file_extension.upper()} file...")
+    deadline = asyncio.get_running_loop().time() + PARSE_TIMEOUT_SECONDS
+    if get_parser_pool() is None:
+        stream, cancelled = queue.Queue(HWP_STREAM_QUEUE_SIZE), threading.Event()
+    else:
+        manager = get_parser_manager()
+        stream, cancelled = manager.Queue(HWP_STREAM_QUEUE_SIZE), manager.Event()
+    extraction = asyncio.ensure_future(run_in_parser_pool(stream_hwp_text, file_content, stream, cancelled))
+
+    def next_block():
+        # 추출이 끝나기 전에 파싱 프로세스가 비정상 종료되면 None을 받지 못하므로 주기적으로 확인한다.
+        while True:
+            try:
+                return stream.get(timeout=0.5)
+            except queue.Empty:
+                if extraction.done() or cancelled.is_set():
+                    return None
+
+    try:
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        splitter = TextPageSplitter()
+        page_count = 0
+        while True:
+            block = await asyncio.wait_for(asyncio.to_thread(next_block), timeout=get_remaining_time(deadline))
+            if block is None:
+                break
+            for page in splitter.feed(clean_text(decoder.decode(block))):
+                page_count += 1
+                yield page
+        # 추출 중 발생한 오류를 전달한다.
+        await asyncio.wait_for(extraction, timeout=get_remaining_time(deadline))
+
+        for page in splitter.feed(clean_text(decoder.decode(b"", final=True))) + splitter.close():
+            page_count += 1
+            yield page
+        print(f"HWP 문서를 {page_count}개의 페이지로 분할했습니다.")
+    except asyncio.TimeoutError:
+        print(f"{file_extension.upper()} 파싱 제한 시간({PARSE_TIMEOUT_SECONDS}초)을 초과했습니다.")
+        raise
+    finally:
+        # 중간에 중단되면 파싱 프로세스의 추출도 멈춘다.
+        cancelled.set()
+        if not extraction.done():
+            extraction.cancel()
+        elif not extraction.cancelled():
+            # 이미 다른 오류로 중단된 경우 추출 오류는 확인만 하고 버린다.
+            extraction.exception()
+
+
+async def iter_hwp5txt_pages(file_content, file_extension="hwp"):
+    """hwp5txt의 출력을 읽는 대로 페이지 단위로 나눠 내보낸다. (추출된 텍스트 전체를 메모리에 올리지 않는다)"""
+    from config.settings import PARSE_TIMEOUT_SECONDS
+    print(f"Loading {file_extension.upper()} file with hwp5txt...")
+
+    deadline = asyncio.get_running_loop().time() + PARSE_TIMEOUT_SECONDS
+
+    # 임시 파일 생성 (HWP/HWPX 파일용)
+    with tempfile.NamedTemporaryFile(delete=False, suffix=f".{file_extension}") as hwp_temp:
+        hwp_temp.write(file_content)
+        hwp_path = hwp_temp.name
+
+    process = None
+    try:
+        # hwp5txt는 별도 프로세스이므로 파싱용 프로세스 풀을 사용하지 않고 표준 출력을 직접 읽는다.
+        process = await asyncio.create_subprocess_exec(
+            'hwp5txt', hwp_path,
+            stdout=asyncio.subprocess.PIPE
+        )
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        splitter = TextPageSplitter()
+        page_count = 0
+        while True:
+            block = await asyncio.wait_for(process.stdout.read(65536), timeout=get_remaining_time(deadline))
+            if not block:
+                break
+            for page in splitter.feed(clean_text(decoder.decode(block))):
+                page_count += 1
+                yield page
+
+        return_code = await asyncio.wait_for(process.wait(), timeout=get_remaining_time(deadline))
+        if return_code != 0:
+            raise subprocess.CalledProcessError(return_code, 'hwp5txt')
+
+        for page in splitter.feed(clean_text(decoder.decode(b"", final=True))) + splitter.close():
+            page_count += 1
+            yield page
+        print(f"HWP 문서를 {page_count}개의 페이지로 분할했습니다.")
+    except asyncio.TimeoutError:
+        print(f"{file_extension.upper()} 파싱 제한 시간({PARSE_TIMEOUT_SECONDS}초)을 초과했습니다.")
+        raise
+    finally:
+        if process is not None and process.returncode is None:
+            process.kill()
+            await process.wait()
+        # 임시 파일 삭제
+        if os.path.exists(hwp_path):
+            os.unlink(hwp_path)
+
+
+def get_local_name(tag: str) -> str:
+    """XML 태그에서 네임스페이스를 제외한 이름"""
+    return tag.rsplit('}', 1)[-1]
+
+
+def get_hwpx_section_names(hwpx_zip) -> list:
+    """HWPX 본문 섹션 파일 이름을 문서 순서대로 반환 (content.hpf의 spine 순서, 없으면 섹션 번호 순서)"""
+    import xml.etree.ElementTree as ET
+
+    names = set(hwpx_zip.namelist())
+    section_names = []
+    if 'Contents/content.hpf' in names:
+        with hwpx_zip.open('Contents/content.hpf') as f:
+            package = ET.parse(f).getroot()
+        hrefs = {}
+        for element in package.iter():
+            if get_local_name(element.tag) == 'item' and element.get('id') and element.get('href'):
+                hrefs[element.get('id')] = element.get('href')
+        for element in package.iter():
+            if get_local_name(element.tag) == 'itemref':
+                href = hrefs.get(element.get('idref'), '')
+                name = href if href in names else f"Contents/{href}"
+                if name in names and re.search(r'section\d+\.xml$', name):
+                    section_names.append(name)
+    if not section_names:
+        numbered = [
+            (int(match.group(1)), name)
+            for name in names
+            for match in [re.fullmatch(r'Contents/section(\d+)\.xml', name)]
+            if match
+        ]
+        section_names = [name for _, name in sorted(numbered)]
+    return section_names
+
+
+def iter_hwpx_sections(file_content: bytes, max_page_size: int = 100000):
+    """HWPX(zip + XML) 문서의 텍스트를 섹션 단위로 내보낸다.
+
+    섹션 XML을 압축 해제하면서 iterparse로 읽고 처리한 문단은 바로 버린다.
+    섹션 하나가 max_page_size 글자를 넘으면 문단 경계에서 나눠서 내보낸다.
+    """
+    import xml.etree.ElementTree as ET
+
+    with zipfile.ZipFile(BytesIO(file_content)) as hwpx_zip:
+        for section_name in get_hwpx_section_names(hwpx_zip):
+            parts = []
+            length = 0
+            paragraph_depth = 0
+            root = None
+            with hwpx_zip.open(section_name) as section_file:
+                for event, element in ET.iterparse(section_file, events=('start', 'end')):
+                    name = get_local_name(element.tag)
+                    if event == 'start':
+                        if root is None:
+                            root = element
+                        if name == 'p':
+                            paragraph_depth += 1
+                        continue
+
+                    if name == 't':
+                        # <hp:t>텍스트<hp:tab/>텍스트<hp:lineBreak/>...</hp:t>
+                        text = [element.text or '']
+                        for child in element:
+                            child_name = get_local_name(child.tag)
+                            if child_name == 'tab':
+                                text.append('\t')
+                            elif child_name == 'lineBreak':
+                                text.append('\n')
+                            text.append(child.tail or '')
+                        text = ''.join(text)
+                        parts.append(text)
+                        length += len(text)
+                    elif name == 'p':
+                        paragraph_depth -= 1
+                        parts.append('\n')
+                        length += 1
+                        if paragraph_depth == 0:
+                            # 처리가 끝난 최상위 문단은 메모리에서 제거
+                            root.clear()
+                            if length > max_page_size:
+                                page = clean_text(''.join(parts)).strip()
+                                if page:
+                                    yield page
+                                parts = []
+                                length = 0
+
+            page = clean_text(''.join(parts)).strip()
+            if page:
+                yield page
+
+
+async def iter_hwpx_pages(file_content):
+    """HWPX 문서를 섹션 단위로 내보낸다. (hwp5txt와 임시 파일 없이 zip에서 바로 읽는다)"""
+    from config.settings import PARSE_TIMEOUT_SECONDS
+    print("Loading HWPX file...")
+
+    deadline = asyncio.get_running_loop().time() + PARSE_TIMEOUT_SECONDS
+    sections = iter_hwpx_sections(file_content)
+    page_count = 0
+    try:
+        while True:
+            # XML 파싱이 이벤트 루프를 막지 않도록 다음 섹션은 스레드에서 읽는다.
+            page = await asyncio.wait_for(
+                asyncio.to_thread(next, sections, None),
+                timeout=get_remaining_time(deadline)
+            )
+            if page is None:
+                break
+            page_count += 1
+            yield page
+        print(f"HWPX 문서에서 {page_count}개의 섹션을 추출했습니다.")
+    except asyncio.TimeoutError:
+        print(f"HWPX 파싱 제한 시간({PARSE_TIMEOUT_SECONDS}초)을 초과했습니다.")
+        raise
+    finally:
+        # 스레드에서 실행 중인 next()가 끝나기 전에 close()하면 ValueError가 발생한다.
+        try:
+            sections.close()
+        except ValueError:
+            pass
+
+
+def iter_document_pages(file_content, file_extension):
+    """파일 형식에 맞는 페이지 스트림(비동기 이터레이터)을 반환"""
+    if file_extension == 'pdf':
+        return iter_pdf_pages(file_content)
+    if file_extension == 'docx':
+        return iter_docx_pages(file_content)
+    if file_extension == 'hwpx':
+        return iter_hwpx_pages(file_content)
+    if file_extension == 'hwp':
+        return iter_hwp_pages(file_content, file_extension)
+    raise ValueError(f"지원되지 않는 파일 형식입니다: {file_extension}")
+
+
+async def collect_pages(pages) -> list:
+    """페이지 스트림을 리스트로 모은다."""
+    async with aclosing(pages) as pages:
+        return [page async for page in pages]
+
+
+async def load_pdf(file_content):
+    """PDF 파일 사전 처리 (페이지 리스트 반환)"""
+    try:
+        return await collect_pages(iter_pdf_pages(file_content))
     except Exception as e:
         print(f"Error loading PDF file: {str(e)}")
         raise
 
 
-
 async def load_docx(docx_content):
     """Word 문서 처리"""
-    print("Loading DOCX file...")
-    
-    # 임시 파일 생성
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".docx") as temp:
-        temp.write(docx_content)
-        temp_path = temp.name
-    
     try:
-        # docx2txt 패키지를 사용하여 문서 로드
-        text = docx2txt.process(temp_path)
-        
-        # 결과를 PDF와 같은 형식으로 변환
-        documents = []
-        text = clean_text(text)
-        documents.append(text)
-        
+        documents = await collect_pages(iter_docx_pages(docx_content))
         print(f"추출된 Word 문서 내용: {len(documents)} 페이지")
         return documents
     except Exception as e:
         print(f"DOCX 파일 처리 중 오류 발생: {str(e)}")
         raise
-    finally:
-        # 임시 파일 삭제
-        os.unlink(temp_path)
-
-
-
 
 
 async def load_hwp(file_content, file_extension="hwp"):
     """HWP/HWPX 문서 처리"""
-    print(f"Loading {file_extension.upper()} file...")
-    
-    # 임시 파일 생성 (HWP/HWPX 파일용)
-    with tempfile.NamedTemporaryFile(delete=False, suffix=f".{file_extension}") as hwp_temp:
-        hwp_temp.write(file_content)
-        hwp_path = hwp_temp.name
-    
-    # 텍스트 출력용 임시 파일
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".txt") as txt_temp:
-        txt_path = txt_temp.name
-    
     try:
-        print(f"Running hwp5txt on temporary file with output to {txt_path}")
-        subprocess.run(['hwp5txt', hwp_path, '--output', txt_path], check=True)
-        
-        # 텍스트 파일 읽기 및 정리
-        with open(txt_path, 'r', encoding='utf-8') as f:
-            text = f.read()
-        
-        # 텍스트 정리
-        text = clean_text(text)
-        
-        # 페이지 구분 (빈 줄이 여러 개 있는 곳을 페이지 구분자로 간주)
-        # 일반적으로 HWP 문서는 페이지 구분이 명확하지 않아 휴리스틱하게 처리
-        page_delimiter = re.compile(r'\n{3,}')  # 3줄 이상의 빈 줄을 페이지 구분자로 간주
-        pages = page_delimiter.split(text)
-        
-        # 빈 페이지 제거 및 공백 정리
-        documents = [page.strip() for page in pages if page.strip()]
-        
-        # 페이지 분할이 제대로 되지 않은 경우 (페이지가 하나만 있는 경우)
-        if len(documents) <= 1:
-            # 약 1000자 단위로 페이지 분할
-            text = documents[0] if documents else text
-            page_size = 1000
-            documents = [text[i:i+page_size] for i in range(0, len(text), page_size)]
-        
-        print(f"HWP 문서를 {len(documents)}개의 페이지로 분할했습니다.")
-        return documents
+        return await collect_pages(iter_document_pages(file_content, file_extension))
     except Exception as e:
         print(f"{file_extension.upper()} 파일 처리 중 오류 발생: {str(e)}")
         import traceback
         print(traceback.format_exc())
         raise
-    finally:
-        # 임시 파일 삭제
-        if os.path.exists(hwp_path):
-            os.unlink(hwp_path)
-        if os.path.exists(txt_path):
-            os.unlink(txt_path)
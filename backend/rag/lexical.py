@@ -0,0 +1,58 @@
+# 한국어 전문 검색용 n-gram 색인.
+# 한국어는 조사가 단어에 붙어 있어("연차는", "연차를") 공백 단위 토큰으로는 같은 단어를 찾을 수 없으므로,
+# 토큰 전체와 두 글자 n-gram을 tsvector 어휘소로 저장하고, 질의는 토큰마다 토큰 전체나 n-gram이 일치하는 청크를 찾는다.
+
+import re
+import unicodedata
+
+
+# 이보다 긴 토큰(인코딩된 데이터 등)은 토큰 전체를 어휘소로 저장하지 않는다. (tsvector 어휘소 최대 2KB)
+MAX_TOKEN_LENGTH = 64
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def extract_lexemes(text: str) -> list:
+    """텍스트를 어휘소(토큰 전체 + 두 글자 n-gram) 리스트로 변환 (중복 제거, 정렬)"""
+    lexemes = set()
+    normalized = unicodedata.normalize("NFKC", text or "").casefold()
+    for token in TOKEN_PATTERN.findall(normalized):
+        if len(token) <= MAX_TOKEN_LENGTH:
+            # 조항 번호, 파일 이름처럼 정확히 같은 토큰은 n-gram보다 더 많이 일치하게 된다.
+            lexemes.add(token)
+        for i in range(len(token) - 1):
+            lexemes.add(token[i:i + 2])
+    return sorted(lexemes)
+
+
+def to_tsvector_text(text: str) -> str:
+    """청크 내용을 document_chunks.content_tsv에 저장할 tsvector 문자열로 변환
+
+    어휘소는 \\w 문자로만 이루어져 있으므로 따옴표로 감싸기만 하면 된다.
+    DB의 텍스트 검색 파서를 거치지 않으므로 DB 로케일과 관계없이 한글이 그대로 저장된다.
+    """
+    return " ".join(f"'{lexeme}'" for lexeme in extract_lexemes(text))
+
+
+def to_tsquery_text(query: str):
+    """질의를 토큰 중 하나 이상이 일치하는 청크를 찾는 tsquery 문자열로 변환. 어휘소가 없으면 None
+
+    토큰은 토큰 전체가 같거나, 마지막 n-gram(조사가 붙는 자리)을 뺀 n-gram이 모두 있으면 일치한다.
+    ("연차휴가는" -> '연차휴가는' | '연차' & '차휴' & '휴가')
+    질문에는 "며칠", "알려주세요"처럼 문서에 잘 나오지 않는 토큰이 섞여 있으므로 토큰끼리는 OR로 묶고,
+    더 많은 토큰이 일치하는 청크가 ts_rank로 앞에 오게 한다. 후보 수는 순위 상위 top_n개로 제한된다.
+    """
+    groups = []
+    normalized = unicodedata.normalize("NFKC", query or "").casefold()
+    for token in dict.fromkeys(TOKEN_PATTERN.findall(normalized)):
+        bigrams = [token[i:i + 2] for i in range(len(token) - 1)]
+        if len(bigrams) > 1:
+            bigrams = bigrams[:-1]
+        terms = [" & ".join(f"'{bigram}'" for bigram in dict.fromkeys(bigrams))] if bigrams else []
+        if len(token) <= MAX_TOKEN_LENGTH and token not in bigrams:
+            terms.insert(0, f"'{token}'")
+        if terms:
+            groups.append(terms[0] if len(terms) == 1 else f"({' | '.join(terms)})")
+    if not groups:
+        return None
+    return " | ".join(groups)
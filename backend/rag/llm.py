@@ -6,6 +6,7 @@ from langchain_core.documents import Document
 
 from sqlalchemy import text
 
+import threading
 import traceback
 
 
@@ -19,7 +20,10 @@ def format_docs(docs):
     
     formatted_docs = []
     for doc in docs:
-        content = f"<The name of this document:{doc.metadata['document_name']}> <The path of this document>{doc.metadata['document_path']}</The path of this document> {doc.page_content} </The name of this document:{doc.metadata['document_name']}>"
+        # 문서 이름과 경로는 임베딩에 포함되어 있지 않으므로 답변 생성 시점에 붙여준다.
+        document_name = doc.metadata.get('document_name') or "unknown"
+        document_path = doc.metadata.get('document_path') or "unknown"
+        content = f"<The name of this document:{document_name}> <The path of this document>{document_path}</The path of this document> {doc.page_content} </The name of this document:{document_name}>"
         formatted_docs.append(content)
     
     return "\n\n".join(formatted_docs)
@@ -28,9 +32,27 @@ def format_docs(docs):
 
 
 
-def get_llms_answer(docs: list[Document], query: str) -> str:
-    """LLM 모델 함수"""
-    from db.database import engine  # 기존 엔진을 임포트
+# 프로세스마다 한 번만 만드는 LLM 클라이언트 (HTTP 연결 재사용)
+_llm = None
+_llm_lock = threading.Lock()
+
+
+def get_llm():
+    """답변 생성용 OpenAI 모델 객체. 프로세스마다 한 번만 만든다."""
+    global _llm
+    if _llm is None:
+        with _llm_lock:
+            if _llm is None:
+                # OpenAI 모델 객체를 생성한다.
+                _llm = ChatOpenAI(
+                temperature=0.2,
+                max_tokens=2048,
+                model_name="gpt-4o-mini",)
+    return _llm
+
+
+def build_answer_chain(docs: list[Document]):
+    """검색한 문서를 컨텍스트로 질의에 답하는 체인"""
     # 프롬프트를 생성합니다.
     prompt = PromptTemplate.from_template(
         """
@@ -46,11 +68,7 @@ def get_llms_answer(docs: list[Document], query: str) -> str:
     """
     )
 
-    # OpenAI 모델 객체를 생성한다.
-    llm = ChatOpenAI(
-    temperature=0.2,
-    max_tokens=2048,
-    model_name="gpt-4o-mini",)
+    llm = get_llm()
 
     # 문서가 없으면 빈 컨텍스트 반환
     if not docs:
@@ -64,9 +82,6 @@ def get_llms_answer(docs: list[Document], query: str) -> str:
         print(f"문서 포맷팅 오류: {str(e)}")
         formatted_docs = "문서 처리 중 오류가 발생했습니다."
 
-
-
-
     # 단계 8: 체인(Chain) 생성
     chain = (
         {"question": RunnablePassthrough(), "context": lambda _: formatted_docs}
@@ -74,20 +89,19 @@ def get_llms_answer(docs: list[Document], query: str) -> str:
         | llm
         | StrOutputParser()
     )
+    return chain
 
 
+async def aget_llms_answer(docs: list[Document], query: str) -> tuple[str, bool]:
+    """LLM 모델 함수. OpenAI 응답을 기다리는 동안 이벤트 루프가 다른 요청을 처리한다.
 
-
-
-    # 체인 실행(Run Chain)
-    # 문서에 대한 질의를 입력하고, 답변을 출력합니다.
+    (답변, 성공 여부)를 반환한다. 실패하면 오류 안내 문구와 False를 반환하므로 호출자는 답변을 캐시하지 않는다.
+    """
+    chain = build_answer_chain(docs)
     try:
-        response = chain.invoke(query)
+        response = await chain.ainvoke(query)
     except Exception as e:
         print(f"LLM 응답 생성 오류: {str(e)}")
         print(f"오류 상세 내용: {traceback.format_exc()}")
-        # 오류 발생 시 기본 응답 반환
-        response = "죄송합니다. 답변을 생성하는 중에 오류가 발생했습니다."
-   
-    return response
-
+        return "죄송합니다. 답변을 생성하는 중에 오류가 발생했습니다.", False
+    return response, True
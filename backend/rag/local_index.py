@@ -0,0 +1,445 @@
+# 사용자별 프로세스 내 벡터 인덱스.
+# 청크 수가 적은 사용자는 임베딩을 연속된 float32 행렬로 로컬 스냅샷 파일에 저장하고 메모리 매핑(mmap)하여
+# pgvector 쿼리 없이 NumPy 행렬-벡터 곱으로 전체 탐색한다. (전체 탐색이므로 근사 인덱스와 달리 recall이 항상 1)
+# 이 프로세스에서 저장/삭제한 청크는 바로 반영하고, 다른 프로세스(워커 등)의 변경은 문서 집합 버전(users.corpus_version)이
+# 바뀌었을 때 청크 id를 비교하여 추가된 청크의 임베딩만 가져온다.
+# 청크 수가 LOCAL_INDEX_MAX_CHUNKS를 넘는 사용자는 인덱스를 만들지 않고 pgvector로 검색한다.
+
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import numpy as np
+from sqlalchemy import text
+
+
+# 사용자 id -> 인덱스 상태. 상태 dict는 바꾸지 않고 새로 만들어 교체하므로 검색 중에 바뀌지 않는다.
+_indexes = {}
+_indexes_lock = threading.Lock()
+# 사용자별 동기화 잠금 (같은 사용자의 인덱스를 동시에 여러 번 만들지 않는다)
+_owner_locks = {}
+# 사용자 id -> 이 프로세스에서 저장했지만 아직 행렬에 합치지 않은 청크 {"ids", "paths", "vectors"} (사용자별 잠금 안에서 변경)
+# 수집 중에는 배치마다 전체 행렬을 다시 만들지 않고 모아 두었다가 다음 검색 때 한 번에 합친다.
+_pending = {}
+
+# 새 청크의 임베딩을 한 번에 가져올 최대 개수
+FETCH_BATCH_SIZE = 1000
+
+
+def get_owner_lock(owner_id: int) -> threading.Lock:
+    with _indexes_lock:
+        return _owner_locks.setdefault(owner_id, threading.Lock())
+
+
+def get_index_key() -> dict:
+    """스냅샷을 그대로 사용할 수 있는지 판단하는 설정 값 (모델이나 컬럼이 바뀌면 다시 만든다)"""
+    from config.settings import EMBEDDING_MODEL, EMBEDDING_DIMENSION
+    from rag.retriever import get_search_column
+
+    column, _, _ = get_search_column()
+    return {"model": EMBEDDING_MODEL, "dimension": EMBEDDING_DIMENSION, "column": column}
+
+
+def get_snapshot_dir(owner_id: int) -> str:
+    from config.settings import LOCAL_INDEX_DIR
+    return os.path.join(LOCAL_INDEX_DIR, str(int(owner_id)))
+
+
+def build_state(ids, paths: list, embeddings: np.ndarray, version: int, key: dict, dirty: bool = False) -> dict:
+    """인덱스 상태를 만든다. 노름의 역수와 청크 id -> 행 위치는 한 번만 계산한다."""
+    norms = np.sqrt(np.einsum("ij,ij->i", embeddings, embeddings)) if len(ids) else np.empty(0, dtype=np.float32)
+    return {
+        "version": version,
+        "key": key,
+        "too_large": False,
+        "dirty": dirty,
+        "ids": np.asarray(ids, dtype=np.int64),
+        "paths": list(paths),
+        "embeddings": embeddings,
+        "inverse_norms": np.divide(1, norms, out=np.zeros_like(norms), where=norms > 0).astype(np.float32),
+        "positions": {int(chunk_id): position for position, chunk_id in enumerate(ids)},
+    }
+
+
+def get_too_large_state(version: int, key: dict) -> dict:
+    """청크 수가 너무 많아 pgvector로 검색하는 사용자의 상태"""
+    return {"version": version, "key": key, "too_large": True}
+
+
+@contextmanager
+def snapshot_lock(snapshot_dir: str, exclusive: bool):
+    """사용자 스냅샷 디렉터리의 파일 잠금 (같은 디렉터리를 쓰는 여러 프로세스 사이). 쓰기는 배타, 읽기는 공유 잠금"""
+    import fcntl
+
+    with open(os.path.join(snapshot_dir, ".lock"), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        yield
+
+
+def get_file_token(name: str) -> str:
+    """'ids-<토큰>.npy' 형식의 데이터 파일 이름에서 토큰. 토큰은 만든 시각 순서로 정렬된다."""
+    return name[:-len(".npy")].split("-", 1)[-1]
+
+
+def load_snapshot(owner_id: int):
+    """로컬 스냅샷을 읽는다. 임베딩 행렬은 메모리 매핑하므로 필요한 페이지만 읽힌다. 없거나 읽을 수 없으면 None"""
+    snapshot_dir = get_snapshot_dir(owner_id)
+    if not os.path.isdir(snapshot_dir):
+        return None
+    try:
+        # 읽는 동안 다른 프로세스가 데이터 파일을 지우지 않도록 공유 잠금을 잡는다. (메모리 매핑한 뒤에는 지워져도 읽을 수 있다)
+        with snapshot_lock(snapshot_dir, exclusive=False):
+            with open(os.path.join(snapshot_dir, "meta.json"), encoding="utf-8") as file:
+                meta = json.load(file)
+            ids = np.load(os.path.join(snapshot_dir, meta["ids_file"]))
+            # 빈 파일은 메모리 매핑할 수 없다.
+            mmap_mode = "r" if len(ids) else None
+            embeddings = np.load(os.path.join(snapshot_dir, meta["embeddings_file"]), mmap_mode=mmap_mode)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"로컬 벡터 인덱스 스냅샷 읽기 오류 (사용자 {owner_id}): {str(e)}")
+        return None
+    if len(ids) != len(meta["paths"]) or len(ids) != len(embeddings):
+        return None
+    state = build_state(ids, meta["paths"], embeddings, meta["version"], meta["key"])
+    state["files"] = (meta["ids_file"], meta["embeddings_file"])
+    return state
+
+
+def save_snapshot(owner_id: int, state: dict, write_data: bool) -> dict:
+    """스냅샷을 저장하고, 임베딩 행렬을 저장한 파일에서 메모리 매핑한 상태를 반환
+
+    write_data가 False이면 버전과 경로만 바뀐 것이므로 메타데이터만 다시 쓴다.
+    데이터 파일은 매번 시각 순서의 새 토큰으로 쓰고 meta.json을 원자적으로 교체하므로, 다른 프로세스는 항상 완성된 스냅샷을 읽는다.
+    여러 프로세스가 같은 디렉터리를 쓰므로 배타 잠금 안에서 쓰고, meta.json이 가리키는 토큰보다 오래된 데이터 파일만 삭제한다.
+    """
+    snapshot_dir = get_snapshot_dir(owner_id)
+    os.makedirs(snapshot_dir, exist_ok=True)
+    old_files = state.get("files")
+    with snapshot_lock(snapshot_dir, exclusive=True):
+        # 다른 프로세스가 이미 지운 파일은 다시 쓴다.
+        if old_files is None or not all(os.path.exists(os.path.join(snapshot_dir, name)) for name in old_files):
+            write_data = True
+        if write_data:
+            token = f"{time.time_ns():020d}{uuid.uuid4().hex[:8]}"
+            files = (f"ids-{token}.npy", f"embeddings-{token}.npy")
+            np.save(os.path.join(snapshot_dir, files[0]), state["ids"])
+            np.save(os.path.join(snapshot_dir, files[1]), np.ascontiguousarray(state["embeddings"], dtype=np.float32))
+        else:
+            files = old_files
+
+        meta = {
+            "version": state["version"],
+            "key": state["key"],
+            "ids_file": files[0],
+            "embeddings_file": files[1],
+            "paths": state["paths"],
+        }
+        temp_path = os.path.join(snapshot_dir, f"meta.json.{uuid.uuid4().hex}.tmp")
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(meta, file, ensure_ascii=False)
+        os.replace(temp_path, os.path.join(snapshot_dir, "meta.json"))
+
+        # 현재 meta.json이 가리키는 것보다 오래된 데이터 파일 삭제
+        # (교체 전 파일을 메모리 매핑한 프로세스는 파일이 삭제되어도 계속 읽을 수 있다)
+        current_token = get_file_token(files[0])
+        for name in os.listdir(snapshot_dir):
+            if name.endswith(".npy") and get_file_token(name) < current_token:
+                try:
+                    os.remove(os.path.join(snapshot_dir, name))
+                except OSError:
+                    pass
+
+    if files != old_files:
+        embeddings = state["embeddings"]
+        if len(state["ids"]):
+            embeddings = np.load(os.path.join(snapshot_dir, files[1]), mmap_mode="r")
+        state = {**state, "embeddings": embeddings}
+    return {**state, "files": files, "dirty": False}
+
+
+def fetch_corpus_version(connection, owner_id: int) -> int:
+    version = connection.execute(
+        text("SELECT corpus_version FROM users WHERE id = :owner_id"), {"owner_id": owner_id}
+    ).scalar()
+    return version or 0
+
+
+def fetch_tenant_chunks(connection, owner_id: int, column: str, limit: int) -> list:
+    """사용자 청크의 (id, 문서 경로)를 id 순서로 최대 limit개 가져온다. (임베딩은 가져오지 않는다)"""
+    return connection.execute(
+        text(f"""
+        SELECT id, document_path
+        FROM document_chunks
+        WHERE owner_id = :owner_id
+        AND {column} IS NOT NULL
+        ORDER BY id
+        LIMIT :limit
+        """),
+        {"owner_id": owner_id, "limit": limit}
+    ).fetchall()
+
+
+def fetch_chunk_embeddings(connection, chunk_ids: list, column: str, send_function: str) -> dict:
+    """청크 id -> float32 임베딩. 그 사이 삭제된 청크는 포함되지 않는다."""
+    from rag.retriever import decode_vectors
+
+    embeddings = {}
+    for start in range(0, len(chunk_ids), FETCH_BATCH_SIZE):
+        rows = connection.execute(
+            text(f"SELECT id, {send_function}({column}) AS embedding FROM document_chunks WHERE id = ANY(:chunk_ids)"),
+            {"chunk_ids": chunk_ids[start:start + FETCH_BATCH_SIZE]}
+        ).fetchall()
+        vectors = decode_vectors([bytes(row.embedding) for row in rows])
+        embeddings.update({row.id: vectors[i] for i, row in enumerate(rows)})
+    return embeddings
+
+
+def sync_index(connection, owner_id: int, state, version: int, key: dict) -> dict:
+    """DB의 청크 목록과 비교하여 추가된 청크의 임베딩만 가져오고 삭제된 청크는 제외한 상태를 반환"""
+    from config.settings import LOCAL_INDEX_MAX_CHUNKS, EMBEDDING_DIMENSION
+    from rag.retriever import get_search_column
+
+    column, _, send_function = get_search_column()
+    rows = fetch_tenant_chunks(connection, owner_id, column, LOCAL_INDEX_MAX_CHUNKS + 1)
+    if len(rows) > LOCAL_INDEX_MAX_CHUNKS:
+        print(f"사용자 {owner_id}의 청크가 {LOCAL_INDEX_MAX_CHUNKS}개를 넘어 pgvector로 검색합니다.")
+        return get_too_large_state(version, key)
+
+    if state is None or state["too_large"] or state["key"] != key:
+        state = None
+    old_positions = state["positions"] if state is not None else {}
+    new_ids = [row.id for row in rows if row.id not in old_positions]
+    new_embeddings = fetch_chunk_embeddings(connection, new_ids, column, send_function) if new_ids else {}
+    # 목록을 가져온 뒤 삭제된 청크는 제외한다.
+    rows = [row for row in rows if row.id in old_positions or row.id in new_embeddings]
+
+    ids = [row.id for row in rows]
+    paths = [row.document_path or "" for row in rows]
+    data_changed = state is None or state["dirty"] or ids != state["ids"].tolist()
+    if data_changed:
+        dimension = state["embeddings"].shape[1] if state is not None and len(state["ids"]) else EMBEDDING_DIMENSION
+        if new_embeddings:
+            dimension = len(next(iter(new_embeddings.values())))
+        embeddings = np.empty((len(ids), dimension), dtype=np.float32)
+        for position, chunk_id in enumerate(ids):
+            old_position = old_positions.get(chunk_id)
+            embeddings[position] = state["embeddings"][old_position] if old_position is not None else new_embeddings[chunk_id]
+    else:
+        embeddings = state["embeddings"]
+
+    new_state = build_state(ids, paths, embeddings, version, key)
+    if state is not None:
+        new_state["files"] = state.get("files")
+    new_state = save_snapshot(owner_id, new_state, write_data=data_changed)
+    removed = len(old_positions) - (len(ids) - len(new_embeddings))
+    print(f"사용자 {owner_id}의 로컬 벡터 인덱스 동기화: 청크 {len(ids)}개 (추가 {len(new_embeddings)}개, 삭제 {removed}개)")
+    return new_state
+
+
+def get_local_index(owner_id: int):
+    """사용자의 로컬 인덱스 상태. 사용하지 않거나(설정, 청크 수 초과, 오류) 사용할 수 없으면 None
+
+    이 프로세스에서 저장한 청크가 모여 있으면 먼저 행렬에 합친다.
+    마지막 확인 후 LOCAL_INDEX_SYNC_INTERVAL초가 지났으면 문서 집합 버전을 확인하고, 바뀌었으면 동기화한다.
+    """
+    from config.settings import LOCAL_INDEX_ENABLED, LOCAL_INDEX_SYNC_INTERVAL
+
+    if not LOCAL_INDEX_ENABLED or owner_id is None:
+        return None
+
+    state = _indexes.get(owner_id)
+    if (state is not None and owner_id not in _pending
+            and time.monotonic() - state["checked_at"] < LOCAL_INDEX_SYNC_INTERVAL):
+        return None if state["too_large"] else state
+
+    with get_owner_lock(owner_id):
+        state = _indexes.get(owner_id)
+        try:
+            if state is not None and owner_id in _pending:
+                state = merge_pending_chunks(owner_id, state)
+                _indexes[owner_id] = state
+            if state is not None and time.monotonic() - state["checked_at"] < LOCAL_INDEX_SYNC_INTERVAL:
+                return None if state["too_large"] else state
+
+            from db.database import engine
+
+            key = get_index_key()
+            with engine.connect() as connection:
+                version = fetch_corpus_version(connection, owner_id)
+                if state is None:
+                    # 프로세스에서 처음 사용할 때는 로컬 스냅샷에서 시작한다.
+                    state = load_snapshot(owner_id)
+                if state is None or state["version"] != version or state["key"] != key or state["dirty"]:
+                    state = sync_index(connection, owner_id, state, version, key)
+        except Exception as e:
+            print(f"로컬 벡터 인덱스 동기화 오류 (사용자 {owner_id}): {str(e)}")
+            _indexes.pop(owner_id, None)
+            _pending.pop(owner_id, None)
+            return None
+        state = {**state, "checked_at": time.monotonic()}
+        _indexes[owner_id] = state
+    return None if state["too_large"] else state
+
+
+def get_path_mask(paths: list, path_prefix: str):
+    """폴더 경로(하위 폴더 포함) 아래 청크의 마스크. 루트이거나 없으면 None (get_path_pattern과 같은 범위)"""
+    path_prefix = (path_prefix or "").rstrip("/")
+    if not path_prefix:
+        return None
+    prefix = path_prefix + "/"
+    return np.fromiter((path.startswith(prefix) for path in paths), dtype=bool, count=len(paths))
+
+
+def search_local_index(index: dict, query_embedding, top_n: int, path_prefix: str = None, lexical_ids: list = None) -> dict:
+    """로컬 인덱스를 전체 탐색하여 asearch_similarity와 같은 형식의 후보를 반환
+
+    lexical_ids(전문 검색 순위대로 정렬된 청크 id)를 주면 벡터 검색 상위 top_n개와 RRF로 합친다. (get_search_query와 같은 점수)
+    이때도 similarities는 RRF 점수가 아닌 질의와의 유사도이다.
+    """
+    from config.settings import SEARCH_RRF_K
+    from rag.retriever import get_distance_operator, get_empty_candidates
+
+    embeddings = index["embeddings"]
+    if len(index["ids"]) == 0:
+        return get_empty_candidates()
+    query = np.asarray(query_embedding, dtype=np.float32)
+    scores = embeddings @ query
+    if get_distance_operator() == "<=>":
+        # 코사인 유사도 (0 벡터는 유사도 0)
+        query_norm = float(np.linalg.norm(query))
+        scores *= index["inverse_norms"] * (1 / query_norm if query_norm > 0 else 0)
+
+    positions = np.arange(len(scores))
+    mask = get_path_mask(index["paths"], path_prefix)
+    if mask is not None:
+        positions = positions[mask]
+    if len(positions) > top_n:
+        top = np.argpartition(-scores[positions], top_n - 1)[:top_n]
+        positions = positions[top]
+    # 유사도 내림차순 (같으면 청크 id 순서)
+    positions = positions[np.argsort(-scores[positions], kind="stable")]
+
+    if lexical_ids is None:
+        similarities = scores[positions].astype(np.float32)
+    else:
+        fused = {}
+        for rank, position in enumerate(positions.tolist(), start=1):
+            fused[position] = fused.get(position, 0.0) + 1.0 / (SEARCH_RRF_K + rank)
+        # 전문 검색 후보는 이미 같은 사용자/폴더 범위로 검색되었다.
+        lexical_positions = [index["positions"][chunk_id] for chunk_id in lexical_ids if chunk_id in index["positions"]]
+        for rank, position in enumerate(lexical_positions, start=1):
+            fused[position] = fused.get(position, 0.0) + 1.0 / (SEARCH_RRF_K + rank)
+        ranked = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:top_n]
+        if not ranked:
+            return get_empty_candidates()
+        positions = np.array([position for position, _ in ranked], dtype=np.int64)
+        # 순서는 RRF 점수를 따르고, MMR의 관련성은 벡터 검색과 같이 질의와의 유사도를 사용한다.
+        similarities = scores[positions].astype(np.float32)
+
+    if len(positions) == 0:
+        return get_empty_candidates()
+    return {
+        "ids": index["ids"][positions].tolist(),
+        "similarities": similarities,
+        "embeddings": np.ascontiguousarray(embeddings[positions], dtype=np.float32),
+    }
+
+
+def update_loaded_index(owner_id: int, update):
+    """이 프로세스에 로드된 사용자 인덱스에 update(상태) -> 새 상태를 적용한다. 로드되지 않았으면 다음 동기화 때 반영된다."""
+    from config.settings import LOCAL_INDEX_ENABLED
+
+    if not LOCAL_INDEX_ENABLED or owner_id is None or owner_id not in _indexes:
+        return
+    try:
+        with get_owner_lock(owner_id):
+            state = _indexes.get(owner_id)
+            if state is None or state["too_large"]:
+                return
+            new_state = update(state)
+            if new_state is not None:
+                _indexes[owner_id] = new_state
+    except Exception as e:
+        # 반영하지 못한 변경은 문서 집합 버전이 바뀔 때 다시 동기화된다.
+        print(f"로컬 벡터 인덱스 갱신 오류 (사용자 {owner_id}): {str(e)}")
+        _indexes.pop(owner_id, None)
+        _pending.pop(owner_id, None)
+
+
+def merge_pending_chunks(owner_id: int, state: dict) -> dict:
+    """모아 둔 청크를 한 번의 행렬 연결로 인덱스에 합친 상태를 반환 (사용자별 잠금 안에서 호출)"""
+    from config.settings import LOCAL_INDEX_MAX_CHUNKS
+
+    pending = _pending.pop(owner_id, None)
+    if pending is None or state["too_large"]:
+        return state
+    # 이미 인덱스에 있거나(동기화로 가져온 청크) 여러 번 저장된 청크는 한 번만 추가한다.
+    seen = set(state["positions"])
+    keep = []
+    for i, chunk_id in enumerate(pending["ids"]):
+        if chunk_id not in seen:
+            seen.add(chunk_id)
+            keep.append(i)
+    if not keep:
+        return state
+    if len(state["ids"]) + len(keep) > LOCAL_INDEX_MAX_CHUNKS:
+        print(f"사용자 {owner_id}의 청크가 {LOCAL_INDEX_MAX_CHUNKS}개를 넘어 pgvector로 검색합니다.")
+        return {**get_too_large_state(state["version"], state["key"]), "checked_at": state["checked_at"]}
+
+    vectors = np.concatenate(pending["vectors"])[keep]
+    if len(state["ids"]):
+        vectors = np.concatenate([state["embeddings"], vectors])
+    new_state = build_state(
+        np.concatenate([state["ids"], np.asarray(pending["ids"], dtype=np.int64)[keep]]),
+        state["paths"] + [pending["paths"][i] for i in keep],
+        vectors, state["version"], state["key"], dirty=True
+    )
+    return {**new_state, "files": state.get("files"), "checked_at": state["checked_at"]}
+
+
+def add_chunks(owner_id: int, chunk_ids: list, document_path: str, embeddings: list):
+    """이 프로세스에서 저장(commit)한 청크를 로드된 인덱스에 추가할 청크로 모아 둔다.
+
+    행렬에는 다음 검색(get_local_index) 때 한 번에 합치고, 스냅샷 파일은 다음 동기화 때 다시 쓴다.
+    """
+    if not chunk_ids:
+        return
+
+    def update(state):
+        pending = _pending.setdefault(owner_id, {"ids": [], "paths": [], "vectors": []})
+        pending["ids"].extend(int(chunk_id) for chunk_id in chunk_ids)
+        pending["paths"].extend([document_path or ""] * len(chunk_ids))
+        pending["vectors"].append(np.asarray(embeddings, dtype=np.float32))
+        return None
+
+    update_loaded_index(owner_id, update)
+
+
+def remove_chunks(owner_id: int, chunk_ids: list):
+    """이 프로세스에서 삭제(commit)한 청크를 로드된 인덱스에서 제외"""
+    if not chunk_ids:
+        return
+
+    def update(state):
+        # 모아 둔 청크도 삭제될 수 있으므로 먼저 합친다.
+        state = merge_pending_chunks(owner_id, state)
+        if state["too_large"]:
+            return state
+        removed = np.isin(state["ids"], np.asarray(list(chunk_ids), dtype=np.int64))
+        if not removed.any():
+            return state
+        keep = np.flatnonzero(~removed)
+        new_state = build_state(
+            state["ids"][keep],
+            [state["paths"][i] for i in keep],
+            np.ascontiguousarray(state["embeddings"][keep], dtype=np.float32),
+            state["version"], state["key"], dirty=True
+        )
+        return {**new_state, "files": state.get("files"), "checked_at": state["checked_at"]}
+
+    update_loaded_index(owner_id, update)
@@ -0,0 +1,138 @@
+# cross-encoder 재순위(rerank).
+# 벡터 검색 후보의 내용을 가져와 질의와 함께 로컬 CPU cross-encoder로 관련성을 계산하고,
+# MMR이 코사인 유사도 대신 이 점수를 관련성으로 사용하게 한다.
+# 배치를 스레드 풀에서 추론하고, 제한 시간 안에 끝나지 않으면 벡터 검색 결과를 그대로 사용한다.
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+# 프로세스마다 한 번만 로드하는 cross-encoder 모델과 추론용 스레드 풀
+_rerankers = {}
+_rerankers_lock = threading.Lock()
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_reranker():
+    """설정된 cross-encoder 모델. 프로세스마다 한 번만 로드한다."""
+    from config.settings import RERANK_MODEL, RERANK_MAX_LENGTH
+
+    key = (RERANK_MODEL, RERANK_MAX_LENGTH)
+    reranker = _rerankers.get(key)
+    if reranker is None:
+        with _rerankers_lock:
+            reranker = _rerankers.get(key)
+            if reranker is None:
+                try:
+                    from sentence_transformers import CrossEncoder
+                except ImportError:
+                    raise ImportError("RERANK_ENABLED=true를 사용하려면 sentence-transformers를 설치해야 합니다.")
+                reranker = CrossEncoder(RERANK_MODEL, max_length=RERANK_MAX_LENGTH, device="cpu")
+                _rerankers[key] = reranker
+    return reranker
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """재순위 추론용 스레드 풀 (PyTorch 추론은 GIL을 놓으므로 배치를 동시에 계산할 수 있다)"""
+    global _executor
+    from config.settings import RERANK_MAX_WORKERS
+
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=max(1, RERANK_MAX_WORKERS), thread_name_prefix="rerank")
+    return _executor
+
+
+def score_pairs(query: str, texts: list) -> np.ndarray:
+    """질의/텍스트 쌍 배치 하나의 관련성 점수 (0~1)"""
+    reranker = get_reranker()
+    # 출력이 하나인 cross-encoder는 sigmoid를 적용해 0~1 점수를 반환한다.
+    scores = reranker.predict([(query, text) for text in texts], show_progress_bar=False)
+    return np.asarray(scores, dtype=np.float32).reshape(-1)
+
+
+async def ascore_with_budget(query: str, texts: list, timeout_ms: int, batch_size: int):
+    """텍스트를 배치로 나눠 스레드 풀에서 점수를 계산하고 이벤트 루프는 결과를 기다리기만 한다. 제한 시간 안에 끝나지 않으면 None
+
+    시작하지 않은 배치는 취소하며, 이미 실행 중인 배치는 끝날 때까지 스레드 풀에서 계속 실행된다.
+    (처음 호출할 때는 모델 로딩 시간 때문에 제한 시간을 넘을 수 있으며, 모델은 계속 로드되어 다음 질의부터 사용된다)
+    """
+    if not texts:
+        return np.empty(0, dtype=np.float32)
+    batch_size = max(1, batch_size)
+    executor = get_executor()
+    futures = [
+        asyncio.wrap_future(executor.submit(score_pairs, query, texts[start:start + batch_size]))
+        for start in range(0, len(texts), batch_size)
+    ]
+    done, pending = await asyncio.wait(futures, timeout=max(0, timeout_ms) / 1000)
+    if pending:
+        # 시작하지 않은 배치는 스레드 풀에서도 취소된다.
+        for future in pending:
+            future.cancel()
+        return None
+    return np.concatenate([future.result() for future in futures])
+
+
+def get_rerank_inputs(candidates: dict, documents: list):
+    """가져온 청크 내용 중 아직 남아 있는 후보의 인덱스와 청크 id별 Document"""
+    documents = {doc.metadata["chunk_id"]: doc for doc in documents}
+    # 검색 후 삭제된 청크는 제외한다.
+    keep = [i for i, chunk_id in enumerate(candidates["ids"]) if chunk_id in documents]
+    return keep, documents
+
+
+def apply_rerank_scores(candidates: dict, keep: list, documents: dict, scores, timeout_ms: int, start: float) -> dict:
+    """재순위 점수로 후보를 정렬한다. 점수가 없으면(제한 시간 초과, 오류) 원래 후보를 반환"""
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    if scores is None:
+        print(f"재순위 제한 시간({timeout_ms}ms)을 넘었거나 실패하여 벡터 검색 순서를 사용합니다. ({elapsed_ms:.0f}ms)")
+        if len(keep) < len(candidates["ids"]):
+            return candidates
+        # 이미 가져온 내용은 그대로 사용한다.
+        return {**candidates, "documents": [documents[chunk_id] for chunk_id in candidates["ids"]]}
+    print(f"{len(keep)}개의 후보를 재순위했습니다. ({elapsed_ms:.0f}ms)")
+
+    # 재순위 점수 내림차순으로 정렬한 후보
+    ranking = np.argsort(-scores, kind="stable")
+    order = [keep[i] for i in ranking]
+    return {
+        "ids": [candidates["ids"][i] for i in order],
+        "similarities": scores[ranking],
+        "embeddings": candidates["embeddings"][order],
+        "documents": [documents[candidates["ids"][i]] for i in order],
+    }
+
+
+async def arerank_candidates(query: str, candidates: dict, engine, timeout_ms: int = None) -> dict:
+    """asearch_similarity 후보를 cross-encoder 점수로 다시 정렬한 후보를 반환 (engine: AsyncEngine)
+
+    후보 청크의 내용을 한 번에 가져와 candidates["documents"]에 함께 넣으므로 ado_mmr은 내용을 다시 조회하지 않는다.
+    제한 시간(timeout_ms, 없으면 RERANK_TIMEOUT_MS)을 넘거나 오류가 나면 원래 후보(벡터 검색 순서)를 반환한다.
+    """
+    from config.settings import RERANK_TIMEOUT_MS, RERANK_BATCH_SIZE
+    from rag.retriever import aload_chunk_documents
+
+    if not candidates["ids"]:
+        return candidates
+    timeout_ms = RERANK_TIMEOUT_MS if timeout_ms is None else timeout_ms
+    start = time.perf_counter()
+
+    keep, documents = get_rerank_inputs(candidates, await aload_chunk_documents(engine, candidates["ids"]))
+    if not keep:
+        return candidates
+
+    remaining_ms = timeout_ms - (time.perf_counter() - start) * 1000
+    texts = [documents[candidates["ids"][i]].page_content for i in keep]
+    try:
+        scores = await ascore_with_budget(query, texts, remaining_ms, RERANK_BATCH_SIZE)
+    except Exception as e:
+        print(f"재순위 오류: {str(e)}")
+        scores = None
+    return apply_rerank_scores(candidates, keep, documents, scores, timeout_ms, start)
@@ -3,198 +3,610 @@ from langchain_core.documents import Document
 import numpy as np
 from sqlalchemy import text
 
-def search_similarity(embed_query_data, engine):
-    """db에서 유사도 검색 수행"""
-# <SQL 쿼리를 날려 사용자 쿼리와 유사한 임베딩 청크 가져오기>
+def get_distance_operator() -> str:
+    """VECTOR_DISTANCE에 해당하는 pgvector 거리 연산자 (<=>: 코사인 거리, <#>: 음의 내적)"""
+    from config.settings import VECTOR_DISTANCE
+    return "<#>" if VECTOR_DISTANCE == "inner_product" else "<=>"
+
+
+def get_similarity_expression(distance: str) -> str:
+    """거리 식을 유사도(클수록 비슷함)로 변환하는 식"""
+    if get_distance_operator() == "<#>":
+        # 정규화된 벡터의 내적은 코사인 유사도와 같다.
+        return f"({distance}) * -1"
+    return f"1 - ({distance})"
+
+
+def resolve_shortlist(storage: str, keep_full_precision: bool, shortlist: str = None) -> str:
+    """실제로 사용할 1단계 후보 검색 방식 (none, halfvec, binary, prefix)"""
+    from config.settings import SEARCH_SHORTLIST
+
+    shortlist = shortlist or SEARCH_SHORTLIST
+    if shortlist in ("", "auto"):
+        shortlist = "halfvec" if storage == "halfvec" else "none"
+    if shortlist == "halfvec" and not (storage == "halfvec" and keep_full_precision):
+        # halfvec 컬럼으로 찾은 후보를 halfvec으로 다시 계산할 필요는 없다.
+        shortlist = "none"
+    return shortlist
+
+
+# 질의 벡터는 query CTE에 파라미터로 한 번만 전달하고, 쿼리의 나머지 부분에서는 이 서브쿼리로 참조한다.
+# (상수처럼 취급되는 InitPlan이므로 벡터 인덱스 검색에도 사용할 수 있다)
+QUERY_VECTOR = "(SELECT query_vector FROM query)"
+
+
+def to_query_vector(embedding) -> np.ndarray:
+    """질의 임베딩을 pgvector psycopg 어댑터가 binary 형식으로 전송하는 float32 배열로 변환"""
+    return np.asarray(embedding, dtype=np.float32)
+
+
+def get_shortlist_distance(shortlist: str, storage: str) -> str:
+    """1단계 후보 검색에 사용할 거리 식. 인덱스를 타려면 db.migrations의 인덱스 식과 같아야 한다."""
+    from config.settings import EMBEDDING_DIMENSION, SEARCH_PREFIX_DIMENSION
+
+    # halfvec 모드에서는 float32 컬럼이 비어 있을 수 있으므로 반정밀도 컬럼으로 후보를 찾는다.
+    column = "embedding_half" if storage == "halfvec" else "embedding"
+    query = QUERY_VECTOR
+    if shortlist == "binary":
+        # 각 차원의 부호만 남긴 비트 벡터의 해밍 거리
+        return f"binary_quantize({column})::bit({EMBEDDING_DIMENSION}) <~> binary_quantize({query})"
+    if shortlist == "prefix":
+        # text-embedding-3 계열은 앞쪽 차원만 잘라도 의미가 유지된다. (코사인 거리는 길이에 무관)
+        prefix_type = f"halfvec({SEARCH_PREFIX_DIMENSION})" if storage == "halfvec" else f"vector({SEARCH_PREFIX_DIMENSION})"
+        return (
+            f"subvector({column}, 1, {SEARCH_PREFIX_DIMENSION})::{prefix_type} <=> "
+            f"subvector({query}, 1, {SEARCH_PREFIX_DIMENSION})::{prefix_type}"
+        )
+    return f"embedding_half {get_distance_operator()} CAST({query} AS halfvec({EMBEDDING_DIMENSION}))"
+
+
+def get_search_column(storage: str = None, keep_full_precision: bool = None):
+    """정확한 유사도를 계산할 임베딩 컬럼, 컬럼 타입, binary 전송 함수 (halfvec 모드에서 float32 사본이 없으면 반정밀도 컬럼)"""
+    from config.settings import EMBEDDING_STORAGE, EMBEDDING_DIMENSION, EMBEDDING_KEEP_FULL_PRECISION
+
+    storage = storage or EMBEDDING_STORAGE
+    if keep_full_precision is None:
+        keep_full_precision = EMBEDDING_KEEP_FULL_PRECISION
+    if storage != "halfvec" or keep_full_precision:
+        return "embedding", "vector", "vector_send"
+    return "embedding_half", f"halfvec({EMBEDDING_DIMENSION})", "halfvec_send"
+
+
+def get_path_pattern(path_prefix: str):
+    """폴더 경로를 그 폴더와 하위 폴더의 문서에 맞는 LIKE 패턴으로 변환. 루트이거나 없으면 None"""
+    path_prefix = (path_prefix or "").rstrip("/")
+    if not path_prefix:
+        return None
+    # 폴더 이름의 %, _는 와일드카드가 아닌 문자로 취급한다.
+    escaped = path_prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return escaped + "/%"
+
+
+def get_scope_filter(owner_id: int = None, path_prefix: str = None):
+    """사용자/폴더 검색 범위 조건과 파라미터를 반환 (벡터 검색 쿼리의 WHERE 절에 그대로 붙인다)"""
+    conditions = []
+    params = {}
+    if owner_id is not None:
+        conditions.append("AND owner_id = :owner_id")
+        params["owner_id"] = owner_id
+    path_pattern = get_path_pattern(path_prefix)
+    if path_pattern is not None:
+        # ix_document_chunks_owner_path(text_pattern_ops) 인덱스로 접두사 검색이 가능하다.
+        conditions.append("AND document_path LIKE :path_pattern")
+        params["path_pattern"] = path_pattern
+    return " ".join(conditions), params
+
+
+def build_similarity_query(
+    query_embedding,
+    top_n: int,
+    storage: str = None,
+    keep_full_precision: bool = None,
+    shortlist: str = None,
+    shortlist_size: int = None,
+    owner_id: int = None,
+    path_prefix: str = None,
+    lexical_query: str = None
+):
+    """임베딩 저장 방식(EMBEDDING_STORAGE)과 후보 검색 방식(SEARCH_SHORTLIST)에 맞는 유사도 검색 쿼리와 파라미터를 반환
+
+    후보 검색을 사용하면 저렴한 거리(halfvec, 이진 양자화, 앞쪽 차원)로 shortlist_size개의 후보를 뽑고
+    전체 임베딩으로 정확한 코사인 유사도를 다시 계산해 상위 top_n개를 반환한다.
+    결과에는 청크 id, binary 형식 임베딩, 유사도만 포함한다. (내용은 aload_chunk_documents로 따로 가져온다)
+    owner_id, path_prefix를 주면 그 사용자의 문서(폴더와 하위 폴더)만 검색한다. 조건은 벡터 인덱스 검색과 같은 단계에서 적용된다.
+    lexical_query(rag.lexical.to_tsquery_text)를 주면 전문 검색 후보와 RRF로 합친다. (get_search_query 참고)
+    인자를 지정하지 않으면 설정 값을 사용한다. (벤치마크에서 방식 비교용)
+    쿼리 문자열은 설정과 방식에만 의존하므로 연결마다 한 번 prepare된 뒤 재사용된다.
+    """
+    from config.settings import (
+        EMBEDDING_STORAGE, EMBEDDING_DIMENSION, EMBEDDING_KEEP_FULL_PRECISION, EMBEDDING_RESCORE_FACTOR,
+        SEARCH_SHORTLIST_SIZE
+    )
+
+    storage = storage or EMBEDDING_STORAGE
+    if keep_full_precision is None:
+        keep_full_precision = EMBEDDING_KEEP_FULL_PRECISION
+
+    # 정확한 유사도를 계산할 컬럼 (halfvec 모드에서 float32 사본이 없으면 반정밀도 컬럼)
+    # 임베딩은 binary 형식(bytea)으로 받아 decode_vectors로 한 번에 행렬로 변환한다.
+    column, column_type, send_function = get_search_column(storage, keep_full_precision)
+    distance = f"{column} {get_distance_operator()} CAST({QUERY_VECTOR} AS {column_type})"
+    similarity = get_similarity_expression(distance)
+
+    shortlist = resolve_shortlist(storage, keep_full_precision, shortlist)
+    query_cte = f"query AS (SELECT CAST(:query_embedding AS vector({EMBEDDING_DIMENSION})) AS query_vector)"
+    params = {"query_embedding": to_query_vector(query_embedding), "top_n": top_n}
+    scope, scope_params = get_scope_filter(owner_id, path_prefix)
+    params.update(scope_params)
+
+    if shortlist == "none":
+        ctes = query_cte
+        vector_select = f"""
+            SELECT
+                id,
+                {send_function}({column}) AS embedding,
+                {similarity} AS similarity
+            FROM 
+                document_chunks
+            WHERE 
+                {column} IS NOT NULL
+                {scope}
+            ORDER BY 
+                {distance}
+            LIMIT :top_n
+            """
+        return get_search_query(ctes, vector_select, params, lexical_query, column, send_function, similarity, scope)
+
+    if not shortlist_size:
+        if shortlist == "halfvec":
+            shortlist_size = top_n * max(1, EMBEDDING_RESCORE_FACTOR)
+        else:
+            shortlist_size = SEARCH_SHORTLIST_SIZE
+    shortlist_size = max(shortlist_size, top_n)
+
+    shortlist_distance = get_shortlist_distance(shortlist, storage)
+    shortlist_column = "embedding_half" if storage == "halfvec" else "embedding"
+    params["shortlist_size"] = shortlist_size
+    ctes = f"""{query_cte},
+        shortlist AS (
+            SELECT id, {column}
+            FROM document_chunks
+            WHERE {shortlist_column} IS NOT NULL
+            {scope}
+            ORDER BY {shortlist_distance}
+            LIMIT :shortlist_size
+        )"""
+    vector_select = f"""
+        SELECT
+            id,
+            {send_function}({column}) AS embedding,
+            {similarity} AS similarity
+        FROM 
+            shortlist
+        WHERE 
+            {column} IS NOT NULL
+        ORDER BY 
+            similarity DESC
+        LIMIT :top_n
+        """
+    return get_search_query(ctes, vector_select, params, lexical_query, column, send_function, similarity, scope)
+
+
+def get_search_query(ctes, vector_select, params, lexical_query, column, send_function, similarity, scope):
+    """벡터 검색 쿼리를 완성한다. lexical_query(tsquery 문자열)가 있으면 전문 검색 후보와 RRF로 합치는 하이브리드 쿼리를 만든다.
+
+    하이브리드 쿼리는 벡터 검색 상위 top_n개와 전문 검색 상위 top_n개의 순위를 한 쿼리 안에서
+    sum(1 / (SEARCH_RRF_K + 순위))로 합쳐 상위 top_n개를 반환하며, 결과에 RRF 점수(score)가 추가된다.
+    """
+    from config.settings import SEARCH_RRF_K
+
+    if lexical_query is None:
+        return text(f"WITH {ctes}{vector_select}"), params
+
+    params["lexical_query"] = lexical_query
+    params["rrf_k"] = SEARCH_RRF_K
+    return text(
+    f"""WITH {ctes},
+        vector_candidates AS (
+            SELECT id, row_number() OVER (ORDER BY similarity DESC) AS rank
+            FROM ({vector_select}) AS vector_results
+        ),
+        lexical_candidates AS (
+            SELECT id, row_number() OVER (ORDER BY lexical_rank DESC, id) AS rank
+            FROM ({get_lexical_select(column, scope)}) AS lexical_matches
+        ),
+        fused AS (
+            SELECT id, sum(1.0 / (:rrf_k + rank)) AS score
+            FROM (
+                SELECT id, rank FROM vector_candidates
+                UNION ALL
+                SELECT id, rank FROM lexical_candidates
+            ) AS ranked
+            GROUP BY id
+            ORDER BY score DESC
+            LIMIT :top_n
+        )
+        SELECT
+            document_chunks.id,
+            {send_function}({column}) AS embedding,
+            {similarity} AS similarity,
+            fused.score AS score
+        FROM 
+            fused JOIN document_chunks ON document_chunks.id = fused.id
+        ORDER BY 
+            fused.score DESC
+        """), params
+
+
+def get_index_settings_query(params: dict):
+    """유사도 검색 쿼리 파라미터에 맞는 벡터 인덱스 검색 설정 쿼리와 파라미터를 반환"""
+    from config.settings import (
+        VECTOR_INDEX_EF_SEARCH, VECTOR_INDEX_PROBES, VECTOR_INDEX_ITERATIVE_SCAN, VECTOR_INDEX_MAX_SCAN_TUPLES
+    )
+
+    # HNSW 인덱스 검색은 최대 hnsw.ef_search개만 반환하므로 가져올 행 수보다 작지 않게 한다. (최대 1000)
+    limit = params.get("shortlist_size", params["top_n"])
+    ef_search = min(max(VECTOR_INDEX_EF_SEARCH, limit), 1000)
+    # set_config(..., true)는 현재 트랜잭션에만 적용된다.
+    settings = {"hnsw.ef_search": str(ef_search), "ivfflat.probes": str(VECTOR_INDEX_PROBES)}
+    scoped = "owner_id" in params or "path_pattern" in params
+    if scoped and VECTOR_INDEX_ITERATIVE_SCAN != "off":
+        # 인덱스가 찾은 ef_search개 중 다른 사용자의 청크가 걸러져도 limit개를 채울 때까지 인덱스를 계속 탐색한다.
+        # relaxed_order의 결과 순서는 조금 어긋날 수 있지만 후보 검색은 다시 정렬하고 MMR은 순서를 사용하지 않는다.
+        settings["hnsw.iterative_scan"] = VECTOR_INDEX_ITERATIVE_SCAN
+        settings["hnsw.max_scan_tuples"] = str(VECTOR_INDEX_MAX_SCAN_TUPLES)
+        # IVFFlat은 relaxed_order만 지원한다.
+        settings["ivfflat.iterative_scan"] = "relaxed_order"
+    names = list(settings)
+    return (
+        text("SELECT " + ", ".join(f"set_config(:name_{i}, :value_{i}, true)" for i in range(len(names)))),
+        {
+            **{f"name_{i}": name for i, name in enumerate(names)},
+            **{f"value_{i}": settings[name] for i, name in enumerate(names)},
+        }
+    )
+
+
+def get_lexical_select(column: str, scope: str) -> str:
+    """전문 검색에 일치한 청크 중 ts_rank 상위 top_n개의 id와 순위 점수(lexical_rank)를 가져오는 쿼리
+
+    일치하는 청크는 GIN 인덱스(content_tsv)로 찾고, 모두 ts_rank를 계산한 뒤 상위 top_n개만 남기는 정렬(top-N heapsort)을 사용한다.
+    동점은 id 순서로 정하므로 같은 데이터에서는 항상 같은 후보가 나온다.
+    """
+    return f"""
+            SELECT id, ts_rank(content_tsv, lexical.lexical_query) AS lexical_rank
+            FROM document_chunks, (SELECT CAST(:lexical_query AS tsquery) AS lexical_query) AS lexical
+            WHERE content_tsv @@ lexical.lexical_query
+            AND {column} IS NOT NULL
+            {scope}
+            ORDER BY lexical_rank DESC, id
+            LIMIT :top_n
+            """
+
+
+def build_lexical_query(lexical_query: str, top_n: int, owner_id: int = None, path_prefix: str = None):
+    """전문 검색 후보 id만 순위대로 가져오는 쿼리와 파라미터 (로컬 인덱스의 하이브리드 검색용)"""
+    column, _, _ = get_search_column()
+    scope, scope_params = get_scope_filter(owner_id, path_prefix)
+    return text(get_lexical_select(column, scope)), {"lexical_query": lexical_query, "top_n": top_n, **scope_params}
+
+
+def execute_similarity_query(connection, similarity_query, params: dict):
+    """build_similarity_query로 만든 쿼리를 벡터 인덱스 검색 설정과 함께 실행"""
+    connection.execute(*get_index_settings_query(params))
+    return connection.execute(similarity_query, params)
+
+
+async def aexecute_similarity_query(connection, similarity_query, params: dict):
+    """execute_similarity_query의 비동기 버전 (AsyncConnection)"""
+    await connection.execute(*get_index_settings_query(params))
+    return await connection.execute(similarity_query, params)
+
+
+def decode_vectors(blobs: list) -> np.ndarray:
+    """vector_send/halfvec_send로 받은 binary 임베딩 리스트를 (행 수, 차원) float32 행렬로 변환
+
+    binary 형식은 차원 수(2바이트), 예약 값(2바이트) 다음에 big-endian float32(halfvec은 float16) 값이 이어진다.
+    """
+    if not blobs:
+        return np.empty((0, 0), dtype=np.float32)
+    dimension = int.from_bytes(blobs[0][:2], "big")
+    width = (len(blobs[0]) - 4) // max(dimension, 1)
+    dtype, header = (">f2", 2) if width == 2 else (">f4", 1)
+    values = np.frombuffer(b"".join(blobs), dtype=dtype).reshape(len(blobs), -1)
+    return np.ascontiguousarray(values[:, header:], dtype=np.float32)
+
+
+def get_empty_candidates() -> dict:
+    """검색 결과가 없을 때의 후보"""
+    return {"ids": [], "similarities": np.empty(0, dtype=np.float32), "embeddings": np.empty((0, 0), dtype=np.float32)}
+
+
+def prepare_similarity_search(
+    embed_query_data,
+    shortlist_size: int = None,
+    fetch_k: int = None,
+    owner_id: int = None,
+    path_prefix: str = None,
+    query: str = None
+):
+    """asearch_similarity의 검색 쿼리, 파라미터, 전문 검색 질의(하이브리드가 아니면 None)를 반환"""
+    # 상위 유사도 문서 검색 쿼리
+    # 1. 유효한 임베딩 벡터만 고려 (NULL 아님)
+    # 2. 코사인 유사도 계산: 1 - (벡터1 <=> 벡터2)
+    # 3. 유사도 기준으로 정렬하여 상위 N개 가져오기
+    from config.settings import MMR_FETCH_K, SEARCH_HYBRID
+    from rag.lexical import to_tsquery_text
+    top_n = fetch_k or MMR_FETCH_K  # 후보 문서 수
+    lexical_query = to_tsquery_text(query) if SEARCH_HYBRID and query else None
+
+    similarity_query, params = build_similarity_query(
+        embed_query_data, top_n, shortlist_size=shortlist_size, owner_id=owner_id, path_prefix=path_prefix,
+        lexical_query=lexical_query
+    )
+    return similarity_query, params, lexical_query
+
+
+def to_candidates(rows: list) -> dict:
+    """검색 결과 행을 후보 dict로 변환"""
+    print(f"데이터베이스에서 {len(rows)}개의 후보 문서를 가져왔습니다.")
+
+    if not rows:
+        print("유사한 문서를 찾을 수 없습니다.")
+        return get_empty_candidates()
+
+    # 하이브리드 검색도 MMR의 관련성은 코사인 유사도를 사용한다. (RRF 점수는 후보와 순서를 정하는 데만 사용)
+    # RRF 점수는 다양성 항(코사인 유사도)과 척도가 달라 lambda_mult의 의미가 벡터 검색과 달라진다.
+    similarities = np.array([row.similarity for row in rows], dtype=np.float32)
+    return {
+        "ids": [row.id for row in rows],
+        "similarities": similarities,
+        "embeddings": decode_vectors([bytes(row.embedding) for row in rows]),
+    }
+
+
+async def asearch_similarity(
+    embed_query_data,
+    engine,
+    shortlist_size: int = None,
+    fetch_k: int = None,
+    owner_id: int = None,
+    path_prefix: str = None,
+    query: str = None
+) -> dict:
+    """db에서 유사도 검색 수행 (engine: AsyncEngine, shortlist_size: 후보 검색을 사용할 때 1단계 후보 수, fetch_k: MMR에 넘길 후보 수, 없으면 설정 값)
+
+    owner_id, path_prefix를 주면 그 사용자의 청크(폴더 경로 아래의 문서)만 검색한다.
+    query(질의 원문)를 주고 SEARCH_HYBRID가 켜져 있으면 전문 검색 후보와 RRF로 합친 후보를 같은 쿼리에서 가져온다.
+    이때 후보는 RRF 점수 순서이고, similarities는 벡터 검색과 같이 질의와의 코사인 유사도이다. (MMR의 관련성 점수로 사용)
+    LOCAL_INDEX_ENABLED이면 청크 수가 적은 사용자는 pgvector 대신 로컬 인덱스(rag.local_index)에서 검색한다.
+
+    후보 청크의 id, 유사도, 임베딩 행렬만 가져온다. 내용과 메타데이터는 MMR로 고른 청크만 aload_chunk_documents로 가져온다.
+    반환: {"ids": 청크 id 리스트, "similarities": (n,) float32 배열, "embeddings": (n, 차원) float32 행렬}
+    """
+    import asyncio
+    from rag.local_index import get_local_index, search_local_index
     try:
-        # 문서 목록을 저장할 변수
-        docs = []
-        # connection 직접 가져오기
-        with engine.connect() as connection:
-            # 데이터베이스에서 직접 유사도 계산 및 상위 문서 가져오기
-            # 쿼리 임베딩을 문자열로 변환
-            query_embedding_str = str(embed_query_data)
-            query_embedding_str = query_embedding_str.replace("'", "\"")  # 잠재적인 SQL 인젝션 방지
-            
-            # 상위 유사도 문서 검색 쿼리
-            # 1. 유효한 임베딩 벡터만 고려 (NULL 아님)
-            # 2. 코사인 유사도 계산: 1 - (벡터1 <=> 벡터2)
-            # 3. 유사도 기준으로 정렬하여 상위 N개 가져오기
-            top_n = 20  # 후보 문서 수
-            
-            # PostgreSQL에서는 쿼리 매개변수를 직접 쿼리에 포함
-            similarity_query = text(    
-            f"""SELECT
+        similarity_query, params, lexical_query = prepare_similarity_search(
+            embed_query_data, shortlist_size, fetch_k, owner_id, path_prefix, query
+        )
+        # 로컬 인덱스 동기화와 전체 탐색은 이벤트 루프를 막지 않도록 스레드에서 실행한다.
+        index = await asyncio.to_thread(get_local_index, owner_id)
+        if index is not None:
+            lexical_ids = None
+            if lexical_query is not None:
+                lexical_select, lexical_params = build_lexical_query(lexical_query, params["top_n"], owner_id, path_prefix)
+                async with engine.connect() as connection:
+                    lexical_ids = [row.id for row in await connection.execute(lexical_select, lexical_params)]
+            return await asyncio.to_thread(
+                search_local_index, index, embed_query_data, params["top_n"], path_prefix, lexical_ids
+            )
+
+        async with engine.connect() as connection:
+            rows = (await aexecute_similarity_query(connection, similarity_query, params)).fetchall()
+        return to_candidates(rows)
+    except Exception as e:
+        print(f"문서 검색 오류: {str(e)}")
+        print(f"오류 상세 내용: {traceback.format_exc()}")
+        return get_empty_candidates()
+
+
+def build_batch_similarity_query(
+    query_embeddings: list,
+    top_n: int,
+    storage: str = None,
+    keep_full_precision: bool = None,
+    owner_id: int = None,
+    path_prefix: str = None
+):
+    """여러 질의의 상위 top_n개 후보를 한 번에 가져오는 쿼리와 파라미터를 반환
+
+    질의 벡터 배열을 unnest로 펼치고, 질의마다 LATERAL 서브쿼리에서 벡터 인덱스로 top_n개를 찾는다.
+    결과 행에는 질의 순서(query_index)가 붙으며, 행의 나머지 컬럼은 build_similarity_query와 같다.
+    인덱스 컬럼(halfvec 모드에서는 embedding_half)으로 후보를 찾고 유사도는 가장 정확한 컬럼으로 계산한다.
+    전문 검색 후보와 합치지 않고, 후보를 다시 정렬하는 2단계 검색도 하지 않는다.
+    """
+    from config.settings import EMBEDDING_STORAGE, EMBEDDING_DIMENSION, EMBEDDING_KEEP_FULL_PRECISION
+
+    storage = storage or EMBEDDING_STORAGE
+    if keep_full_precision is None:
+        keep_full_precision = EMBEDDING_KEEP_FULL_PRECISION
+
+    column, column_type, send_function = get_search_column(storage, keep_full_precision)
+    if storage == "halfvec":
+        index_column, index_type = "embedding_half", f"halfvec({EMBEDDING_DIMENSION})"
+    else:
+        index_column, index_type = "embedding", "vector"
+    query_vector = "queries.query_vector"
+    similarity = get_similarity_expression(f"{column} {get_distance_operator()} CAST({query_vector} AS {column_type})")
+    index_distance = f"{index_column} {get_distance_operator()} CAST({query_vector} AS {index_type})"
+
+    params = {"query_embeddings": [to_query_vector(embedding) for embedding in query_embeddings], "top_n": top_n}
+    scope, scope_params = get_scope_filter(owner_id, path_prefix)
+    params.update(scope_params)
+    return text(f"""
+        WITH queries AS (
+            SELECT
+                (ordinality - 1)::int AS query_index,
+                CAST(query_vector AS vector({EMBEDDING_DIMENSION})) AS query_vector
+            FROM unnest(CAST(:query_embeddings AS vector[])) WITH ORDINALITY AS query_vectors(query_vector, ordinality)
+        )
+        SELECT
+            queries.query_index,
+            candidates.id,
+            candidates.embedding,
+            candidates.similarity
+        FROM
+            queries
+            CROSS JOIN LATERAL (
+                SELECT
                     id,
-                    document_id,
-                    content,
-                    meta,
-                    embedding,
-                    1 - (embedding <=> CAST('{query_embedding_str}' AS vector)) AS similarity
-                FROM 
+                    {send_function}({column}) AS embedding,
+                    {similarity} AS similarity
+                FROM
                     document_chunks
-                WHERE 
-                    embedding IS NOT NULL
-                    AND vector_dims(embedding) > 0
-                ORDER BY 
-                    embedding <=> CAST('{query_embedding_str}' AS vector)
+                WHERE
+                    {index_column} IS NOT NULL
+                    AND {column} IS NOT NULL
+                    {scope}
+                ORDER BY
+                    {index_distance}
                 LIMIT :top_n
-                """)           
-            # 쿼리 실행 (top_n만 파라미터로 전달)
-            result = connection.execute(
-                similarity_query, 
-                {"top_n": top_n}
-            )
+            ) AS candidates
+        ORDER BY
+            queries.query_index, candidates.similarity DESC
+        """), params
+
 
-            candidates = [dict(row._mapping) for row in result]
-            print(f"데이터베이스에서 {len(candidates)}개의 후보 문서를 가져왔습니다.")
-
-            # 후보 문서가 없으면 빈 리스트 반환
-            if not candidates:
-                print("유사한 문서를 찾을 수 없습니다.")
-                docs = []
-                return (docs)
-            
-        candidate_docs = []
-        # 각 문서의 임베딩을 numpy 배열로 변환
-        for row in candidates:
-            try:
-                # 임베딩이 문자열인지 확인 후 변환
-                if isinstance(row['embedding'], str):
-                    import ast
-                    try:
-                        # 문자열 형태의 임베딩을 배열로 변환 시도
-                        embedding_data = ast.literal_eval(row['embedding'])
-                        doc_embedding = np.array(embedding_data, dtype=float)
-                    except (ValueError, SyntaxError) as e:
-                        print(f"임베딩 문자열 파싱 오류: {str(e)} - 문서 ID: {row['id']}")
-                        continue  # 이 문서는 건너뜁니다
-                else:
-                    doc_embedding = np.array(row['embedding'])
-
-                # 임베딩 벡터 검증
-                if len(doc_embedding) == 0:
-                    print(f"빈 임베딩 벡터 - 문서 ID: {row['id']}")
-                    continue
-                
-                candidate_docs.append({
-                    "id": row['id'],
-                    "document_id": row['document_id'],
-                    "content": row['content'],
-                    "meta": row['meta'],
-                    "embedding": doc_embedding,
-                    "similarity": row['similarity']
-                })
-            except Exception as e:
-                print(f"임베딩 변환 오류: {str(e)} - 문서 ID: {row['id']}")
-                continue            
-
-        return (candidate_docs)
+async def asearch_similarity_batch(
+    query_embeddings: list,
+    engine,
+    fetch_k: int = None,
+    owner_id: int = None,
+    path_prefix: str = None
+) -> list:
+    """여러 질의의 유사도 검색을 한 쿼리로 수행 (engine: AsyncEngine). 질의 순서대로 asearch_similarity 형식의 후보 리스트를 반환"""
+    from config.settings import MMR_FETCH_K
+
+    if not query_embeddings:
+        return []
+    try:
+        top_n = fetch_k or MMR_FETCH_K
+        similarity_query, params = build_batch_similarity_query(
+            query_embeddings, top_n, owner_id=owner_id, path_prefix=path_prefix
+        )
+        async with engine.connect() as connection:
+            rows = (await aexecute_similarity_query(connection, similarity_query, params)).fetchall()
     except Exception as e:
         print(f"문서 검색 오류: {str(e)}")
         print(f"오류 상세 내용: {traceback.format_exc()}")
-        # 오류 발생 시 빈 문서 리스트 반환
-        docs = []
-        return (docs)                 # 쿼리의 결과는 candidates 리스트에 저장된다.
-
-
-def do_mmr(candidate_docs):
-    """MMR 알고리즘 구현"""
-    import numpy as np
-
-    selected_docs = []
-    lambda_val = 0.5  # MMR 가중치 - 관련성과 다양성 균형
-    max_documents = 3  # 최종 반환 문서 수
-
-
-    # 유사도 기준으로 정렬
-    candidate_docs = sorted(candidate_docs, key=lambda x: x["similarity"], reverse=True)
-
-    while len(selected_docs) < max_documents and candidate_docs:
-        # MMR 점수 계산
-        mmr_scores = {}
-        for i, doc in enumerate(candidate_docs):
-            if len(selected_docs) == 0:
-                # 첫 번째 문서는 유사도가 가장 높은 것 선택
-                mmr_scores[i] = doc["similarity"]
-            else:
-                # 이미 선택된 문서와의 최대 유사도 계산
-                max_sim_with_selected = 0
-                for selected_doc in selected_docs:
-                    # 코사인 유사도 계산 - 0으로 나누기 예외 처리
-                    try:
-                        # 디버깅: 임베딩 타입 확인 -  디버깅 시에만 주석 해제하기.
-                        # print(f"doc embedding type: {type(doc['embedding'])}")
-                        # print(f"doc embedding sample: {str(doc['embedding'])[:100]}")
-                        # print(f"selected_doc embedding type: {type(selected_doc['embedding'])}")
-                        # print(f"selected_doc embedding sample: {str(selected_doc['embedding'])[:100]}")
-
-                        # 임베딩이 문자열인 경우 배열로 변환 시도
-                        if isinstance(doc["embedding"], str):
-                            import ast
-                            try:
-                                doc["embedding"] = np.array(ast.literal_eval(doc["embedding"]), dtype=float)
-                            except:
-                                # 문자열을 배열로 변환할 수 없는 경우 빈 배열 사용
-                                doc["embedding"] = np.array([], dtype=float)
-
-                        if isinstance(selected_doc["embedding"], str):
-                            import ast
-                            try:
-                                selected_doc["embedding"] = np.array(ast.literal_eval(selected_doc["embedding"]), dtype=float)
-                            except:
-                                # 문자열을 배열로 변환할 수 없는 경우 빈 배열 사용
-                                selected_doc["embedding"] = np.array([], dtype=float)
-
-                        # 빈 배열이거나 모양이 맞지 않는 경우 건너뛰기
-                        if len(doc["embedding"]) == 0 or len(selected_doc["embedding"]) == 0:
-                            print("임베딩 벡터가 비어 있어 유사도 계산을 건너뜁니다.")
-                            sim = 0
-                            continue
-                        
-                        doc_norm = np.linalg.norm(doc["embedding"])
-                        selected_norm = np.linalg.norm(selected_doc["embedding"])
-
-                        # 0으로 나누기 방지
-                        if doc_norm > 0 and selected_norm > 0:
-                            sim = np.dot(doc["embedding"], selected_doc["embedding"]) / (doc_norm * selected_norm)
-                        else:
-                            sim = 0
-
-                        max_sim_with_selected = max(max_sim_with_selected, sim)
-                    except Exception as e:
-                        print(f"유사도 계산 오류: {str(e)}")
-                        # 오류 발생 시 기본값 사용
-                        sim = 0
-
-                # MMR 점수 계산
-                mmr_scores[i] = lambda_val * doc["similarity"] - (1 - lambda_val) * max_sim_with_selected
-        # 가장 높은 MMR 점수를 가진 문서 선택
-        if mmr_scores:
-            try:
-                selected_idx = max(mmr_scores, key=mmr_scores.get)
-                selected_docs.append(candidate_docs[selected_idx])
-                candidate_docs.pop(selected_idx)
-            except (ValueError, KeyError, IndexError) as e:
-                print(f"문서 선택 오류: {str(e)}")
-                break  # 문서 선택 오류 시 루프 종료
-        else:
-            break
+        return [get_empty_candidates() for _ in query_embeddings]
+
+    print(f"데이터베이스에서 질의 {len(query_embeddings)}개의 후보 문서 {len(rows)}개를 가져왔습니다.")
+    rows_by_query = [[] for _ in query_embeddings]
+    for row in rows:
+        rows_by_query[row.query_index].append(row)
+    return [
+        {
+            "ids": [row.id for row in query_rows],
+            "similarities": np.array([row.similarity for row in query_rows], dtype=np.float32),
+            "embeddings": decode_vectors([bytes(row.embedding) for row in query_rows]),
+        } if query_rows else get_empty_candidates()
+        for query_rows in rows_by_query
+    ]
+
+
+# 청크 id로 내용과 메타데이터를 가져오는 쿼리
+CHUNK_DOCUMENTS_QUERY = text("""
+    SELECT id, content, document_name, document_path
+    FROM document_chunks
+    WHERE id = ANY(:chunk_ids)
+    """)
+
 
-    # 7. 결과를 Document 객체 리스트로 변환
+def to_chunk_documents(rows, chunk_ids: list) -> list:
+    """조회한 청크 행을 청크 id 순서대로 Document 리스트로 변환"""
+    chunks = {row.id: row for row in rows}
     docs = []
-    for doc in selected_docs:
-        try:
-            # metadata가 None인 경우 빈 딕셔너리로 대체
-            metadata = doc["meta"] if doc["meta"] is not None else {}
-            
-            doc_obj = Document(
-                page_content=doc["content"] or "",  # content가 None인 경우 빈 문자열로 대체
-                metadata=metadata
-            )
-            docs.append(doc_obj)
-        except Exception as e:
-            print(f"Document 객체 생성 오류: {str(e)} - 문서 ID: {doc.get('id', 'unknown')}")
-            continue            
-    
+    for chunk_id in chunk_ids:
+        row = chunks.get(chunk_id)
+        if row is None:
+            # 검색 후 삭제된 청크
+            continue
+        docs.append(Document(
+            page_content=row.content or "",  # content가 None인 경우 빈 문자열로 대체
+            # 문서 이름/경로는 임베딩이 아닌 컬럼에서 가져와 답변 생성 시 사용한다.
+            metadata={"chunk_id": row.id, "document_name": row.document_name, "document_path": row.document_path}
+        ))
     return docs
+
+
+async def aload_chunk_documents(engine, chunk_ids: list) -> list:
+    """청크 id 순서대로 내용과 메타데이터를 가져와 Document 리스트로 반환 (engine: AsyncEngine)"""
+    if not chunk_ids:
+        return []
+    try:
+        async with engine.connect() as connection:
+            rows = (await connection.execute(CHUNK_DOCUMENTS_QUERY, {"chunk_ids": list(chunk_ids)})).fetchall()
+    except Exception as e:
+        print(f"청크 내용 조회 오류: {str(e)}")
+        return []
+    return to_chunk_documents(rows, chunk_ids)
+
+
+def select_mmr(similarities: np.ndarray, embeddings: np.ndarray, k: int, lambda_mult: float) -> list:
+    """MMR로 후보 중 k개의 인덱스를 선택 순서대로 반환
+
+    후보 임베딩의 노름을 한 번만 계산하고 선택된 문서와의 최대 유사도 벡터를 유지하므로
+    선택 한 번에 행렬-벡터 곱 한 번만 계산한다.
+    """
+    candidate_count = len(similarities)
+    if candidate_count == 0 or k <= 0:
+        return []
+
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    # 행렬 전체를 정규화하는 대신 내적 결과에 노름의 역수를 곱한다. (0 벡터는 유사도 0)
+    norms = np.sqrt(np.einsum("ij,ij->i", embeddings, embeddings))
+    inverse_norms = np.divide(1, norms, out=np.zeros_like(norms), where=norms > 0)
+
+    relevance = lambda_mult * np.asarray(similarities, dtype=np.float32)
+    # 선택된 문서와의 최대 코사인 유사도 (선택된 문서가 없거나 음수이면 0)
+    max_similarity = np.zeros(candidate_count, dtype=np.float32)
+    scores = np.empty(candidate_count, dtype=np.float32)
+    available = np.ones(candidate_count, dtype=bool)
+
+    selected = []
+    for _ in range(min(k, candidate_count)):
+        np.multiply(max_similarity, 1 - lambda_mult, out=scores)
+        np.subtract(relevance, scores, out=scores)
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        cosine = embeddings @ embeddings[best]
+        cosine *= inverse_norms
+        cosine *= inverse_norms[best]
+        np.maximum(max_similarity, cosine, out=max_similarity)
+    return selected
+
+
+def get_mmr_selection(candidates: dict, k: int = None, lambda_mult: float = None) -> list:
+    """ado_mmr이 고른 후보 인덱스 (k, lambda_mult가 없으면 설정 값)"""
+    from config.settings import MMR_K, MMR_LAMBDA
+
+    k = MMR_K if k is None else k
+    lambda_mult = MMR_LAMBDA if lambda_mult is None else lambda_mult
+    return select_mmr(candidates["similarities"], candidates["embeddings"], k, lambda_mult)
+
+
+async def ado_mmr(candidates: dict, engine, k: int = None, lambda_mult: float = None) -> list:
+    """MMR 알고리즘 구현 (고른 청크의 내용만 가져와 Document 리스트로 반환, engine: AsyncEngine)
+
+    k: 최종 반환 문서 수, lambda_mult: 관련성과 다양성의 균형 (1이면 관련성만 사용). 없으면 설정 값을 사용한다.
+    """
+    selected = get_mmr_selection(candidates, k, lambda_mult)
+
+    if "documents" in candidates:
+        # 재순위 단계에서 이미 가져온 내용
+        return [candidates["documents"][i] for i in selected]
+    return await aload_chunk_documents(engine, [candidates["ids"][i] for i in selected])
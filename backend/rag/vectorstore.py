@@ -1,57 +1,209 @@
-from rag.embeddings import get_embeddings
+from rag.embedding_cache import get_cached_embeddings, get_embedding_cache_stats, hash_text
 
 
 
-async def save_to_vector_store(db, documents, file_name, file_path):
-    """문서를 PostgreSQL 벡터 스토어에 저장합니다."""
-    from db.database import SessionLocal
+async def save_to_vector_store(db, documents, file_name, file_path, document_id=None, replace=False):
+    """청크 리스트를 PostgreSQL 벡터 스토어에 저장합니다. (save_stream_to_vector_store 참고)"""
+    async def single_batch():
+        yield documents
+
+    return await save_stream_to_vector_store(
+        db, single_batch(), file_name, file_path, document_id=document_id, replace=replace
+    )
+
+
+async def save_stream_to_vector_store(db, chunk_stream, file_name, file_path, document_id=None, replace=False):
+    """청크 스트림을 PostgreSQL 벡터 스토어에 저장합니다.
+
+    chunk_stream은 청크 리스트를 내보내는 비동기 이터레이터입니다.
+    생산자 태스크가 청크를 EMBEDDING_BATCH_SIZE 개씩 묶어 크기가 INGESTION_QUEUE_SIZE인 대기열에 넣고,
+    EMBEDDING_MAX_CONCURRENCY 개의 소비자 태스크가 배치를 임베딩하고, 하나의 저장 태스크가 임베딩된 배치를
+    워커 스레드에서 순서대로 저장합니다. (세션은 동시에 한 곳에서만 사용되며 DB 쓰기가 이벤트 루프를 막지 않는다)
+    대기열이 가득 차면 파싱이 멈추므로 문서 크기와 관계없이 메모리 사용량이 일정하고,
+    파싱이 끝나기 전에 저장이 시작됩니다.
+
+    replace가 True이면 문서의 기존 청크와 내용 해시를 비교하여 추가/변경된 청크만 임베딩하여 저장하고,
+    새 문서에 없는 기존 청크는 삭제합니다. 이 경우 저장과 삭제는 모두 하나의 트랜잭션으로 처리됩니다.
+    저장/삭제한 청크는 commit 후 이 프로세스의 로컬 벡터 인덱스(rag.local_index)에도 반영합니다.
+    """
     from db import crud
+    from config.settings import EMBEDDING_BATCH_SIZE, EMBEDDING_MAX_CONCURRENCY, INGESTION_QUEUE_SIZE
+    from rag.local_index import add_chunks as add_local_chunks, remove_chunks as remove_local_chunks
+    from contextlib import aclosing
     import asyncio
     
     try:
-        # 임베딩 모델
-        embeddings = get_embeddings()
-        
-        # 각 청크에 대해
-        tasks = []
-        for chunk in documents:
-            # 해당 문서 찾기
-            content = chunk.page_content
-            
-            
-            # 문서 ID 찾기. 문서 이름이 db에 존재하면 해당 문서의 레코드 반환. # 더 효율적인 방법으로 수정하기.
+        # 임베딩 모델 (임베딩 캐시를 먼저 조회한다)
+        embeddings = get_cached_embeddings()
+
+        # 문서 ID 찾기. 문서 ID가 주어지지 않은 경우 청크마다 조회하지 않고 한 번만 조회한다.
+        if document_id is None:
             document = crud.get_file_info_by_filename(db, file_name)
-            
-            if document:
-                # 메타데이터에서 필요한 정보 추출
-                metadata_text = f"<The name of this document>{file_name}</The name of this document> <The path of this document>{file_path}</The path of this document>"
-                # 콘텐츠와 메타데이터 결합
-                combined_text = f"{metadata_text} {content}"
-                
-                # 임베딩 비동기 처리
-                tasks.append(start_embedding(db, embeddings, combined_text, document, content))
-        await asyncio.gather(*tasks)
+            if not document:
+                raise ValueError(f"documents 테이블에서 문서를 찾을 수 없습니다: {file_name}")
+            document_id = document.id
+        # 사용자별 검색을 위해 청크에 문서 소유자를 함께 저장한다.
+        owner_id = crud.get_document_owner_id(db, document_id)
+
+        batch_size = max(1, EMBEDDING_BATCH_SIZE)
+        consumer_count = max(1, EMBEDDING_MAX_CONCURRENCY)
+        queue = asyncio.Queue(maxsize=max(1, INGESTION_QUEUE_SIZE))
+        counts = {"chunks": 0, "batches": 0, "kept": 0}
+        stored_batches = []
+
+        # 교체 모드: 기존 청크를 내용 해시별로 모아 두고, 새 문서에 같은 내용이 있으면 그대로 둔다.
+        # 같은 내용의 청크가 여러 개일 수 있으므로 해시별 id 리스트로 관리한다.
+        existing_chunk_ids = {}
+        if replace:
+            for chunk_id, content_hash in crud.get_document_chunk_hashes(db, document_id):
+                existing_chunk_ids.setdefault(content_hash, []).append(chunk_id)
 
-        print(f"총 {len(documents)}개의 청크가 PostgreSQL에 저장되었습니다.")
-        return document.id
+        async def produce():
+            # 청크 내용만 임베딩한다. 문서 이름과 경로는 임베딩에 넣지 않고 컬럼으로 저장하여
+            # 이름 변경/이동 시 다시 임베딩하지 않아도 되도록 한다.
+            contents = []
+            async with aclosing(chunk_stream) as chunks_by_page:
+                async for chunks in chunks_by_page:
+                    for chunk in chunks:
+                        if replace:
+                            matching_ids = existing_chunk_ids.get(hash_text(chunk.page_content))
+                            if matching_ids:
+                                matching_ids.pop()
+                                counts["kept"] += 1
+                                continue
+                        contents.append(chunk.page_content)
+                        if len(contents) == batch_size:
+                            await queue.put(contents)
+                            contents = []
+            if contents:
+                await queue.put(contents)
+            # 소비자 종료 신호
+            for _ in range(consumer_count):
+                await queue.put(None)
+
+        async def consume():
+            while True:
+                contents = await queue.get()
+                if contents is None:
+                    # 저장 태스크 종료 신호
+                    await store_queue.put(None)
+                    return
+                # 배치 단위 임베딩 (비동기 API 사용)
+                vectors = await embeddings.aembed_documents(contents)
+                await store_queue.put((contents, vectors))
+
+        async def store():
+            finished_consumers = 0
+            while finished_consumers < consumer_count:
+                batch = await store_queue.get()
+                if batch is None:
+                    finished_consumers += 1
+                    continue
+                contents, vectors = batch
+                writing = asyncio.ensure_future(asyncio.to_thread(
+                    store_batch, db, document_id, file_name, file_path, contents, vectors,
+                    commit=not replace, owner_id=owner_id
+                ))
+                try:
+                    chunk_ids = await asyncio.shield(writing)
+                except asyncio.CancelledError:
+                    # 다른 태스크가 실패해도 세션을 롤백/종료하기 전에 진행 중인 저장이 끝나기를 기다린다.
+                    await asyncio.wait([writing])
+                    raise
+                if replace:
+                    # 교체 모드는 마지막에 한 번에 commit하므로 그 뒤에 로컬 인덱스에 반영한다.
+                    stored_batches.append((chunk_ids, vectors))
+                else:
+                    add_local_chunks(owner_id, chunk_ids, file_path, vectors)
+                counts["chunks"] += len(contents)
+                counts["batches"] += 1
+
+        store_queue = asyncio.Queue(maxsize=max(1, INGESTION_QUEUE_SIZE))
+        tasks = (
+            [asyncio.create_task(produce()), asyncio.create_task(store())]
+            + [asyncio.create_task(consume()) for _ in range(consumer_count)]
+        )
+        try:
+            # 한 태스크라도 실패하면 나머지 태스크를 취소하고 예외를 전달한다.
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        if replace:
+            # 새 문서에 없는 기존 청크(이전 방식의 청크 포함)를 삭제하고 한 번에 commit
+            stale_chunk_ids = [chunk_id for chunk_ids in existing_chunk_ids.values() for chunk_id in chunk_ids]
+            crud.delete_document_chunks_by_ids(db, stale_chunk_ids, commit=False)
+            db.commit()
+            for chunk_ids, vectors in stored_batches:
+                add_local_chunks(owner_id, chunk_ids, file_path, vectors)
+            remove_local_chunks(owner_id, stale_chunk_ids)
+            print(f"문서 교체: 유지 {counts['kept']}개, 추가 {counts['chunks']}개, 삭제 {len(stale_chunk_ids)}개 청크")
+
+        print(f"총 {counts['chunks']}개의 청크가 {counts['batches']}개의 배치로 PostgreSQL에 저장되었습니다.")
+        cache_stats = get_embedding_cache_stats()
+        print(f"임베딩 캐시 통계: 적중 {cache_stats['hits']}, 실패 {cache_stats['misses']}, 적중률 {cache_stats['hit_rate']:.1%}")
+        return document_id
     except Exception as e:
         print(f"PostgreSQL 저장 오류: {str(e)}")
+        if replace:
+            db.rollback()
         raise e
     finally:
         db.close()
 
-async def start_embedding(db, embeddings, combined_text, document, content):
+def store_batch(db, document_id, file_name, file_path, contents, embedding_vectors, commit=True, owner_id=None):
+    """임베딩된 청크 배치 하나를 저장하고 청크 id 리스트를 반환합니다. commit이 True이면 배치마다 하나의 트랜잭션으로 저장합니다.
+
+    이벤트 루프를 막지 않도록 워커 스레드에서 호출되며, 세션을 동시에 사용하지 않도록 한 번에 하나씩만 호출합니다.
+    """
     from db import crud
+    from sqlalchemy import inspect
 
-    embedding_vector = embeddings.embed_query(combined_text)
-    
-    # DB에 저장
-    crud.add_document_chunk(
+    chunks = crud.add_document_chunks(
         db=db,
-        document_id=document.id,
-        content=content,
-        embedding=embedding_vector
-    )    
+        document_id=document_id,
+        document_name=file_name,
+        document_path=file_path,
+        contents=contents,
+        content_hashes=[hash_text(content) for content in contents],
+        embeddings=embedding_vectors,
+        commit=commit,
+        owner_id=owner_id
+    )
+    # commit으로 만료된 청크를 다시 조회하지 않도록 identity에서 id를 읽는다.
+    return [inspect(chunk).identity[0] for chunk in chunks]
+
+
+async def reembed_legacy_chunks(db, batch_size: int = None) -> int:
+    """이름/경로가 포함된 텍스트로 임베딩된 이전 방식의 청크를 내용만으로 다시 임베딩합니다.
+
+    content_hash가 NULL인 청크가 이전 방식의 청크이며, 처리한 청크 수를 반환합니다.
+    """
+    from db import crud
+    from config.settings import EMBEDDING_BATCH_SIZE
+
+    batch_size = batch_size or EMBEDDING_BATCH_SIZE
+    embeddings = get_cached_embeddings()
+    total = 0
+    while True:
+        legacy_chunks = crud.get_legacy_document_chunks(db, batch_size)
+        if not legacy_chunks:
+            break
+        contents = [chunk.content or "" for chunk in legacy_chunks]
+        embedding_vectors = await embeddings.aembed_documents(contents)
+        crud.update_document_chunk_embeddings(
+            db,
+            [chunk.id for chunk in legacy_chunks],
+            [hash_text(content) for content in contents],
+            embedding_vectors
+        )
+        total += len(legacy_chunks)
+        print(f"이전 방식의 청크 {total}개를 다시 임베딩했습니다.")
+    return total
 
 
 def manually_create_vector_extension(engine):
@@ -81,6 +233,8 @@ def manually_create_vector_extension(engine):
         with engine.connect() as connection:
             connection.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
             connection.commit()
+        # 익스텐션이 없을 때 만들어진 연결에는 pgvector 타입 어댑터가 등록되지 않았으므로 연결 풀을 비운다.
+        engine.dispose()
         return True
     except Exception as e:
         print(f"수동 벡터 확장 생성 오류: {str(e)}")
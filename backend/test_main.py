@@ -3,7 +3,7 @@ import os
 from fastapi.testclient import TestClient
 import random
 import string
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, ANY
 from datetime import datetime
 from fastapi import HTTPException, status
 
@@ -194,3 +194,1123 @@ def test_user_me_endpoint():
     assert response.status_code == 200, f"응답 내용: {response.text}"
     
     assert response.json()["username"] == "testuser"
+
+
+def test_save_to_vector_store_batches_embeddings():
+    """청크가 배치 단위로 임베딩되고, 배치마다 한 번씩 이벤트 루프 밖에서 하나씩 저장되는지 테스트"""
+    import asyncio
+    import threading
+    from langchain_core.documents import Document as LCDocument
+    from rag import vectorstore
+
+    class FakeEmbeddings:
+        def __init__(self):
+            self.calls = []
+
+        async def aembed_documents(self, texts):
+            self.calls.append(len(texts))
+            return [[0.0, 1.0] for _ in texts]
+
+    fake_embeddings = FakeEmbeddings()
+    chunks = [LCDocument(page_content=f"chunk {i}") for i in range(10)]
+    db = MagicMock()
+    document = MagicMock(id=7)
+
+    writes = {"active": 0, "max_active": 0, "threads": set()}
+    write_lock = threading.Lock()
+
+    def add_chunks(**kwargs):
+        with write_lock:
+            writes["active"] += 1
+            writes["max_active"] = max(writes["max_active"], writes["active"])
+        writes["threads"].add(threading.get_ident())
+        with write_lock:
+            writes["active"] -= 1
+        return []
+
+    with patch('rag.vectorstore.get_cached_embeddings', return_value=fake_embeddings), \
+         patch('db.crud.get_file_info_by_filename', return_value=document) as mock_lookup, \
+         patch('db.crud.add_document_chunks', side_effect=add_chunks) as mock_add_chunks, \
+         patch('config.settings.EMBEDDING_BATCH_SIZE', 4):
+        document_id = asyncio.run(vectorstore.save_to_vector_store(db, chunks, "a.pdf", "/a.pdf"))
+
+    assert document_id == 7
+    # 세션을 공유하는 저장은 동시에 실행되지 않고, 이벤트 루프 스레드에서 실행되지 않는다.
+    assert writes["max_active"] == 1
+    assert threading.get_ident() not in writes["threads"]
+    assert sorted(fake_embeddings.calls) == [2, 4, 4]
+    assert mock_lookup.call_count == 1
+    assert mock_add_chunks.call_count == 3
+    # 문서 이름/경로는 임베딩 텍스트가 아닌 컬럼으로 저장된다.
+    first_batch = mock_add_chunks.call_args_list[0].kwargs
+    assert first_batch["document_path"] == "/a.pdf"
+    assert all(content.startswith("chunk") for content in first_batch["contents"])
+
+
+def test_cached_embeddings_only_embeds_missing_texts():
+    """임베딩 캐시에 있는 텍스트는 임베딩 모델로 보내지 않는지 테스트"""
+    from rag.embedding_cache import CachedEmbeddings, hash_text
+
+    underlying = MagicMock()
+    underlying.embed_documents.side_effect = lambda texts: [[float(len(t))] for t in texts]
+    cached = CachedEmbeddings(underlying, "test-model")
+
+    with patch.object(CachedEmbeddings, '_lookup', return_value={hash_text("cached"): [9.0]}), \
+         patch.object(CachedEmbeddings, '_store') as mock_store:
+        result = cached.embed_documents(["cached", "new", "new"])
+
+    assert result == [[9.0], [3.0], [3.0]]
+    underlying.embed_documents.assert_called_once_with(["new"])
+    mock_store.assert_called_once_with({hash_text("new"): [3.0]})
+
+
+def test_embedding_cache_key_includes_provider_and_dimension(monkeypatch):
+    """임베딩 캐시 키가 모델 이름뿐 아니라 공급자와 차원도 구분하는지 테스트"""
+    import config.settings as settings
+    from rag.embedding_cache import get_cached_embeddings
+
+    monkeypatch.setattr(settings, "EMBEDDING_CACHE_ENABLED", True)
+    monkeypatch.setattr(settings, "EMBEDDING_PROVIDER", "openai")
+    monkeypatch.setattr(settings, "EMBEDDING_MODEL", "text-embedding-3-small")
+    keys = []
+    with patch("rag.embeddings.get_embeddings"):
+        for dimension in (1536, 512):
+            monkeypatch.setattr(settings, "EMBEDDING_DIMENSION", dimension)
+            keys.append(get_cached_embeddings().model)
+    assert keys == ["openai:text-embedding-3-small:1536", "openai:text-embedding-3-small:512"]
+
+
+def test_embedding_cache_batches_touches_and_evicts_on_cadence(monkeypatch):
+    """캐시 조회마다 마지막 사용 시각을 커밋하지 않고, 저장 N번마다만 캐시 크기를 확인하는지 테스트"""
+    import rag.embedding_cache as embedding_cache
+
+    monkeypatch.setattr("config.settings.EMBEDDING_CACHE_TOUCH_INTERVAL", 300)
+    monkeypatch.setattr("config.settings.EMBEDDING_CACHE_EVICT_EVERY", 3)
+    monkeypatch.setattr(embedding_cache, "_pending_touches", {})
+    monkeypatch.setattr(embedding_cache, "_maintenance", {"last_touch_flush": 0.0, "stores_since_evict": 0})
+    now = [1000.0]
+    monkeypatch.setattr(embedding_cache.time, "monotonic", lambda: now[0])
+
+    db = MagicMock()
+    db.execute.return_value = [MagicMock(text_hash="a", embedding=[1.0])]
+    embedding_cache.lookup_cached_embeddings(db, "m", ["a"])
+    assert db.commit.call_count == 1
+    db.execute.return_value = [MagicMock(text_hash="b", embedding=[2.0])]
+    embedding_cache.lookup_cached_embeddings(db, "m", ["b"])
+    assert db.commit.call_count == 1
+    now[0] += 301
+    embedding_cache.lookup_cached_embeddings(db, "m", ["b"])
+    assert db.commit.call_count == 2
+    assert embedding_cache._pending_touches == {}
+
+    with patch.object(embedding_cache, "evict_embedding_cache") as mock_evict:
+        for _ in range(6):
+            embedding_cache.store_cached_embeddings(MagicMock(), "m", {"c": [1.0]})
+    assert mock_evict.call_count == 2
+
+
+def test_ingestion_jobs_endpoint():
+    """문서 수집 작업 상태 조회 테스트"""
+    job = MagicMock(
+        id=3, document_id=10, file_name="a.pdf", file_path="/a.pdf",
+        status="running", stage="chunked", attempts=1, max_attempts=3, error=None,
+        created_at=datetime.now(), updated_at=datetime.now(), finished_at=None
+    )
+    with patch('db.crud.get_ingestion_jobs', return_value=[job]) as mock_get_jobs:
+        response = client.get(
+            "/fast_api/documents/jobs?job_ids=3",
+            headers={"Authorization": "Bearer fake_token"}
+        )
+
+    assert response.status_code == 200, f"응답 내용: {response.text}"
+    data = response.json()["jobs"]
+    assert data[0]["job_id"] == 3
+    assert data[0]["stage"] == "chunked"
+    assert mock_get_jobs.call_args.args[2] == [3]
+
+
+def test_split_page_ranges():
+    """PDF 페이지 구간 분할 테스트 (순서 유지, 빠짐없이 분할)"""
+    from rag.file_load import split_page_ranges
+
+    assert split_page_ranges(45, 10) == [(0, 10), (10, 20), (20, 30), (30, 40), (40, 45)]
+    # 페이지 수가 적으면 하나의 작업으로 처리
+    assert split_page_ranges(5, 10) == [(0, 5)]
+    assert split_page_ranges(0, 10) == []
+
+
+def test_iter_text_pages_keeps_hwp_page_heuristics():
+    """줄 단위 스트리밍 페이지 분할이 기존 HWP 페이지 분할 규칙과 같은지 테스트"""
+    from rag.file_load import iter_text_pages
+
+    # 빈 줄이 2개 이상 연속되면 페이지 구분
+    lines = ["첫 페이지\n", "계속\n", "\n", "\n", "두 번째 페이지\n"]
+    assert list(iter_text_pages(lines)) == ["첫 페이지\n계속", "두 번째 페이지"]
+
+    # 페이지가 하나뿐이면 1000자 단위로 분할
+    assert list(iter_text_pages(["가" * 2500])) == ["가" * 1000, "가" * 1000, "가" * 500]
+
+
+def test_pyhwp_pages_stream_through_bounded_queue(monkeypatch):
+    """pyhwp 추출 결과를 임시 파일 없이 크기가 정해진 큐로 블록 단위로 받아 페이지로 나누는지 테스트"""
+    import asyncio
+    import rag.file_load as file_load
+
+    text = "첫 페이지\n\n\n두 번째\x01 페이지\n".encode("utf-8")
+
+    def write_hwp_text(content, output):
+        # 여러 바이트 문자가 블록 경계에서 잘려도 이어서 디코딩되어야 한다.
+        for i in range(0, len(text), 5):
+            output.write(text[i:i + 5])
+
+    monkeypatch.setattr("config.settings.PARSER_POOL_SIZE", 0)
+    monkeypatch.setattr(file_load, "HWP_STREAM_BLOCK_SIZE", 4)
+    monkeypatch.setattr(file_load, "HWP_STREAM_QUEUE_SIZE", 1)
+    monkeypatch.setattr(file_load, "use_in_process_hwp_extractor", lambda extension: True)
+    monkeypatch.setattr(file_load, "write_hwp_text", write_hwp_text)
+
+    pages = asyncio.run(file_load.collect_pages(file_load.iter_hwp_pages(b"hwp")))
+    assert pages == ["첫 페이지", "두 번째 페이지"]
+
+    # 추출 오류는 페이지를 받는 쪽으로 전달된다.
+    monkeypatch.setattr(file_load, "write_hwp_text", lambda content, output: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        asyncio.run(file_load.collect_pages(file_load.iter_hwp_pages(b"hwp")))
+
+
+def test_iter_hwpx_sections_reads_sections_in_spine_order():
+    """HWPX 섹션을 content.hpf 순서대로, 표 안의 문단까지 읽는지 테스트"""
+    import io
+    import zipfile
+    from rag.file_load import iter_hwpx_sections
+
+    hp = 'xmlns:hp="http://www.hancom.co.kr/hwpml/2011/paragraph"'
+    content_hpf = (
+        '<opf:package xmlns:opf="http://www.idpf.org/2007/opf/">'
+        '<opf:manifest>'
+        '<opf:item id="section0" href="Contents/section0.xml"/>'
+        '<opf:item id="section1" href="Contents/section1.xml"/>'
+        '</opf:manifest>'
+        '<opf:spine><opf:itemref idref="section1"/><opf:itemref idref="section0"/></opf:spine>'
+        '</opf:package>'
+    )
+    section0 = f'<hs:sec xmlns:hs="http://www.hancom.co.kr/hwpml/2011/section" {hp}><hp:p><hp:run><hp:t>둘째 섹션</hp:t></hp:run></hp:p></hs:sec>'
+    section1 = (
+        f'<hs:sec xmlns:hs="http://www.hancom.co.kr/hwpml/2011/section" {hp}>'
+        '<hp:p><hp:run><hp:t>첫 문단<hp:tab/>탭</hp:t></hp:run></hp:p>'
+        '<hp:p><hp:run><hp:tbl><hp:tc><hp:subList><hp:p><hp:run><hp:t>표 안</hp:t></hp:run></hp:p></hp:subList></hp:tc></hp:tbl></hp:run></hp:p>'
+        '</hs:sec>'
+    )
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as hwpx_zip:
+        hwpx_zip.writestr('mimetype', 'application/hwp+zip')
+        hwpx_zip.writestr('Contents/content.hpf', content_hpf)
+        hwpx_zip.writestr('Contents/section0.xml', section0)
+        hwpx_zip.writestr('Contents/section1.xml', section1)
+
+    assert list(iter_hwpx_sections(buffer.getvalue())) == ["첫 문단\t탭\n표 안", "둘째 섹션"]
+
+
+def test_replace_mode_embeds_only_changed_chunks():
+    """문서 교체 시 바뀐 청크만 임베딩하고 없어진 청크는 삭제하는지 테스트"""
+    import asyncio
+    from langchain_core.documents import Document as LCDocument
+    from rag import vectorstore
+    from rag.embedding_cache import hash_text
+
+    class FakeEmbeddings:
+        def __init__(self):
+            self.texts = []
+
+        async def aembed_documents(self, texts):
+            self.texts.extend(texts)
+            return [[0.0, 1.0] for _ in texts]
+
+    fake_embeddings = FakeEmbeddings()
+    existing = [(1, hash_text("같음")), (2, hash_text("삭제됨")), (3, hash_text("같음"))]
+    chunks = [LCDocument(page_content=text) for text in ["같음", "새 내용", "같음"]]
+    db = MagicMock()
+
+    with patch('rag.vectorstore.get_cached_embeddings', return_value=fake_embeddings), \
+         patch('db.crud.get_document_chunk_hashes', return_value=existing), \
+         patch('db.crud.add_document_chunks') as mock_add_chunks, \
+         patch('db.crud.delete_document_chunks_by_ids') as mock_delete_chunks:
+        asyncio.run(vectorstore.save_to_vector_store(db, chunks, "a.pdf", "/a.pdf", document_id=7, replace=True))
+
+    assert fake_embeddings.texts == ["새 내용"]
+    assert mock_add_chunks.call_args.kwargs["commit"] is False
+    assert mock_delete_chunks.call_args.args[1] == [2]
+    db.commit.assert_called_once()
+
+
+def test_duplicate_upload_reuses_blob():
+    """같은 내용의 파일은 s3에 다시 업로드하지 않고 내용 해시 기반 s3_key를 공유하는지 테스트"""
+    import io
+    import asyncio
+    import hashlib
+    from fast_api.endpoints import documents
+
+    content = b"%PDF-1.4 same regulations"
+    upload_file = io.BytesIO(content)
+
+    content_sha256, size = documents.hash_upload_file(upload_file)
+    assert content_sha256 == hashlib.sha256(content).hexdigest()
+    assert size == len(content)
+    assert upload_file.tell() == 0
+
+    with patch('db.crud.add_blob_reference', return_value=(2, True)) as mock_add_reference, \
+         patch('fast_api.endpoints.documents.upload_file_to_s3') as mock_upload:
+        result, s3_key = asyncio.run(documents.store_upload_blob(
+            MagicMock(), upload_file, "a.pdf", "/a.pdf", content_sha256, size
+        ))
+
+    assert s3_key == f"blobs/{content_sha256}"
+    assert result["deduplicated"] is True
+    mock_upload.assert_not_called()
+    assert mock_add_reference.call_args.args[1:] == (content_sha256, s3_key, size)
+
+    # 다른 업로드가 참조만 늘리고 아직 s3에 올리지 못한 blob은 직접 업로드하고 업로드 완료를 기록한다.
+    with patch('db.crud.add_blob_reference', return_value=(2, False)), \
+         patch('db.crud.mark_blob_uploaded') as mock_mark, \
+         patch('fast_api.endpoints.documents.upload_file_to_s3', return_value={"status": "success"}) as mock_upload:
+        result, _ = asyncio.run(documents.store_upload_blob(
+            MagicMock(), upload_file, "a.pdf", "/a.pdf", content_sha256, size
+        ))
+
+    assert "deduplicated" not in result
+    mock_upload.assert_called_once()
+    assert mock_mark.call_args.args[1] == content_sha256
+
+
+def test_failed_upload_registration_releases_blob_reference():
+    """업로드 후 문서 등록 도중 실패하면 문서 레코드를 삭제하고 늘린 blob 참조를 놓는지 테스트"""
+    import asyncio
+    from unittest.mock import AsyncMock
+    from fast_api.endpoints import documents
+
+    upload_file = MagicMock(filename="a.pdf")
+    with patch.object(documents, 'set_filename', return_value="a.pdf"), \
+         patch.object(documents, 'set_file_path', return_value=("/a.pdf", "/")), \
+         patch('db.crud.get_directory_id_by_path', return_value="root"), \
+         patch.object(documents, 'hash_upload_file', return_value=("abc", 3)), \
+         patch.object(documents, 'store_upload_blob', new=AsyncMock(return_value=({"status": "success"}, "blobs/abc"))), \
+         patch.object(documents, 'register_document', return_value=MagicMock(id=7)), \
+         patch.object(documents, 'store_directory_table', side_effect=RuntimeError("directory insert failed")), \
+         patch('db.crud.delete_document_by_id') as mock_delete, \
+         patch.object(documents, 'release_document_blob') as mock_release:
+        results = asyncio.run(documents.process_file_uploads([upload_file], "/", mock_user, MagicMock()))
+
+    assert results == [{"status": "success"}]
+    mock_delete.assert_called_once_with(ANY, 7)
+    mock_release.assert_called_once_with(ANY, "abc", "blobs/abc")
+
+
+def test_hashing_embeddings_are_deterministic():
+    """테스트용 해시 임베딩이 결정적이고 정규화되어 있으며 비슷한 텍스트가 더 가까운지 테스트"""
+    import numpy as np
+    from rag.embeddings import HashingEmbeddings
+
+    embeddings = HashingEmbeddings(64)
+    first, same, similar, different = embeddings.embed_documents(
+        ["행정 규정 제1조", "행정 규정 제1조", "행정 규정 제2조", "완전히 다른 문장입니다"]
+    )
+
+    assert len(first) == 64
+    assert first == same
+    assert np.isclose(np.linalg.norm(first), 1.0)
+    assert np.dot(first, similar) > np.dot(first, different)
+    assert embeddings.embed_query("행정 규정 제1조") == first
+
+
+def test_halfvec_storage_shortlists_then_rescores(monkeypatch):
+    """halfvec 저장 방식에서 반정밀도 컬럼으로 후보를 뽑고 float32 임베딩으로 다시 정렬하는지 테스트"""
+    import config.settings as settings
+    from db.crud import get_embedding_columns
+    from rag.retriever import build_similarity_query
+
+    monkeypatch.setattr(settings, "EMBEDDING_STORAGE", "halfvec")
+    monkeypatch.setattr(settings, "EMBEDDING_KEEP_FULL_PRECISION", True)
+    monkeypatch.setattr(settings, "EMBEDDING_RESCORE_FACTOR", 4)
+
+    assert get_embedding_columns([0.5, 0.5]) == {"embedding": [0.5, 0.5], "embedding_half": [0.5, 0.5]}
+    query, params = build_similarity_query([0.5, 0.5], 20)
+    assert (params["top_n"], params["shortlist_size"]) == (20, 80)
+    assert "ORDER BY embedding_half <=>" in str(query)
+    assert "embedding <=> CAST((SELECT query_vector FROM query) AS vector)" in str(query)
+
+    monkeypatch.setattr(settings, "EMBEDDING_KEEP_FULL_PRECISION", False)
+    assert get_embedding_columns([0.5, 0.5]) == {"embedding": None, "embedding_half": [0.5, 0.5]}
+    query, params = build_similarity_query([0.5, 0.5], 20)
+    assert "shortlist_size" not in params
+    assert "ORDER BY \n                embedding_half <=>" in str(query)
+
+
+def test_binary_shortlist_query_uses_requested_size(monkeypatch):
+    """이진 양자화 후보 검색에서 질의마다 지정한 후보 수로 해밍 거리 검색 후 전체 임베딩으로 재정렬하는지 테스트"""
+    import config.settings as settings
+    from rag.retriever import build_similarity_query
+
+    monkeypatch.setattr(settings, "EMBEDDING_STORAGE", "full")
+    monkeypatch.setattr(settings, "SEARCH_SHORTLIST", "binary")
+
+    query, params = build_similarity_query([0.5, 0.5], 20, shortlist_size=300)
+    assert (params["top_n"], params["shortlist_size"]) == (20, 300)
+    assert "binary_quantize(embedding)" in str(query)
+    assert "<~>" in str(query)
+    assert "1 - (embedding <=> CAST((SELECT query_vector FROM query) AS vector))" in str(query)
+
+    # 후보 수는 최종 검색 수보다 작을 수 없다.
+    _, params = build_similarity_query([0.5, 0.5], 20, shortlist_size=5)
+    assert params["shortlist_size"] == 20
+
+
+def test_vector_extension_is_updated_and_version_checked(monkeypatch):
+    """기존 DB의 pgvector를 먼저 업데이트하고, 설정에 필요한 버전보다 낮으면 시작하지 않는지 테스트 (성능 설정은 경고 후 끔)"""
+    import config.settings as settings
+    from db.migrations import ensure_vector_extension
+
+    def make_connection(before, after):
+        connection = MagicMock()
+        connection.execute.return_value.scalar.side_effect = [before, after]
+        return connection
+
+    monkeypatch.setattr("config.settings.VECTOR_INDEX_ITERATIVE_SCAN", "relaxed_order")
+    monkeypatch.setattr("config.settings.EMBEDDING_STORAGE", "full")
+    monkeypatch.setattr("config.settings.SEARCH_SHORTLIST", "none")
+    connection = make_connection("0.5.1", "0.8.0")
+    assert ensure_vector_extension(connection) is True
+    assert "ALTER EXTENSION vector UPDATE" in str(connection.execute.call_args_list[1].args[0])
+    assert settings.VECTOR_INDEX_ITERATIVE_SCAN == "relaxed_order"
+    # 반복 인덱스 검색은 성능 설정이므로 pgvector 0.8 미만이면 시작을 막지 않고 끈다.
+    assert ensure_vector_extension(make_connection("0.5.1", "0.5.1")) is False
+    assert settings.VECTOR_INDEX_ITERATIVE_SCAN == "off"
+
+    monkeypatch.setattr("config.settings.VECTOR_INDEX_ITERATIVE_SCAN", "off")
+    monkeypatch.setattr("config.settings.EMBEDDING_STORAGE", "halfvec")
+    assert ensure_vector_extension(make_connection("0.7.4", "0.7.4")) is False
+    with pytest.raises(RuntimeError, match="halfvec"):
+        ensure_vector_extension(make_connection("0.6.2", "0.6.2"))
+
+
+def test_vector_index_matches_search_settings(monkeypatch):
+    """벡터 인덱스 정의와 검색 쿼리가 같은 컬럼, 거리 함수, 인덱스 파라미터를 사용하는지 테스트"""
+    import config.settings as settings
+    from db.migrations import get_vector_index_definitions
+    from rag.retriever import build_similarity_query
+
+    monkeypatch.setattr(settings, "EMBEDDING_STORAGE", "full")
+    monkeypatch.setattr(settings, "SEARCH_SHORTLIST", "auto")
+    monkeypatch.setattr(settings, "VECTOR_INDEX_TYPE", "hnsw")
+    monkeypatch.setattr(settings, "VECTOR_INDEX_M", 24)
+    monkeypatch.setattr(settings, "VECTOR_INDEX_EF_CONSTRUCTION", 128)
+    monkeypatch.setattr(settings, "VECTOR_DISTANCE", "inner_product")
+
+    definitions = get_vector_index_definitions()
+    assert definitions == {
+        "ix_document_chunks_ann_embedding_ip_hnsw_m24_ef128":
+            "document_chunks USING hnsw (embedding vector_ip_ops) WITH (m = 24, ef_construction = 128)"
+    }
+    query, _ = build_similarity_query([0.5, 0.5], 20)
+    assert "(embedding <#> CAST((SELECT query_vector FROM query) AS vector)) * -1 AS similarity" in str(query)
+
+    monkeypatch.setattr(settings, "VECTOR_INDEX_TYPE", "none")
+    assert get_vector_index_definitions() == {}
+
+
+def test_similarity_query_binds_query_vector_once(monkeypatch):
+    """질의 벡터를 쿼리 문자열에 넣지 않고 float32 배열 파라미터로 한 번만 전달하는지 테스트"""
+    import numpy as np
+    import config.settings as settings
+    from rag.retriever import build_similarity_query
+
+    monkeypatch.setattr(settings, "EMBEDDING_STORAGE", "full")
+    monkeypatch.setattr(settings, "SEARCH_SHORTLIST", "binary")
+
+    first_query, params = build_similarity_query([0.25, 0.5], 20)
+    second_query, _ = build_similarity_query([0.75, 0.125], 20)
+
+    # 질의마다 쿼리 문자열이 같아야 prepare된 쿼리를 재사용할 수 있다.
+    assert str(first_query) == str(second_query)
+    assert str(first_query).count(":query_embedding") == 1
+    assert "0.25" not in str(first_query)
+    assert params["query_embedding"].dtype == np.float32
+    assert params["query_embedding"].tolist() == [0.25, 0.5]
+
+
+def test_decode_vectors_and_mmr_fetch_only_selected_chunks():
+    """binary 임베딩을 float32 행렬로 변환하고 MMR로 고른 청크의 내용만 가져오는지 테스트"""
+    import numpy as np
+    from pgvector.utils import Vector, HalfVector
+    import asyncio
+    from rag.retriever import decode_vectors, ado_mmr
+
+    rows = [[1.0, 0.0, 0.5], [0.25, -2.0, 3.0]]
+    for vector_type in (Vector, HalfVector):
+        matrix = decode_vectors([vector_type._to_db_binary(row) for row in rows])
+        assert matrix.dtype == np.float32 and matrix.flags["C_CONTIGUOUS"]
+        assert matrix.tolist() == rows
+
+    candidates = {
+        "ids": [10, 11, 12, 13],
+        "similarities": np.array([0.9, 0.89, 0.5, 0.1], dtype=np.float32),
+        # 11은 10과 거의 같은 내용이므로 유사도가 높아도 선택되지 않아야 한다.
+        "embeddings": np.array([[1, 0], [1, 0.01], [0, 1], [-1, 0]], dtype=np.float32),
+    }
+    with patch("rag.retriever.aload_chunk_documents", side_effect=lambda engine, ids: ids) as mock_load:
+        assert asyncio.run(ado_mmr(candidates, engine=None)) == [10, 12, 13]
+    mock_load.assert_awaited_once()
+
+
+def test_select_mmr_matches_loop_implementation():
+    """행렬 연산 MMR이 이중 루프 MMR과 같은 순서로 문서를 고르는지 테스트"""
+    import numpy as np
+    from rag.retriever import select_mmr
+
+    def loop_mmr(similarities, embeddings, k, lambda_mult):
+        # 기준 구현: 후보와 선택된 문서 쌍마다 코사인 유사도를 계산하는 이중 루프 MMR
+        remaining = sorted(range(len(similarities)), key=lambda i: similarities[i], reverse=True)
+        selected = []
+        while len(selected) < k and remaining:
+            mmr_scores = {}
+            for i in remaining:
+                max_sim_with_selected = 0
+                for j in selected:
+                    sim = np.dot(embeddings[i], embeddings[j]) / (np.linalg.norm(embeddings[i]) * np.linalg.norm(embeddings[j]))
+                    max_sim_with_selected = max(max_sim_with_selected, sim)
+                mmr_scores[i] = lambda_mult * similarities[i] - (1 - lambda_mult) * max_sim_with_selected
+            selected_idx = max(mmr_scores, key=mmr_scores.get)
+            selected.append(selected_idx)
+            remaining.remove(selected_idx)
+        return selected
+
+    # 질의와 비슷한 정도가 다른 무작위 후보 (유사도 내림차순)
+    rng = np.random.default_rng(1)
+    query = rng.standard_normal(32).astype(np.float32)
+    embeddings = (rng.standard_normal((60, 32)) + query * rng.uniform(0, 2, (60, 1))).astype(np.float32)
+    similarities = embeddings @ query / (np.linalg.norm(embeddings, axis=1) * np.linalg.norm(query))
+    order = np.argsort(-similarities)
+    similarities, embeddings = similarities[order].astype(np.float32), np.ascontiguousarray(embeddings[order])
+    for k, lambda_mult in [(3, 0.5), (10, 0.3), (10, 0.9), (60, 0.5)]:
+        assert select_mmr(similarities, embeddings, k, lambda_mult) == loop_mmr(similarities, embeddings, k, lambda_mult)
+    assert select_mmr(similarities[:0], embeddings[:0], 3, 0.5) == []
+
+
+def test_query_embedding_cache_reuses_client_and_expires(monkeypatch):
+    """같은(정규화 후) 질의는 임베딩 클라이언트를 다시 호출하지 않고, TTL과 최대 크기를 지키는지 테스트"""
+    import asyncio
+    import config.settings as settings
+    import rag.embedding_cache as embedding_cache
+    from rag.embeddings import aembed_query, get_embeddings
+
+    monkeypatch.setattr(settings, "EMBEDDING_PROVIDER", "hashing")
+    monkeypatch.setattr(settings, "QUERY_EMBEDDING_CACHE_SIZE", 2)
+    monkeypatch.setattr(settings, "QUERY_EMBEDDING_CACHE_TTL", 60)
+    embedding_cache.clear_query_embedding_cache()
+
+    client = get_embeddings()
+    assert get_embeddings() is client
+
+    def embed_query(query):
+        return asyncio.run(aembed_query(query))
+
+    now = [1000.0]
+    monkeypatch.setattr(embedding_cache.time, "monotonic", lambda: now[0])
+    with patch.object(client, "embed_query", wraps=client.embed_query) as mock_embed:
+        first = embed_query("휴가 규정은?")
+        assert embed_query("  휴가   규정은? ") == first
+        assert mock_embed.call_count == 1
+
+        # 최대 크기를 넘으면 가장 오래 사용되지 않은 질의부터 제거된다.
+        embed_query("출장 규정은?")
+        embed_query("휴가 규정은?")
+        embed_query("급여 규정은?")
+        embed_query("출장 규정은?")
+        assert mock_embed.call_count == 4
+
+        now[0] += 61
+        embed_query("휴가 규정은?")
+        assert mock_embed.call_count == 5
+
+    stats = embedding_cache.get_query_embedding_cache_stats()
+    assert (stats["hits"], stats["misses"], stats["size"]) == (2, 5, 2)
+
+    # 차원이 바뀌면 같은 질의도 캐시된 벡터를 쓰지 않고 다시 임베딩한다.
+    monkeypatch.setattr(settings, "EMBEDDING_DIMENSION", settings.EMBEDDING_DIMENSION + 1)
+    assert len(embed_query("휴가 규정은?")) == settings.EMBEDDING_DIMENSION
+    embedding_cache.clear_query_embedding_cache()
+
+
+def test_query_returns_cached_answer_and_manage_bumps_corpus_version():
+    """같은 문서 집합 버전의 비슷한 질의는 캐시된 답변을 반환하고, /manage 작업은 버전을 올리는지 테스트"""
+    cached = {"answer": "연차는 15일입니다.", "sources": [{"document_name": "a.pdf", "document_path": "/a.pdf"}], "similarity": 0.99}
+    with patch('db.database.get_async_engine'), \
+         patch('db.crud.aget_corpus_version', return_value=7), \
+         patch('rag.embeddings.aembed_query', return_value=[0.1, 0.2]), \
+         patch('rag.answer_cache.lookup_cached_answer', return_value=cached) as mock_lookup, \
+         patch('fast_api.endpoints.documents.aprocess_query') as mock_process:
+        response = client.post(
+            "/fast_api/documents/query",
+            data={"query": "연차는 며칠인가요?", "k": "3"},
+            headers={"Authorization": "Bearer fake_token"}
+        )
+
+    assert response.status_code == 200, f"응답 내용: {response.text}"
+    assert response.json() == {"answer": cached["answer"], "sources": cached["sources"], "cached": True}
+    assert mock_lookup.call_args.args[1:3] == (mock_user.id, 7)
+    mock_process.assert_not_called()
+
+    # LLM 호출이 실패한 답변은 캐시하지 않는다. (단일 질의와 배치 질의 모두)
+    with patch('db.database.get_async_engine'), \
+         patch('db.crud.aget_corpus_version', return_value=7), \
+         patch('rag.embeddings.aembed_query', return_value=[0.1, 0.2]), \
+         patch('rag.embeddings.aembed_queries', return_value=[[0.1, 0.2]]), \
+         patch('rag.answer_cache.lookup_cached_answer', return_value=None), \
+         patch('rag.answer_cache.store_cached_answer') as mock_store, \
+         patch('fast_api.endpoints.documents.aget_llms_answer', return_value=("죄송합니다.", False)), \
+         patch('fast_api.endpoints.documents.aprocess_query', return_value=[]), \
+         patch('fast_api.endpoints.documents.aprocess_query_batch', return_value=[[]]):
+        response = client.post(
+            "/fast_api/documents/query",
+            data={"query": "연차는 며칠인가요?"},
+            headers={"Authorization": "Bearer fake_token"}
+        )
+        batch_response = client.post(
+            "/fast_api/documents/query/batch",
+            data={"queries": ["연차는 며칠인가요?"]},
+            headers={"Authorization": "Bearer fake_token"}
+        )
+
+    assert response.status_code == 200, f"응답 내용: {response.text}"
+    assert batch_response.status_code == 200, f"응답 내용: {batch_response.text}"
+    assert response.json()["cached"] is False
+    mock_store.assert_not_called()
+
+    # 작업이 끝난 뒤에만 버전을 올리고, 실패한 작업만 있으면 올리지 않는다.
+    with patch('db.crud.bump_corpus_version') as mock_bump, \
+         patch('db.crud.get_file_is_directory_by_id', side_effect=Exception("not found")):
+        response = client.post(
+            "/fast_api/documents/manage",
+            data={"operations": '[{"operation_type": "delete", "item_id": "1"}]'},
+            headers={"Authorization": "Bearer fake_token"}
+        )
+    assert response.status_code == 200, f"응답 내용: {response.text}"
+    assert response.json()["items"][0]["status"] == "error"
+    mock_bump.assert_not_called()
+
+    # 빈 폴더 생성은 검색 결과를 바꾸지 않으므로 버전을 올리지 않는다.
+    with patch('db.crud.bump_corpus_version') as mock_bump:
+        response = client.post(
+            "/fast_api/documents/manage",
+            data={"operations": '[{"operation_type": "create", "name": "새 폴더", "path": "/"}]'},
+            headers={"Authorization": "Bearer fake_token"}
+        )
+
+    assert response.status_code == 200, f"응답 내용: {response.text}"
+    mock_bump.assert_not_called()
+
+    with patch('db.crud.bump_corpus_version') as mock_bump, \
+         patch('db.crud.get_file_is_directory_by_id', return_value=True), \
+         patch('db.crud.get_file_name_by_id', return_value="새 폴더"), \
+         patch('db.crud.get_file_path_by_id', return_value="/새 폴더"), \
+         patch('db.crud.get_parent_id_by_id', return_value="root"), \
+         patch('db.crud.get_directory_id_by_path', return_value="dest"), \
+         patch('db.crud.get_directory_by_parent_id', return_value=[]), \
+         patch('db.crud.update_directory_path_and_parent'):
+        response = client.post(
+            "/fast_api/documents/manage",
+            data={"operations": '[{"operation_type": "create", "name": "새 폴더2", "path": "/"}, {"operation_type": "move", "item_id": "1", "target_path": "/인사"}]'},
+            headers={"Authorization": "Bearer fake_token"}
+        )
+
+    assert response.status_code == 200, f"응답 내용: {response.text}"
+    assert mock_bump.call_count == 1
+    assert mock_bump.call_args.args[1] == mock_user.id
+
+
+def test_answer_cache_requires_same_normalized_question(monkeypatch):
+    """조항 번호만 다른 질문은 임베딩 유사도가 높아도 캐시된 답변을 반환하지 않는지 테스트"""
+    import asyncio
+    from unittest.mock import AsyncMock
+    from rag.answer_cache import lookup_cached_answer
+
+    monkeypatch.setattr("config.settings.ANSWER_CACHE_ENABLED", True)
+    monkeypatch.setattr("config.settings.ANSWER_CACHE_EXACT_MATCH", True)
+    row = MagicMock(query="제3조의 내용은?", answer="제3조 답변", sources=[], similarity=0.98)
+    connection = MagicMock()
+    connection.execute = AsyncMock(return_value=MagicMock(first=MagicMock(return_value=row)))
+    engine = MagicMock()
+    engine.connect.return_value.__aenter__ = AsyncMock(return_value=connection)
+    engine.connect.return_value.__aexit__ = AsyncMock(return_value=False)
+
+    def lookup(query):
+        return asyncio.run(lookup_cached_answer(engine, 1, 0, query, [0.1, 0.2], "{}"))
+
+    assert lookup("제5조의 내용은?") is None
+    assert lookup("  제3조의   내용은? ")["answer"] == "제3조 답변"
+    monkeypatch.setattr("config.settings.ANSWER_CACHE_EXACT_MATCH", False)
+    assert lookup("제5조의 내용은?")["answer"] == "제3조 답변"
+
+
+def test_similarity_search_is_scoped_by_owner_and_folder(monkeypatch):
+    """사용자/폴더 범위 조건이 벡터 인덱스 검색 단계에 들어가고, 범위 검색에서 반복 인덱스 검색을 켜는지 테스트"""
+    import config.settings as settings
+    from rag.retriever import build_similarity_query, execute_similarity_query, get_path_pattern
+
+    monkeypatch.setattr(settings, "EMBEDDING_STORAGE", "full")
+    monkeypatch.setattr(settings, "SEARCH_SHORTLIST", "binary")
+    monkeypatch.setattr(settings, "VECTOR_INDEX_ITERATIVE_SCAN", "relaxed_order")
+
+    assert get_path_pattern("/") is None
+    assert get_path_pattern("/인사_규정/") == "/인사\\_규정/%"
+
+    query, params = build_similarity_query([0.5, 0.5], 20, owner_id=3, path_prefix="/인사")
+    assert (params["owner_id"], params["path_pattern"]) == (3, "/인사/%")
+    # 범위 조건은 후보를 다시 정렬한 뒤가 아니라 인덱스로 후보를 찾는 단계에서 적용된다.
+    shortlist = str(query).split("shortlist AS (")[1].split(")\n")[0]
+    assert "AND owner_id = :owner_id" in shortlist
+    assert "AND document_path LIKE :path_pattern" in shortlist
+
+    connection = MagicMock()
+    execute_similarity_query(connection, query, params)
+    applied = connection.execute.call_args_list[0].args[1]
+    assert "hnsw.iterative_scan" in applied.values()
+    assert "relaxed_order" in applied.values()
+
+    # 범위 조건이 없으면 반복 검색 설정을 바꾸지 않는다.
+    query, params = build_similarity_query([0.5, 0.5], 20)
+    assert "owner_id" not in str(query)
+    connection = MagicMock()
+    execute_similarity_query(connection, query, params)
+    assert "hnsw.iterative_scan" not in connection.execute.call_args_list[0].args[1].values()
+
+    with patch('db.database.get_async_engine'), \
+         patch('db.crud.aget_corpus_version', return_value=0), \
+         patch('rag.embeddings.aembed_query', return_value=[0.1, 0.2]), \
+         patch('rag.answer_cache.lookup_cached_answer', return_value=None), \
+         patch('rag.answer_cache.store_cached_answer'), \
+         patch('fast_api.endpoints.documents.aget_llms_answer', return_value=("답변", True)), \
+         patch('fast_api.endpoints.documents.aprocess_query', return_value=[]) as mock_process:
+        response = client.post(
+            "/fast_api/documents/query",
+            data={"query": "출장비 규정은?", "path": "/인사"},
+            headers={"Authorization": "Bearer fake_token"}
+        )
+
+    assert response.status_code == 200, f"응답 내용: {response.text}"
+    assert mock_process.call_args.kwargs == {"owner_id": mock_user.id, "path_prefix": "/인사", "rerank": None}
+
+
+def test_hybrid_search_fuses_ngram_and_vector_candidates(monkeypatch):
+    """한국어 질의가 조사와 관계없이 n-gram으로 일치하고, 하이브리드 검색이 한 쿼리에서 RRF로 후보를 합치는지 테스트"""
+    import config.settings as settings
+    from pgvector.utils import Vector
+    from db.crud import add_document_chunks
+    from rag.lexical import extract_lexemes, to_tsquery_text
+    import asyncio
+    from rag.retriever import build_similarity_query, asearch_similarity
+
+    # "연차는"과 "연차를"은 n-gram "연차"로 일치하고, 조항 번호는 토큰 전체로도 일치한다.
+    assert set(extract_lexemes("연차는")) & set(extract_lexemes("직원은 연차를 사용한다")) == {"연차"}
+    assert "제3조" in extract_lexemes("제3조(연차휴가)")
+    assert to_tsquery_text("  ?! ") is None
+
+    db = MagicMock()
+    chunks = add_document_chunks(db, 1, "a.pdf", "/a.pdf", ["제3조 연차"], ["hash"], [[0.5, 0.5]], owner_id=2)
+    assert chunks[0].content_tsv == "'3조' '연차' '제3' '제3조'"
+    assert chunks[0].owner_id == 2
+
+    monkeypatch.setattr(settings, "EMBEDDING_STORAGE", "full")
+    monkeypatch.setattr(settings, "SEARCH_SHORTLIST", "none")
+    monkeypatch.setattr(settings, "SEARCH_RRF_K", 60)
+    query, params = build_similarity_query([0.5, 0.5], 20, owner_id=2, lexical_query=to_tsquery_text("연차는"))
+    assert params["lexical_query"] == "('연차는' | '연차')"
+    assert params["rrf_k"] == 60
+    # 질문의 토큰 중 하나만 일치해도 후보가 되고, 일치한 청크는 순위 상위 top_n개만 남긴다. (동점은 id 순서)
+    question = to_tsquery_text("연차휴가는 며칠인가요?")
+    assert question == "('연차휴가는' | '연차' & '차휴' & '휴가') | ('며칠인가요' | '며칠' & '칠인' & '인가')"
+    # "며칠인가요"는 문서에 없어도 "연차휴가는"의 n-gram이 모두 있는 청크와 일치한다.
+    chunk_lexemes = set(extract_lexemes("직원은 연차휴가를 매년 15일 사용할 수 있다."))
+    assert {"연차", "차휴", "휴가"} <= chunk_lexemes
+    assert not {"며칠", "칠인", "인가"} <= chunk_lexemes
+    assert "ORDER BY lexical_rank DESC, id" in str(query)
+    assert "content_tsv @@ lexical.lexical_query" in str(query)
+    assert str(query).count("AND owner_id = :owner_id") == 2
+    assert "sum(1.0 / (:rrf_k + rank))" in str(query)
+
+    # 하이브리드 검색 결과는 RRF 점수 순서이고, MMR에 넘기는 관련성은 벡터 검색과 같은 코사인 유사도이다.
+    monkeypatch.setattr(settings, "SEARCH_HYBRID", True)
+    rows = [
+        MagicMock(id=5, score=2 / 61, similarity=0.4, embedding=Vector._to_db_binary([1.0, 0.0])),
+        MagicMock(id=6, score=1 / 61, similarity=0.9, embedding=Vector._to_db_binary([0.0, 1.0])),
+    ]
+    engine = MagicMock()
+    with patch("rag.retriever.aexecute_similarity_query") as mock_execute:
+        mock_execute.return_value.fetchall.return_value = rows
+        candidates = asyncio.run(asearch_similarity([0.5, 0.5], engine, owner_id=2, query="연차는"))
+    assert "lexical_query" in mock_execute.call_args.args[2]
+    assert candidates["ids"] == [5, 6]
+    assert candidates["similarities"].tolist() == pytest.approx([0.4, 0.9])
+    assert candidates["embeddings"].tolist() == [[1.0, 0.0], [0.0, 1.0]]
+
+
+def test_rerank_reorders_candidates_and_falls_back_after_timeout():
+    """cross-encoder 점수로 후보를 재정렬하고 MMR이 내용을 다시 조회하지 않으며, 제한 시간을 넘으면 원래 순서를 쓰는지 테스트"""
+    import asyncio
+    import threading
+    import numpy as np
+    from langchain_core.documents import Document as LCDocument
+    from rag.reranker import arerank_candidates
+    from rag.retriever import ado_mmr
+
+    candidates = {
+        "ids": [1, 2, 3],
+        "similarities": np.array([0.9, 0.8, 0.7], dtype=np.float32),
+        "embeddings": np.array([[1, 0], [0, 1], [1, 1]], dtype=np.float32),
+    }
+    docs = [LCDocument(page_content=f"청크 {i}", metadata={"chunk_id": i}) for i in (1, 2, 3)]
+    relevance = {"청크 1": 0.1, "청크 2": 0.3, "청크 3": 0.95}
+
+    with patch("rag.retriever.aload_chunk_documents", return_value=docs), \
+         patch("rag.reranker.score_pairs", side_effect=lambda query, texts: np.array([relevance[t] for t in texts], dtype=np.float32)), \
+         patch("config.settings.RERANK_BATCH_SIZE", 2):
+        reranked = asyncio.run(arerank_candidates("질문", candidates, engine=None, timeout_ms=5000))
+    assert reranked["ids"] == [3, 2, 1]
+    assert reranked["similarities"].tolist() == pytest.approx([0.95, 0.3, 0.1])
+    assert reranked["embeddings"].tolist() == [[1, 1], [0, 1], [1, 0]]
+    with patch("rag.retriever.aload_chunk_documents") as mock_load:
+        assert [doc.metadata["chunk_id"] for doc in asyncio.run(ado_mmr(reranked, engine=None, k=1))] == [3]
+    mock_load.assert_not_called()
+
+    # 추론이 제한 시간 안에 끝나지 않으면 벡터 검색 순서를 그대로 사용한다.
+    release = threading.Event()
+
+    def slow_score(query, texts):
+        release.wait(5)
+        return np.zeros(len(texts), dtype=np.float32)
+
+    with patch("rag.retriever.aload_chunk_documents", return_value=docs), \
+         patch("rag.reranker.score_pairs", side_effect=slow_score):
+        fallback = asyncio.run(arerank_candidates("질문", candidates, engine=None, timeout_ms=50))
+    release.set()
+    assert fallback["ids"] == [1, 2, 3]
+    assert fallback["similarities"].tolist() == candidates["similarities"].tolist()
+    assert [doc.metadata["chunk_id"] for doc in fallback["documents"]] == [1, 2, 3]
+
+
+def test_async_query_path_serves_concurrent_questions():
+    """비동기 질의 처리가 DB/LLM 응답을 기다리는 동안 이벤트 루프를 막지 않아 여러 질의가 동시에 처리되는지 테스트"""
+    import asyncio
+    import time
+    import numpy as np
+    from langchain_core.documents import Document as LCDocument
+    from langchain_core.language_models import FakeListChatModel
+    from langchain_core.runnables import RunnableLambda
+    from rag.document_service import aprocess_query
+    from rag.llm import aget_llms_answer
+
+    candidates = {
+        "ids": [1, 2],
+        "similarities": np.array([0.9, 0.8], dtype=np.float32),
+        "embeddings": np.array([[1, 0], [0, 1]], dtype=np.float32),
+    }
+    docs = [LCDocument(page_content="연차는 15일", metadata={"chunk_id": 1, "document_name": "a.pdf"})]
+
+    async def slow_search(*args, **kwargs):
+        # DB 왕복 대신 이벤트 루프에 제어를 넘기며 기다린다.
+        await asyncio.sleep(0.2)
+        return candidates
+
+    async def run_queries(count):
+        return await asyncio.gather(*[
+            aprocess_query(f"질문 {i}", engine=None, k=1, query_embedding=[0.5, 0.5], owner_id=1, rerank=False)
+            for i in range(count)
+        ])
+
+    with patch("rag.document_service.asearch_similarity", side_effect=slow_search) as mock_search, \
+         patch("rag.retriever.aload_chunk_documents", return_value=docs) as mock_load:
+        start = time.perf_counter()
+        results = asyncio.run(run_queries(50))
+        elapsed = time.perf_counter() - start
+
+    # 순서대로 처리하면 10초가 걸린다.
+    assert elapsed < 2
+    assert results == [docs] * 50
+    assert mock_search.call_count == 50
+    assert mock_search.call_args.kwargs["owner_id"] == 1
+    assert mock_load.call_args.args[1] == [1]
+
+    with patch("rag.llm.get_llm", return_value=FakeListChatModel(responses=["15일입니다."])):
+        assert asyncio.run(aget_llms_answer(docs, "연차는 며칠인가요?")) == ("15일입니다.", True)
+
+    # LLM 호출이 실패하면 오류 안내 문구와 실패 표시를 반환한다.
+    def fail(prompt):
+        raise RuntimeError("rate limit")
+
+    with patch("rag.llm.get_llm", return_value=RunnableLambda(fail)):
+        answer, answered = asyncio.run(aget_llms_answer(docs, "연차는 며칠인가요?"))
+    assert answered is False
+    assert "오류" in answer
+
+
+def test_batch_query_embeds_once_and_searches_with_one_lateral_query(monkeypatch):
+    """배치 질의가 질문들을 한 번에 임베딩하고, 한 쿼리(unnest + LATERAL)로 질문별 후보를 가져오는지 테스트"""
+    import asyncio
+    from unittest.mock import AsyncMock
+    from pgvector.utils import Vector
+    import config.settings as settings
+    from rag.embeddings import aembed_queries
+    from rag.retriever import build_batch_similarity_query, asearch_similarity_batch
+
+    monkeypatch.setattr(settings, "EMBEDDING_STORAGE", "full")
+    query, params = build_batch_similarity_query([[0.5, 0.5], [1.0, 0.0]], 5, owner_id=1, path_prefix="/인사")
+    assert "unnest(CAST(:query_embeddings AS vector[])) WITH ORDINALITY" in str(query)
+    assert "CROSS JOIN LATERAL" in str(query)
+    assert "AND owner_id = :owner_id" in str(query)
+    assert len(params["query_embeddings"]) == 2
+    assert (params["top_n"], params["owner_id"], params["path_pattern"]) == (5, 1, "/인사/%")
+
+    # 캐시에 없는 질의만, 중복 없이 한 번의 호출로 임베딩한다.
+    embeddings_model = MagicMock()
+    embeddings_model.aembed_documents = AsyncMock(return_value=[[1.0, 0.0], [0.0, 1.0]])
+    with patch("rag.embeddings.get_embeddings", return_value=embeddings_model), \
+         patch("rag.embedding_cache.lookup_query_embedding", side_effect=lambda model, q: [0.5, 0.5] if q == "캐시" else None), \
+         patch("rag.embedding_cache.store_query_embedding"):
+        embeddings = asyncio.run(aembed_queries(["연차", "캐시", "출장", "연차"]))
+    embeddings_model.aembed_documents.assert_awaited_once_with(["연차", "출장"])
+    assert embeddings == [[1.0, 0.0], [0.5, 0.5], [0.0, 1.0], [1.0, 0.0]]
+
+    # 결과 행은 질의 순서별로 나뉜다. (후보가 없는 질의는 빈 후보)
+    rows = [
+        MagicMock(query_index=0, id=5, similarity=0.9, embedding=Vector._to_db_binary([1.0, 0.0])),
+        MagicMock(query_index=0, id=6, similarity=0.7, embedding=Vector._to_db_binary([0.0, 1.0])),
+        MagicMock(query_index=2, id=6, similarity=0.8, embedding=Vector._to_db_binary([0.0, 1.0])),
+    ]
+    with patch("rag.retriever.aexecute_similarity_query", return_value=MagicMock()) as mock_execute:
+        mock_execute.return_value.fetchall.return_value = rows
+        candidates = asyncio.run(asearch_similarity_batch([[1.0, 0.0], [0.5, 0.5], [0.0, 1.0]], MagicMock(), fetch_k=2))
+    mock_execute.assert_awaited_once()
+    assert [c["ids"] for c in candidates] == [[5, 6], [], [6]]
+    assert candidates[2]["embeddings"].tolist() == [[0.0, 1.0]]
+
+    # 엔드포인트: 답변 캐시에 없는 질문만 배치로 처리하고 결과는 질문 순서대로 반환한다.
+    cached = {"answer": "캐시된 답변", "sources": [], "similarity": 0.99}
+    with patch('db.database.get_async_engine'), \
+         patch('db.crud.aget_corpus_version', return_value=0), \
+         patch('rag.embeddings.aembed_queries', return_value=[[0.1, 0.2], [0.3, 0.4]]) as mock_embed, \
+         patch('rag.answer_cache.lookup_cached_answer', side_effect=[None, cached]), \
+         patch('rag.answer_cache.store_cached_answer'), \
+         patch('fast_api.endpoints.documents.aget_llms_answer', side_effect=lambda docs, q: (f"{q} 답변", True)), \
+         patch('fast_api.endpoints.documents.aprocess_query_batch', return_value=[[]]) as mock_batch:
+        response = client.post(
+            "/fast_api/documents/query/batch",
+            data={"queries": ["연차는?", "출장비는?"]},
+            headers={"Authorization": "Bearer fake_token"}
+        )
+
+    assert response.status_code == 200, f"응답 내용: {response.text}"
+    mock_embed.assert_awaited_once_with(["연차는?", "출장비는?"])
+    assert mock_batch.call_args.args[0] == ["연차는?"]
+    assert mock_batch.call_args.kwargs["query_embeddings"] == [[0.1, 0.2]]
+    assert [(r["answer"], r["cached"]) for r in response.json()["results"]] == [("연차는? 답변", False), ("캐시된 답변", True)]
+
+
+def test_local_index_syncs_incrementally_and_falls_back_to_pgvector(monkeypatch, tmp_path):
+    """로컬 인덱스가 스냅샷을 메모리 매핑해 검색하고, 바뀐 청크만 가져오며, 청크가 많으면 pgvector로 검색하는지 테스트"""
+    import asyncio
+    import numpy as np
+    import config.settings as settings
+    import rag.local_index as local_index
+    from rag.retriever import asearch_similarity
+
+    def search_similarity(*args, **kwargs):
+        return asyncio.run(asearch_similarity(*args, **kwargs))
+
+    monkeypatch.setattr(settings, "LOCAL_INDEX_ENABLED", True)
+    monkeypatch.setattr(settings, "LOCAL_INDEX_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "LOCAL_INDEX_MAX_CHUNKS", 3)
+    monkeypatch.setattr(settings, "LOCAL_INDEX_SYNC_INTERVAL", 0)
+    monkeypatch.setattr(settings, "EMBEDDING_STORAGE", "full")
+    monkeypatch.setattr(settings, "SEARCH_HYBRID", False)
+    monkeypatch.setattr(local_index, "_indexes", {})
+    monkeypatch.setattr(local_index, "_pending", {})
+
+    vectors = {1: [1.0, 0.0], 2: [0.0, 1.0], 3: [0.6, 0.8], 4: [0.8, 0.6]}
+    db_chunks = {"version": 1, "rows": [MagicMock(id=1, document_path="/인사/a.pdf"), MagicMock(id=2, document_path="/회계/b.pdf")]}
+    fetched = []
+
+    def fetch_chunk_embeddings(connection, chunk_ids, column, send_function):
+        fetched.append(list(chunk_ids))
+        return {chunk_id: np.array(vectors[chunk_id], dtype=np.float32) for chunk_id in chunk_ids}
+
+    monkeypatch.setattr(local_index, "fetch_corpus_version", lambda connection, owner_id: db_chunks["version"])
+    monkeypatch.setattr(local_index, "fetch_tenant_chunks", lambda connection, owner_id, column, limit: db_chunks["rows"][:limit])
+    monkeypatch.setattr(local_index, "fetch_chunk_embeddings", fetch_chunk_embeddings)
+
+    with patch("db.database.engine"), patch("rag.retriever.aexecute_similarity_query") as mock_execute:
+        candidates = search_similarity([1.0, 0.0], MagicMock(), fetch_k=2, owner_id=1)
+        assert candidates["ids"] == [1, 2]
+        assert candidates["similarities"].tolist() == pytest.approx([1.0, 0.0])
+        # 폴더 범위는 하위 폴더를 포함한 경로 접두사로 거른다.
+        assert search_similarity([1.0, 0.0], MagicMock(), fetch_k=2, owner_id=1, path_prefix="/회계")["ids"] == [2]
+        mock_execute.assert_not_called()
+
+        # 다른 프로세스는 스냅샷을 메모리 매핑하고, 버전이 바뀌면 추가된 청크의 임베딩만 가져온다.
+        monkeypatch.setattr(local_index, "_indexes", {})
+        db_chunks["version"] = 2
+        db_chunks["rows"] = [db_chunks["rows"][1], MagicMock(id=3, document_path="/인사/c.pdf")]
+        index = local_index.get_local_index(1)
+        assert fetched == [[1, 2], [3]]
+        assert isinstance(index["embeddings"], np.memmap)
+        assert index["ids"].tolist() == [2, 3]
+
+        # 이 프로세스에서 저장/삭제한 청크는 바로 반영되고, 임베딩을 다시 가져오지 않고 스냅샷에 저장된다.
+        db_chunks["rows"] = [db_chunks["rows"][1], MagicMock(id=4, document_path="/인사/d.pdf")]
+        # 추가한 청크는 모아 두었다가 다음 검색 때 행렬에 한 번에 합친다.
+        local_index.add_chunks(1, [4], "/인사/d.pdf", [vectors[4]])
+        assert local_index._indexes[1]["ids"].tolist() == [2, 3]
+        assert local_index._pending[1]["ids"] == [4]
+        local_index.remove_chunks(1, [2])
+        assert 1 not in local_index._pending
+        # 다른 프로세스가 방금 쓴(더 새로운) 데이터 파일은 삭제하지 않는다.
+        newer_file = tmp_path / "1" / "ids-99999999999999999999ffffffff.npy"
+        np.save(newer_file, np.array([], dtype=np.int64))
+        assert search_similarity([1.0, 0.0], MagicMock(), fetch_k=5, owner_id=1)["ids"] == [4, 3]
+        assert fetched == [[1, 2], [3]]
+        assert local_index.load_snapshot(1)["ids"].tolist() == [3, 4]
+        assert newer_file.exists()
+        assert len(list((tmp_path / "1").glob("*.npy"))) == 3
+
+        # 청크 수가 LOCAL_INDEX_MAX_CHUNKS를 넘으면 pgvector로 검색한다.
+        db_chunks["version"] = 3
+        db_chunks["rows"] = [MagicMock(id=i, document_path="/a.pdf") for i in range(1, 5)]
+        mock_execute.return_value.fetchall.return_value = []
+        assert local_index.get_local_index(1) is None
+        search_similarity([1.0, 0.0], MagicMock(), fetch_k=2, owner_id=1)
+        mock_execute.assert_called_once()
+
+
+def test_moving_folder_updates_only_chunks_in_moved_subtree():
+    """폴더를 이동하면 그 폴더 트리에 있는 파일의 청크 경로만 바뀌고, 경로가 같은 다른 사용자의 청크는 바뀌지 않는지 테스트"""
+    from db import crud
+
+    db = MagicMock()
+    crud.update_directory_with_sql_file_safe(db, "folder-a", "/문서", "/보관/문서", "parent-a")
+
+    chunk_updates = [call for call in db.execute.call_args_list if "UPDATE document_chunks" in str(call.args[0])]
+    assert len(chunk_updates) == 1
+    chunk_sql, params = str(chunk_updates[0].args[0]), chunk_updates[0].args[1]
+    # 사용자 B의 "/문서" 청크는 사용자 A의 폴더 트리(folder-a)에 속한 문서가 아니므로 조건에 걸리지 않는다.
+    assert "WITH RECURSIVE subtree" in chunk_sql and "WHERE id = :tgt_id" in chunk_sql
+    assert "WHERE document_id IN" in chunk_sql
+    assert params == {"tgt_id": "folder-a", "old_prefix": "/문서", "new_prefix": "/보관/문서"}
+    db.commit.assert_called_once()
+
+
+def test_deleting_document_chunks_updates_local_index():
+    """전체(full) 모드 재수집 전에 삭제한 청크가 로컬 벡터 인덱스에서도 제외되는지 테스트"""
+    from db import crud
+
+    db = MagicMock()
+    db.execute.return_value.fetchall.return_value = [MagicMock(id=5, owner_id=1), MagicMock(id=6, owner_id=1)]
+    with patch("rag.local_index.remove_chunks") as mock_remove:
+        crud.delete_document_chunks_by_document_id(db, 10)
+
+    assert "RETURNING id, owner_id" in str(db.execute.call_args.args[0])
+    db.commit.assert_called_once()
+    mock_remove.assert_called_once_with(1, [5, 6])
+
+
+def test_stale_jobs_over_max_attempts_are_failed_not_reclaimed():
+    """중단된 워커의 작업은 시도 횟수가 남아 있을 때만 다시 가져오고, 모두 쓴 작업은 실패로 기록하는지 테스트"""
+    from db import crud
+
+    db = MagicMock()
+    db.execute.return_value.scalar.return_value = None
+    assert crud.claim_next_ingestion_job(db, 1800) is None
+
+    fail_sql, claim_sql = [str(call.args[0]) for call in db.execute.call_args_list]
+    assert "status = 'failed'" in fail_sql and "attempts >= max_attempts" in fail_sql
+    assert "AND attempts < max_attempts" in claim_sql
+    db.commit.assert_called_once()
+
+
+def test_worker_bumps_corpus_version_only_when_chunks_change():
+    """처리 전에 문서가 삭제된 작업은 답변 캐시 버전을 올리지 않고, 수집한 작업은 올리는지 테스트"""
+    from worker import process_job
+
+    job = MagicMock(id=3, user_id=2, document_id=9, mode="full", file_name="a.pdf", file_path="/a.pdf", s3_key="k")
+    with patch("worker.start_heartbeat"), \
+         patch("db.crud.get_document_by_id", return_value=None), \
+         patch("db.crud.fail_ingestion_job") as mock_fail, \
+         patch("db.crud.bump_corpus_version") as mock_bump:
+        process_job(MagicMock(), job)
+    assert mock_fail.call_args.args[2] == "문서가 삭제되었습니다."
+    mock_bump.assert_not_called()
+
+    with patch("worker.start_heartbeat"), \
+         patch("worker.download_from_s3", return_value=b"content"), \
+         patch("db.database.SessionLocal"), \
+         patch("db.crud.get_document_by_id", return_value=MagicMock()), \
+         patch("db.crud.delete_document_chunks_by_document_id"), \
+         patch("db.crud.complete_ingestion_job") as mock_complete, \
+         patch("rag.document_service.ingest_document") as mock_ingest, \
+         patch("db.crud.bump_corpus_version") as mock_bump:
+        process_job(MagicMock(), job)
+    mock_ingest.assert_awaited_once()
+    mock_complete.assert_called_once()
+    assert mock_bump.call_args.args[1] == 2
+
+
+def test_ingest_document_reports_each_stage_when_its_stream_ends():
+    """'parsed'는 페이지 스트림이, 'chunked'는 청크 스트림이 끝났을 때 따로 기록되는지 테스트"""
+    import asyncio
+    from rag.document_service import ingest_document
+
+    events = []
+
+    async def pages(file_content, file_extension):
+        for page in ["첫 페이지", "둘째 페이지"]:
+            events.append(f"page:{page}")
+            yield page
+
+    async def chunks(pages, file_path, file_name):
+        async for page in pages:
+            yield [page]
+        events.append("chunking done")
+
+    async def save(db, chunk_stream, file_name, file_path, document_id=None, replace=False):
+        async for chunk_list in chunk_stream:
+            events.append(f"save:{chunk_list[0]}")
+        return document_id
+
+    with patch("rag.document_service.iter_document_pages", side_effect=pages), \
+         patch("rag.document_service.iter_chunk_documents", side_effect=chunks), \
+         patch("rag.document_service.save_stream_to_vector_store", side_effect=save):
+        asyncio.run(ingest_document(1, "a.pdf", "/a.pdf", b"", MagicMock(), on_stage=lambda stage: events.append(stage)))
+
+    assert events == [
+        "page:첫 페이지", "save:첫 페이지", "page:둘째 페이지", "save:둘째 페이지",
+        "parsed", "chunking done", "chunked", "embedded",
+    ]
+
+
+def test_running_job_heartbeat_uses_database_clock():
+    """처리 중인 작업은 하트비트 스레드가 DB 시각(now())으로 갱신 시각을 기록하는지 테스트"""
+    import threading
+    from db import crud
+    from worker import start_heartbeat
+
+    db = MagicMock()
+    crud.touch_ingestion_job(db, 7)
+    touch_sql = str(db.execute.call_args.args[0])
+    assert "updated_at=now()" in touch_sql and "status" in touch_sql
+    db.commit.assert_called_once()
+
+    touched = threading.Event()
+    with patch("db.database.SessionLocal"), \
+         patch("db.crud.touch_ingestion_job", side_effect=lambda db, job_id: touched.set()) as mock_touch:
+        stopped = start_heartbeat(7, 0.01)
+        assert touched.wait(2)
+        stopped.set()
+    assert mock_touch.call_args.args[1] == 7
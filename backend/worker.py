@@ -0,0 +1,187 @@
+"""문서 수집(ingestion) 워커.
+
+ingestion_jobs 테이블(PostgreSQL 작업 큐)에서 작업을 가져와 S3의 파일을 파싱, 청킹, 임베딩하여 저장한다.
+작업은 SELECT ... FOR UPDATE SKIP LOCKED로 가져오므로 여러 서버의 워커가 같은 큐를 나눠서 처리할 수 있다.
+
+단독 실행:
+    python worker.py            # INGESTION_WORKERS 개의 워커 프로세스 실행
+
+API 서버(main.py)는 INGESTION_RUN_IN_APP=true일 때만 워커 프로세스를 함께 실행한다.
+"""
+
+import asyncio
+import multiprocessing
+import signal
+import threading
+import time
+import traceback
+
+from dotenv import load_dotenv
+load_dotenv()
+
+
+def download_from_s3(s3_key: str) -> bytes:
+    """s3에서 파일 데이터를 가져온다."""
+    import boto3
+    from config.settings import AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_DEFAULT_REGION, S3_BUCKET_NAME
+
+    s3_client = boto3.client(
+        's3',
+        aws_access_key_id=AWS_ACCESS_KEY_ID,
+        aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+        region_name=AWS_DEFAULT_REGION
+    )
+    response = s3_client.get_object(Bucket=S3_BUCKET_NAME, Key=s3_key)
+    return response['Body'].read()
+
+
+def start_heartbeat(job_id: int, interval: float) -> threading.Event:
+    """작업이 끝날 때까지 interval초마다 작업의 갱신 시각을 기록하는 스레드를 실행하고, 멈출 때 set할 이벤트를 반환한다.
+
+    파싱이나 임베딩이 INGESTION_STALE_AFTER보다 오래 걸려도 다른 워커가 처리 중인 작업을 다시 가져가지 않도록 한다.
+    """
+    from db import crud
+    from db.database import SessionLocal
+
+    stopped = threading.Event()
+
+    def beat():
+        while not stopped.wait(interval):
+            # 작업 처리 세션과 섞이지 않도록 스레드 전용 세션을 사용한다.
+            heartbeat_db = SessionLocal()
+            try:
+                crud.touch_ingestion_job(heartbeat_db, job_id)
+            except Exception as e:
+                print(f"[worker] 작업 {job_id} 하트비트 기록 오류: {str(e)}")
+                heartbeat_db.rollback()
+            finally:
+                heartbeat_db.close()
+
+    threading.Thread(target=beat, name=f"ingestion-heartbeat-{job_id}", daemon=True).start()
+    return stopped
+
+
+def process_job(db, job):
+    """작업 하나를 처리한다."""
+    from db import crud
+    from db.database import SessionLocal
+    from config.settings import INGESTION_RETRY_DELAY, INGESTION_HEARTBEAT_INTERVAL
+    from rag.document_service import ingest_document
+
+    job_id = job.id
+    user_id = job.user_id
+    replace = job.mode == "replace"
+    print(f"[worker] 작업 {job_id} 시작: {job.file_name} (시도 {job.attempts}/{job.max_attempts}, 모드 {job.mode})")
+    heartbeat_stopped = start_heartbeat(job_id, INGESTION_HEARTBEAT_INTERVAL)
+    # 청크를 지우거나 저장하기 시작한 뒤에만 답변 캐시를 무효화한다.
+    chunks_touched = False
+    try:
+        if crud.get_document_by_id(db, job.document_id) is None:
+            # 처리 전에 문서가 삭제된 경우 재시도하지 않는다. (삭제할 때 이미 버전을 올렸다)
+            crud.fail_ingestion_job(db, job_id, "문서가 삭제되었습니다.", INGESTION_RETRY_DELAY, retry=False)
+            return
+
+        file_content = download_from_s3(job.s3_key)
+        chunks_touched = True
+
+        if not replace:
+            # 이전 시도에서 일부 저장된 청크가 있으면 삭제하고 처음부터 다시 저장한다. (임베딩은 캐시에서 재사용된다)
+            crud.delete_document_chunks_by_document_id(db, job.document_id)
+
+        # 작업 상태 변경(commit)이 청크 저장 트랜잭션에 섞이지 않도록 청크 저장에는 별도의 세션을 사용한다.
+        ingestion_db = SessionLocal()
+        try:
+            asyncio.run(ingest_document(
+                job.document_id,
+                job.file_name,
+                job.file_path,
+                file_content,
+                ingestion_db,
+                on_stage=lambda stage: crud.update_ingestion_job_stage(db, job_id, stage),
+                replace=replace
+            ))
+        finally:
+            ingestion_db.close()
+        crud.complete_ingestion_job(db, job_id)
+        print(f"[worker] 작업 {job_id} 완료: {job.file_name}")
+    except Exception as e:
+        print(f"[worker] 작업 {job_id} 실패: {str(e)}")
+        print(traceback.format_exc())
+        crud.fail_ingestion_job(db, job_id, str(e)[:2000], INGESTION_RETRY_DELAY)
+    finally:
+        heartbeat_stopped.set()
+        if chunks_touched:
+            # 청크가 추가/삭제되었으므로 사용자의 답변 캐시를 무효화한다. (실패한 경우에도 일부 청크가 바뀌었을 수 있다)
+            crud.bump_corpus_version(db, user_id)
+
+
+def run_worker(worker_index: int = 0):
+    """작업 큐가 빌 때까지 작업을 처리하고, 비어 있으면 잠시 기다렸다가 다시 조회한다."""
+    from db.database import SessionLocal
+    from db import crud
+    from config.settings import INGESTION_POLL_INTERVAL, INGESTION_STALE_AFTER
+
+    stopping = False
+
+    def handle_stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, handle_stop)
+    signal.signal(signal.SIGINT, handle_stop)
+
+    print(f"[worker {worker_index}] 시작")
+    while not stopping:
+        db = SessionLocal()
+        try:
+            job = crud.claim_next_ingestion_job(db, INGESTION_STALE_AFTER)
+            if job is None:
+                time.sleep(INGESTION_POLL_INTERVAL)
+                continue
+            process_job(db, job)
+        except Exception as e:
+            print(f"[worker {worker_index}] 작업 큐 조회 오류: {str(e)}")
+            db.rollback()
+            time.sleep(INGESTION_POLL_INTERVAL)
+        finally:
+            db.close()
+    print(f"[worker {worker_index}] 종료")
+
+
+def start_worker_pool(worker_count: int) -> list:
+    """워커 프로세스 worker_count개를 실행하고 프로세스 리스트를 반환한다."""
+    # 부모 프로세스의 DB 커넥션을 물려받지 않도록 spawn 방식으로 실행한다.
+    context = multiprocessing.get_context("spawn")
+    processes = []
+    for worker_index in range(worker_count):
+        # 워커는 파싱용 프로세스 풀을 만들어야 하므로 데몬 프로세스로 실행하지 않는다.
+        process = context.Process(target=run_worker, args=(worker_index,))
+        process.start()
+        processes.append(process)
+    return processes
+
+
+def stop_worker_pool(processes: list, timeout: float = 10):
+    """워커 프로세스를 종료한다. 처리 중인 작업은 끝난 뒤 종료된다."""
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+    for process in processes:
+        process.join(timeout)
+
+
+if __name__ == "__main__":
+    from config.settings import INGESTION_WORKERS
+
+    worker_processes = start_worker_pool(max(1, INGESTION_WORKERS))
+
+    def handle_stop(signum, frame):
+        # 컨테이너 종료(docker stop, ECS 작업 중지) 시 SIGTERM은 부모 프로세스에만 전달되므로 워커에 전달한다.
+        stop_worker_pool(worker_processes)
+
+    signal.signal(signal.SIGTERM, handle_stop)
+    try:
+        for worker_process in worker_processes:
+            worker_process.join()
+    except KeyboardInterrupt:
+        stop_worker_pool(worker_processes)